@@ -0,0 +1,384 @@
+"""
+admission.py
+
+Admission control: decides whether a chat request is let in at all.
+
+Why:
+- Nothing limited load, so a burst either used up every worker thread or
+  ran into Groq's rate limits, and then EVERY user got the "glitched"
+  fallback. It is better to turn a few requests away quickly, with a
+  Retry-After, and answer the rest properly.
+
+What this file does:
+- RateLimiter: a token bucket per client (session id, IP address).
+  A client that sends faster than its rate gets 429 Too Many Requests.
+- LLMGate / AsyncLLMGate: at most LLM_MAX_CONCURRENCY LLM calls run at
+  once per worker; others wait in a BOUNDED queue. A request is shed
+  with 503 Service Unavailable when:
+    - the queue is full, or
+    - its expected wait (queue length x recent call time) is already
+      longer than LLM_QUEUE_TIMEOUT_SECONDS, or
+    - it has waited LLM_QUEUE_TIMEOUT_SECONDS without getting a slot
+- AdmissionError carries the HTTP status and a Retry-After in seconds
+
+Important:
+- Everything here is per worker process: with 2 workers the real limits
+  are about twice the configured ones
+- RATE_LIMIT_*_PER_MINUTE=0 turns that limit off (the benchmarks do this,
+  since all their clients share one IP)
+- The per-IP bucket trusts only what the last TRUSTED_PROXY_HOPS proxies
+  wrote in X-Forwarded-For (see client_ip())
+- This file does NOT know about Flask or the LLM
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import asyncio
+import contextlib
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+# Per-session and per-IP token buckets: sustained rate and burst size.
+# Tapas types fast, but not 30 messages a minute for long.
+RATE_LIMIT_SESSION_PER_MINUTE = float(os.getenv("RATE_LIMIT_SESSION_PER_MINUTE", "30"))
+RATE_LIMIT_SESSION_BURST = int(os.getenv("RATE_LIMIT_SESSION_BURST", "8"))
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "120"))
+RATE_LIMIT_IP_BURST = int(os.getenv("RATE_LIMIT_IP_BURST", "30"))
+
+# Proxies in front of the app that append to X-Forwarded-For (Render: 1).
+# The client's IP is the entry the outermost of them added; anything to
+# its left was sent by the client and can be anything. 0 = no proxy:
+# the header is ignored and the socket peer is used.
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+# How many clients' buckets are remembered (least recently seen are dropped)
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "10000"))
+
+# Max LLM calls in flight at once, per worker process
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+
+# Max calls waiting for a slot, per worker process
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+
+# Longest a call may wait for a slot (seconds)
+LLM_QUEUE_TIMEOUT_SECONDS = float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "5"))
+
+
+# -------------------------
+# Errors
+# -------------------------
+
+class AdmissionError(Exception):
+    """
+    The request was turned away. `status` is the HTTP status to answer
+    with, `retry_after` how many seconds the client should wait.
+    """
+
+    status = 503
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"{reason} (retry after {retry_after:.1f}s)")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self):
+        """
+        Retry-After value: whole seconds, at least 1.
+        """
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class RateLimited(AdmissionError):
+    status = 429
+
+
+class Overloaded(AdmissionError):
+    status = 503
+
+
+def client_ip(forwarded_for, peer, trusted_hops=TRUSTED_PROXY_HOPS):
+    """
+    The caller's IP: the X-Forwarded-For entry added by the outermost
+    trusted proxy (`trusted_hops` from the right), else the socket peer.
+
+    Never the first entry: the client sends that one itself, so a new
+    fake IP per request would get a new IP bucket every time.
+    """
+    if forwarded_for and trusted_hops > 0:
+        entries = [entry.strip() for entry in forwarded_for.split(",") if entry.strip()]
+        if entries:
+            # Fewer entries than proxies: all of them were added by proxies
+            return entries[-min(trusted_hops, len(entries))]
+    return peer or "unknown"
+
+
+# -------------------------
+# Rate limiting
+# -------------------------
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+
+class RateLimiter:
+    """
+    One token bucket per key, refilled at `per_minute / 60` tokens per
+    second up to `burst`. Every request takes one token.
+    """
+
+    def __init__(self, per_minute, burst, max_clients=RATE_LIMIT_MAX_CLIENTS, clock=time.monotonic):
+        self.rate = per_minute / 60
+        self.burst = max(1, burst)
+        self.max_clients = max_clients
+        self._clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, key):
+        """
+        0 if the request may go ahead, else seconds until it could.
+        """
+        if not self.enabled:
+            return 0
+
+        now = self._clock()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.burst, now)
+                self._buckets[key] = bucket
+                while len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+                bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+                bucket.updated = now
+
+            if bucket.tokens >= 1:
+                bucket.tokens -= 1
+                return 0
+            return (1 - bucket.tokens) / self.rate
+
+
+class ChatRateLimiter:
+    """
+    The per-session and per-IP limits for chat requests together.
+    """
+
+    def __init__(self, on_reject=None):
+        self.sessions = RateLimiter(RATE_LIMIT_SESSION_PER_MINUTE, RATE_LIMIT_SESSION_BURST)
+        self.ips = RateLimiter(RATE_LIMIT_IP_PER_MINUTE, RATE_LIMIT_IP_BURST)
+        self._on_reject = on_reject
+
+    def check(self, session_id, ip):
+        """
+        Raises RateLimited if either the session or the IP is over its rate.
+        """
+        for reason, limiter, key in (("session_rate", self.sessions, session_id), ("ip_rate", self.ips, ip)):
+            wait = limiter.take(key)
+            if wait:
+                if self._on_reject:
+                    self._on_reject(reason)
+                raise RateLimited(reason, wait)
+
+    def stats(self):
+        return {"sessions": len(self.sessions), "ips": len(self.ips)}
+
+
+# -------------------------
+# Bounded LLM queue
+# -------------------------
+
+class _GateBase:
+    """
+    Queue bookkeeping shared by the thread and asyncio gates.
+
+    The expected wait of a new caller is (callers ahead / slots) x the
+    recent average time a call holds its slot.
+    """
+
+    # Weight of the newest call in the running average
+    SMOOTHING = 0.2
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout, on_reject, on_wait, clock):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._on_reject = on_reject
+        self._on_wait = on_wait
+        self._clock = clock
+        self._active = 0
+        self._waiting = 0
+        self._hold_seconds = None
+        self._stats_lock = threading.Lock()
+        self._rejected = 0
+
+    def _expected_wait(self):
+        if self._hold_seconds is None:
+            return 0.0
+        return (self._waiting + 1) / self.max_concurrency * self._hold_seconds
+
+    def _shed_check(self):
+        """
+        Raises Overloaded if a new caller should not even join the queue.
+        """
+        if self._active < self.max_concurrency:
+            return
+        expected = self._expected_wait()
+        if self._waiting >= self.max_queue:
+            self._reject("queue_full", expected or self.queue_timeout)
+        if expected > self.queue_timeout:
+            self._reject("deadline", expected)
+
+    def _reject(self, reason, retry_after):
+        with self._stats_lock:
+            self._rejected += 1
+        if self._on_reject:
+            self._on_reject(reason)
+        raise Overloaded(reason, retry_after)
+
+    def _observe_wait(self, seconds):
+        if self._on_wait:
+            self._on_wait(seconds)
+
+    def _observe_hold(self, seconds):
+        with self._stats_lock:
+            if self._hold_seconds is None:
+                self._hold_seconds = seconds
+            else:
+                self._hold_seconds += self.SMOOTHING * (seconds - self._hold_seconds)
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "active": self._active,
+                "waiting": self._waiting,
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "avg_call_seconds": round(self._hold_seconds or 0.0, 4),
+                "rejected": self._rejected,
+            }
+
+
+class LLMGate(_GateBase):
+    """
+    Bounded queue in front of the LLM for threads (app.py, background jobs).
+
+        gate.admit()          # fast check before any work is done
+        with gate.slot():     # waits for a free slot (or raises Overloaded)
+            ... call the LLM ...
+    """
+
+    def __init__(
+        self,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        max_queue=LLM_MAX_QUEUE,
+        queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS,
+        on_reject=None,
+        on_wait=None,
+        clock=time.monotonic,
+    ):
+        super().__init__(max_concurrency, max_queue, queue_timeout, on_reject, on_wait, clock)
+        self._cond = threading.Condition()
+
+    def admit(self):
+        """
+        Raises Overloaded if a call made now would be shed.
+        """
+        with self._cond:
+            self._shed_check()
+
+    @contextlib.contextmanager
+    def slot(self):
+        started = self._clock()
+        with self._cond:
+            self._shed_check()
+            self._waiting += 1
+            try:
+                deadline = started + self.queue_timeout
+                while self._active >= self.max_concurrency:
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        self._reject("queue_timeout", self._expected_wait() or self.queue_timeout)
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._active += 1
+
+        acquired = self._clock()
+        self._observe_wait(acquired - started)
+        try:
+            yield
+        finally:
+            self._observe_hold(self._clock() - acquired)
+            with self._cond:
+                self._active -= 1
+                self._cond.notify()
+
+
+class AsyncLLMGate(_GateBase):
+    """
+    Same as LLMGate, for asyncio (asgi.py): waiting does not block the loop.
+
+        gate.admit()
+        async with gate.slot():
+            ...
+    """
+
+    def __init__(
+        self,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        max_queue=LLM_MAX_QUEUE,
+        queue_timeout=LLM_QUEUE_TIMEOUT_SECONDS,
+        on_reject=None,
+        on_wait=None,
+        clock=time.monotonic,
+    ):
+        super().__init__(max_concurrency, max_queue, queue_timeout, on_reject, on_wait, clock)
+        self._slots = asyncio.Semaphore(max_concurrency)
+
+    def admit(self):
+        self._shed_check()
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        started = self._clock()
+        self._shed_check()
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._reject("queue_timeout", self._expected_wait() or self.queue_timeout)
+        finally:
+            self._waiting -= 1
+        self._active += 1
+
+        acquired = self._clock()
+        self._observe_wait(acquired - started)
+        try:
+            yield
+        finally:
+            self._observe_hold(self._clock() - acquired)
+            self._active -= 1
+            self._slots.release()
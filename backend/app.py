@@ -6,10 +6,22 @@ This file is the main Flask application for ArtyBot.
 What this file does:
 - Creates and runs a Flask server
 - Exposes an API endpoint for chat messages
+  (plain JSON at /chat, streamed Server-Sent Events at /chat/stream)
 - Receives user input from the frontend
 - Delegates AI logic and conversation state handling to llm.py
 - Returns AI responses back to the frontend as JSON
-- Handles the final reveal (photo + handwritten note)
+- Handles the final reveal (photo + handwritten note). The reveal fields
+  are encoded once per persona, when it is loaded (see personas.py), and
+  the last few replies before it tell the frontend to start loading the
+  photo (see reveal_photo.py)
+- Serves several personas: /p/<name>/chat and /p/<name>/chat/stream, or
+  an X-Persona header; plain /chat is the default persona
+- Exposes Prometheus metrics at /metrics (see metrics.py)
+- Liveness (/livez) and readiness (/readyz) checks: a worker is ready
+  once its LLM connection is warmed up (see startup.py)
+- Turns away excess load with 429 / 503 + Retry-After (see admission.py)
+- Serves /static with ETags, byte ranges, precompressed variants and
+  long-lived caching for fingerprinted files (see static_files.py)
 
 Important:
 - This file does NOT talk directly to the LLM
@@ -20,39 +32,101 @@ Important:
 # -------------------------
 # Import standard libraries
 # -------------------------
-from flask import Flask, request, jsonify
+import json
+import os
+import time
+
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 
+import metrics
+import tracing
+from admission import AdmissionError, ChatRateLimiter, client_ip
+from startup import readiness, warm_up
+from static_files import CHUNK_SIZE, StaticFiles
+
 # -------------------------
 # Import our own LLM logic
 # -------------------------
 # This file will contain:
-# - conversation stage tracking
+# - conversation stage tracking (per session, see session_store.py)
 # - Hugging Face API calls
-from llm import process_user_message
+from llm import (
+    async_llm_gate,
+    conversation_history,
+    in_flight,
+    llm_client,
+    llm_gate,
+    process_user_message,
+    process_user_message_stream,
+    persona_registry,
+    reply_cache,
+    stages_left,
+    transcript_log,
+)
+from idempotency import is_valid_idempotency_key
+from personas import UnknownPersona
+from session_store import DEFAULT_SESSION_ID, is_valid_session_id
 
 # -------------------------
 # Initialize Flask app
 # -------------------------
-app = Flask(__name__)
+# /static is served by static_files.py below, not by Flask's default view
+app = Flask(__name__, static_folder=None)
 
 # Enable CORS so frontend (Netlify) can talk to backend (Render)
 CORS(app)
 
 # -------------------------
-# Constants for final reveal
+# Request timing (see metrics.py)
 # -------------------------
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-# Path to your final photo (served via Flask static folder)
-FINAL_PHOTO_URL = "/static/final_photo.jpg"
 
-# Your handwritten / typed note
-FINAL_NOTE_TEXT = """
-My text
+@app.after_request
+def observe_request(response):
+    started = g.get("request_started")
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.REQUEST_SECONDS.labels(route).observe(time.perf_counter() - started)
+    return response
 
-Love,
-Arty
-"""
+# -------------------------
+# Admission control (see admission.py)
+# -------------------------
+
+# Per-session and per-IP token buckets for the chat routes
+rate_limiter = ChatRateLimiter(on_reject=metrics.record_rejection)
+
+
+def admission_error_payload(error):
+    """
+    (JSON body, headers) for a 429 / 503. retry_after is in the body too,
+    because browsers hide Retry-After from cross-origin scripts.
+    """
+    message = "Too many messages, slow down a little" if error.status == 429 else "ArtyBot is busy right now"
+    return (
+        {"error": message, "reason": error.reason, "retry_after": int(error.retry_after_header)},
+        {"Retry-After": error.retry_after_header},
+    )
+
+
+@app.errorhandler(AdmissionError)
+def admission_rejected(error):
+    body, headers = admission_error_payload(error)
+    return jsonify(body), error.status, headers
+
+# -------------------------
+# Final reveal
+# -------------------------
+
+# Each persona's photo, note and reveal stage are in its persona.json
+# (personas/artija/persona.json for Artija, see personas.py)
+
+# Start loading the photo this many messages before the reveal
+REVEAL_PRELOAD_STAGES = int(os.getenv("REVEAL_PRELOAD_STAGES", "2"))
 
 # -------------------------
 # Health check route
@@ -63,26 +137,236 @@ def health_check():
     Simple route to check if backend is running.
     Useful for debugging and Render health checks.
     """
-    return jsonify({"status": "ArtyBot backend is alive 💖"})
+    return jsonify(health_payload())
+
+
+def health_payload():
+    return {
+        "status": "ArtyBot backend is alive 💖",
+        "prompt": persona_registry.default().prompts.stats(),
+        "prompt_version": persona_registry.default().prompts.current().version,
+        "rituals": persona_registry.default().rituals.stats(),
+        "personas": persona_registry.stats(),
+        "reply_cache": reply_cache.stats.as_dict(),
+        "llm": llm_client.stats(),
+        "history": conversation_history.stats(),
+        "single_flight": in_flight.stats(),
+        "admission": {
+            "rate_limiter": rate_limiter.stats(),
+            "llm_queue": llm_gate.stats(),
+            "llm_queue_async": async_llm_gate.stats(),
+        },
+        "traces": tracing.writer.stats(),
+        "transcripts": transcript_log.stats(),
+        "startup": readiness.stats(),
+    }
+
+
+# -------------------------
+# Liveness / readiness
+# -------------------------
+@app.route("/livez", methods=["GET"])
+def liveness_check():
+    """
+    The process is up and answering. Cheap: no state is touched.
+    """
+    return jsonify({"status": "alive"})
+
+
+@app.route("/readyz", methods=["GET"])
+def readiness_check():
+    """
+    200 once this worker has warmed up (startup.py), 503 before.
+    Point Render's health check here to keep cold workers out of rotation.
+    """
+    return jsonify(readiness.stats()), 200 if readiness.ready else 503
+
+
+# -------------------------
+# Metrics route (Prometheus text format)
+# -------------------------
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """
+    Latency histograms, token usage, LLM errors / fallbacks and the stage
+    distribution, added up across all gunicorn workers.
+    """
+    body, content_type = metrics.render_metrics()
+    return Response(body, content_type=content_type)
+
+
+# -------------------------
+# Static files (final photo, media)
+# -------------------------
+static_files = StaticFiles()
+
+
+@app.route("/static/<path:filename>", methods=["GET", "HEAD"])
+def static_file(filename):
+    """
+    Conditional (304), ranged (206) and precompressed responses for
+    everything in STATIC_DIR. See static_files.py.
+    """
+    result = static_files.respond(request.method, filename, request.headers.get)
+    if result.path is None:
+        return Response(status=result.status, headers=result.headers)
+
+    f = result.open()
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    if file_wrapper is not None:
+        # gunicorn sends this with sendfile(), from the file's current
+        # position for Content-Length bytes: no copy through Python
+        body = file_wrapper(f, CHUNK_SIZE)
+    else:
+        body = result.iter_body(f)
+
+    response = Response(body, status=result.status, headers=result.headers, direct_passthrough=True)
+    response.call_on_close(f.close)
+    return response
+
+
+# -------------------------
+# Request parsing (shared by /chat, /chat/stream and asgi.py)
+# -------------------------
+def validate_chat_payload(data):
+    """
+    Checks the chat request JSON (already decoded).
+
+    Returns (user_message, session_id, error_text).
+    error_text is None when the payload is fine.
+    """
+
+    # Safety check: ensure message exists
+    if not isinstance(data, dict) or "message" not in data:
+        return None, None, "No message provided"
+
+    user_message = data["message"]
+    if not isinstance(user_message, str):
+        return None, None, "message must be a string"
+
+    # Each browser keeps its own conversation stage.
+    # Old clients without a session id share the default session.
+    session_id = data.get("session_id") or DEFAULT_SESSION_ID
+    if not is_valid_session_id(session_id):
+        return None, None, "Invalid session_id"
+
+    return user_message, session_id, None
+
+
+def validate_idempotency_key(value):
+    """
+    Checks the optional Idempotency-Key header.
+
+    Returns (idempotency_key, error_text). Both are None when the header
+    is missing: the request is simply not replayable.
+    """
+    if value is None:
+        return None, None
+    if not is_valid_idempotency_key(value):
+        return None, "Invalid Idempotency-Key"
+    return value, None
+
+
+def resolve_persona(route_name, header_name):
+    """
+    The persona a chat request is for: the /p/<name>/ route, else the
+    X-Persona header, else the default one.
+
+    Returns (persona, error_text).
+    """
+    try:
+        return persona_registry.get(route_name or header_name or None), None
+    except UnknownPersona:
+        return None, "Unknown persona"
+
+
+def parse_chat_request(persona_name=None):
+    """
+    Reads the chat request JSON and headers from the current Flask request.
+
+    Returns (user_message, session_id, persona, idempotency_key, error_response).
+    error_response is None when the request is fine.
+    """
+    persona, error_text = resolve_persona(persona_name, request.headers.get("X-Persona"))
+    if error_text:
+        return None, None, None, None, (jsonify({"error": error_text}), 404)
+
+    user_message, session_id, error_text = validate_chat_payload(request.get_json(silent=True))
+    if not error_text:
+        idempotency_key, error_text = validate_idempotency_key(request.headers.get("Idempotency-Key"))
+    if error_text:
+        return None, None, None, None, (jsonify({"error": error_text}), 400)
+
+    # Raises RateLimited (→ 429, see admission_rejected).
+    # Per persona: the same browser talking to two personas gets two budgets.
+    rate_limiter.check(
+        persona.session_key(session_id), client_ip(request.headers.get("X-Forwarded-For"), request.remote_addr)
+    )
+
+    return user_message, session_id, persona, idempotency_key, None
+
+
+def sse_event(event, data):
+    """
+    Formats one Server-Sent Event frame.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def final_reveal_body(ai_reply, persona):
+    """
+    /chat's final-reveal JSON body: {"reply": ..., **persona.reveal_payload}.
+    The reveal fields were encoded once, when the persona was loaded.
+    """
+    return f'{{"reply": {json.dumps(ai_reply, ensure_ascii=False)}, {persona.reveal_fields}}}'
+
+
+def reveal_preload(session_id, persona):
+    """
+    persona.reveal_preload when this session's reveal is at most
+    REVEAL_PRELOAD_STAGES messages away, else None.
+    """
+    if stages_left(session_id, persona) <= REVEAL_PRELOAD_STAGES:
+        return persona.reveal_preload
+    return None
+
+
+def done_payload(preload):
+    """
+    The end of a normal (not final) reply: {"is_final": false}, plus
+    "preload" when the reveal is close.
+    """
+    if preload is None:
+        return {"is_final": False}
+    return {"is_final": False, "preload": preload}
 
 
 # -------------------------
 # Chat API route
 # -------------------------
 @app.route("/chat", methods=["POST"])
-def chat():
+@app.route("/p/<persona>/chat", methods=["POST"])
+@tracing.traced("/chat")
+def chat(persona=None):
     """
-    Main chat endpoint.
+    Main chat endpoint. /p/<persona>/chat (or an X-Persona header) talks
+    to another persona than the default one; unknown ones get a 404.
 
     Expected request JSON:
     {
-        "message": "user's message text"
+        "message": "user's message text",
+        "session_id": "random id generated by the browser"   (optional)
     }
 
+    Optional header:
+    - Idempotency-Key: one random id per message typed. A retry with the
+      same key gets the stored reply back, without advancing the stage.
+
     Response JSON (normal chat):
     {
         "reply": "AI response text",
-        "is_final": false
+        "is_final": false,
+        "preload": {"photo": {...}}     (only close to the reveal)
     }
 
     Response JSON (final reveal):
@@ -90,6 +374,8 @@ def chat():
         "reply": "final AI message",
         "is_final": true,
         "photo_url": "/static/final_photo.jpg",
+        "photo": {"src", "sources", "sizes", "placeholder", ...},
+                                        (when reveal_photo.py built them)
         "note": "handwritten note text"
     }
     """
@@ -97,13 +383,10 @@ def chat():
     # -------------------------
     # Parse incoming request
     # -------------------------
-    data = request.get_json()
-
-    # Safety check: ensure message exists
-    if not data or "message" not in data:
-        return jsonify({"error": "No message provided"}), 400
-
-    user_message = data["message"]
+    with tracing.span("parse"):
+        user_message, session_id, persona, idempotency_key, error = parse_chat_request(persona)
+    if error:
+        return error
 
     # -------------------------
     # Delegate logic to llm.py
@@ -116,7 +399,7 @@ def chat():
     # 1. ai_reply → the text that ArtyBot should say next
     # 2. is_final_stage → True if it's time to show the photo + note
     '''
-    ai_reply, is_final_stage = process_user_message(user_message)
+    ai_reply, is_final_stage = process_user_message(user_message, session_id, idempotency_key, persona)
 
     # -------------------------
     # Normal chat response
@@ -134,10 +417,13 @@ def chat():
     # - keep the chat UI active
     '''
     if not is_final_stage:
-        return jsonify({
-            "reply": ai_reply,
-            "is_final": False
-        })
+        # A message or two before the reveal, "preload" lets the photo load now
+        preload = reveal_preload(session_id, persona)
+        with metrics.ENCODE_SECONDS.time(), tracing.span("encode"):
+            return jsonify({
+                "reply": ai_reply,
+                **done_payload(preload)
+            })
 
     # -------------------------
     # Final reveal response
@@ -149,19 +435,94 @@ def chat():
     # We send back:
     # - the final AI message
     # - a flag telling frontend: "conversation is over"
-    # - the URL of your photo
+    # - the URL of your photo (and its responsive variants)
     # - your handwritten / typed note
     #
     # The frontend will:
     # - stop the chat input
     # - display the photo
     # - display the note beneath it
-    return jsonify({
-        "reply": ai_reply,              # Final message from ArtyBot
-        "is_final": True,               # Triggers final reveal UI
-        "photo_url": FINAL_PHOTO_URL,   # Your photo
-        "note": FINAL_NOTE_TEXT         # Your signed note
-    })
+    with metrics.ENCODE_SECONDS.time(), tracing.span("encode"):
+        return Response(final_reveal_body(ai_reply, persona), mimetype="application/json")
+
+
+# -------------------------
+# Streaming chat API route
+# -------------------------
+@app.route("/chat/stream", methods=["POST"])
+@app.route("/p/<persona>/chat/stream", methods=["POST"])
+def chat_stream(persona=None):
+    """
+    Same as /chat, but the reply is streamed as Server-Sent Events.
+
+    Expected request JSON / headers: same as /chat
+
+    Events:
+    - "token" → {"text": "next piece of the reply"}      (many)
+    - "done"  → {"is_final": false, "preload"?}         (last, normal chat)
+    - "final" → {"is_final": true, "photo_url", "note"} (last, final reveal)
+    - "busy"  → {"error", "reason", "retry_after"}      (instead of any
+                token, when the LLM queue timed out after the stream began)
+
+    Requests turned away before the stream starts get a plain 429 / 503.
+
+    The frontend appends every token to the bot bubble as it arrives,
+    so the user sees the first words without waiting for the full reply.
+    """
+
+    trace = tracing.start("/chat/stream")
+    try:
+        with tracing.span("parse"):
+            user_message, session_id, persona, idempotency_key, error = parse_chat_request(persona)
+        if error:
+            tracing.finish(trace)
+            return error
+
+        reply_pieces, is_final_stage = process_user_message_stream(
+            user_message, session_id, idempotency_key, persona
+        )
+    except AdmissionError:
+        tracing.finish(trace)
+        raise
+
+    try:
+        preload = None if is_final_stage else reveal_preload(session_id, persona)
+    except BaseException:
+        reply_pieces.close()
+        tracing.finish(trace)
+        raise
+
+    def generate():
+        # Runs after chat_stream() has returned, so the trace is picked
+        # up again here and finished once the last event is sent
+        tracing.use(trace)
+        try:
+            for text in reply_pieces:
+                yield sse_event("token", {"text": text})
+
+            # Terminal event: tells the frontend the reply is complete
+            if is_final_stage:
+                yield persona.reveal_event
+            else:
+                yield sse_event("done", done_payload(preload))
+        except AdmissionError as error:
+            yield sse_event("busy", admission_error_payload(error)[0])
+        finally:
+            tracing.finish(trace)
+
+    response = Response(
+        generate(),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Stops proxies (Render, nginx) from buffering the whole stream
+            "X-Accel-Buffering": "no",
+        },
+    )
+    # The client may leave before generate() starts: closing the reply
+    # stream lets duplicates of this request stop waiting for it
+    response.call_on_close(reply_pieces.close)
+    return response
 
 
 
@@ -173,4 +534,5 @@ if __name__ == "__main__":
     Run the Flask app locally.
     In production (Render), Gunicorn will run the app instead.
     """
+    warm_up()
     app.run(debug=True)
@@ -0,0 +1,391 @@
+"""
+asgi.py
+
+Async (ASGI) entry point for ArtyBot.
+
+What this file does:
+- Serves the same API as app.py (/, /chat, /chat/stream, /metrics,
+  /static, and /p/<persona>/chat...) without Flask
+- Plus the WebSocket chat channel at /ws and /p/<persona>/ws (see
+  ws_chat.py; uvicorn needs the `websockets` package for it)
+- Awaits Groq with the async client, so a slow LLM call does NOT pin a
+  worker thread: one worker can hold many conversations at once
+- Answers CORS preflights the same way flask-cors does for app.py
+- Applies the same admission control as app.py (429 / 503 + Retry-After)
+- Warms up the LLM connections at lifespan startup (see startup.py), and
+  serves /livez and /readyz like app.py
+
+How to run:
+- Locally:     uvicorn asgi:app
+- On Render:   GUNICORN_WORKER_CLASS=uvicorn.workers.UvicornWorker \\
+               gunicorn -c gunicorn.conf.py asgi:app
+
+Important:
+- Request validation and the (prebuilt) final-reveal responses come from app.py,
+  so both entry points always answer the same way
+- AI logic lives in llm.py, as usual
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import asyncio
+import json
+import time
+
+import metrics
+import tracing
+import ws_chat
+from admission import AdmissionError, client_ip
+from app import (
+    admission_error_payload,
+    done_payload,
+    final_reveal_body,
+    health_payload,
+    rate_limiter,
+    resolve_persona,
+    reveal_preload,
+    sse_event,
+    static_files,
+    validate_chat_payload,
+    validate_idempotency_key,
+)
+from llm import process_user_message_async, process_user_message_stream_async
+from startup import readiness, warm_up, warm_up_async
+
+
+# Requests bigger than this are rejected (a chat message is tiny)
+MAX_BODY_BYTES = 64 * 1024
+
+CORS_HEADERS = [
+    (b"access-control-allow-origin", b"*"),
+]
+
+# Routes of another persona than the default one: /p/<persona>/chat...
+PERSONA_PREFIX = "/p/"
+
+
+# -------------------------
+# Small ASGI helpers
+# -------------------------
+
+async def read_body(receive):
+    """
+    Reads the full request body (or None if it is too big).
+    """
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BODY_BYTES:
+            return None
+        if not message.get("more_body"):
+            return body
+
+
+async def send_json(send, data, status=200, headers=()):
+    with metrics.ENCODE_SECONDS.time(), tracing.span("encode"):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    await send_json_bytes(send, payload, status, headers)
+
+
+async def send_json_bytes(send, payload, status=200, headers=()):
+    """
+    Sends an already encoded JSON body.
+    """
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+            *CORS_HEADERS,
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def send_preflight(scope, send):
+    requested = dict(scope["headers"]).get(b"access-control-request-headers", b"content-type")
+    await send({
+        "type": "http.response.start",
+        "status": 204,
+        "headers": [
+            *CORS_HEADERS,
+            (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+            (b"access-control-allow-headers", requested),
+        ],
+    })
+    await send({"type": "http.response.body", "body": b""})
+
+
+def split_persona(path):
+    """
+    "/p/<persona>/chat" → ("<persona>", "/chat"); any other path → (None, path).
+    """
+    if not path.startswith(PERSONA_PREFIX):
+        return None, path
+    name, slash, rest = path[len(PERSONA_PREFIX):].partition("/")
+    if not name or not slash:
+        return None, path
+    return name, "/" + rest
+
+
+def header_value(scope, name):
+    value = dict(scope["headers"]).get(name)
+    return value.decode("latin-1") if value is not None else None
+
+
+async def read_chat_payload(scope, receive, send):
+    """
+    Finds the persona (see app.resolve_persona), reads and validates the
+    chat JSON and the Idempotency-Key header, then applies the rate
+    limits (raises RateLimited).
+
+    Returns (user_message, session_id, persona, idempotency_key), or
+    (None, None, None, None) after an error response has already been sent.
+    """
+    persona, error_text = resolve_persona(split_persona(scope["path"])[0], header_value(scope, b"x-persona"))
+    if error_text:
+        await send_json(send, {"error": error_text}, status=404)
+        return None, None, None, None
+
+    body = await read_body(receive)
+    if body is None:
+        await send_json(send, {"error": "Request too large"}, status=413)
+        return None, None, None, None
+
+    try:
+        data = json.loads(body) if body else None
+    except ValueError:
+        data = None
+
+    user_message, session_id, error_text = validate_chat_payload(data)
+    headers = dict(scope["headers"])
+    if not error_text:
+        header = headers.get(b"idempotency-key")
+        idempotency_key, error_text = validate_idempotency_key(
+            header.decode("latin-1") if header is not None else None
+        )
+    if error_text:
+        await send_json(send, {"error": error_text}, status=400)
+        return None, None, None, None
+
+    forwarded_for = headers.get(b"x-forwarded-for")
+    peer = scope.get("client") or (None,)
+    rate_limiter.check(
+        persona.session_key(session_id), client_ip(forwarded_for and forwarded_for.decode("latin-1"), peer[0])
+    )
+
+    return user_message, session_id, persona, idempotency_key
+
+
+async def send_admission_error(send, error):
+    """
+    429 / 503 with Retry-After, same body as app.py.
+    """
+    body, headers = admission_error_payload(error)
+    await send_json(
+        send,
+        body,
+        status=error.status,
+        headers=[(key.lower().encode(), value.encode()) for key, value in headers.items()],
+    )
+
+
+# -------------------------
+# Routes
+# -------------------------
+
+@tracing.traced("/chat")
+async def chat(scope, receive, send):
+    with tracing.span("parse"):
+        user_message, session_id, persona, idempotency_key = await read_chat_payload(scope, receive, send)
+    if user_message is None:
+        return
+
+    ai_reply, is_final_stage = await process_user_message_async(
+        user_message, session_id, idempotency_key, persona
+    )
+
+    if not is_final_stage:
+        await send_json(send, {"reply": ai_reply, **done_payload(reveal_preload(session_id, persona))})
+    else:
+        with metrics.ENCODE_SECONDS.time(), tracing.span("encode"):
+            body = final_reveal_body(ai_reply, persona).encode("utf-8")
+        await send_json_bytes(send, body)
+
+
+@tracing.traced("/chat/stream")
+async def chat_stream(scope, receive, send):
+    with tracing.span("parse"):
+        user_message, session_id, persona, idempotency_key = await read_chat_payload(scope, receive, send)
+    if user_message is None:
+        return
+
+    reply_pieces, is_final_stage = await process_user_message_stream_async(
+        user_message, session_id, idempotency_key, persona
+    )
+    try:
+        await _stream_reply(send, reply_pieces, is_final_stage, session_id, persona)
+    finally:
+        # Not read to the end (client gone, preload failed): see llm.py
+        await reply_pieces.aclose()
+
+
+async def _stream_reply(send, reply_pieces, is_final_stage, session_id, persona):
+    preload = None if is_final_stage else reveal_preload(session_id, persona)
+
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [
+            (b"content-type", b"text/event-stream; charset=utf-8"),
+            (b"cache-control", b"no-cache"),
+            (b"x-accel-buffering", b"no"),
+            *CORS_HEADERS,
+        ],
+    })
+
+    try:
+        async for text in reply_pieces:
+            await send({
+                "type": "http.response.body",
+                "body": sse_event("token", {"text": text}).encode("utf-8"),
+                "more_body": True,
+            })
+    except AdmissionError as error:
+        # Headers are already out: tell the client in-band (see app.py)
+        last = sse_event("busy", admission_error_payload(error)[0]).encode("utf-8")
+    else:
+        if is_final_stage:
+            last = persona.reveal_event.encode("utf-8")
+        else:
+            last = sse_event("done", done_payload(preload)).encode("utf-8")
+    await send({"type": "http.response.body", "body": last})
+
+
+async def metrics_endpoint(scope, receive, send):
+    body, content_type = metrics.render_metrics()
+    await send({
+        "type": "http.response.start",
+        "status": 200,
+        "headers": [(b"content-type", content_type.encode()), *CORS_HEADERS],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def static_file(scope, receive, send):
+    """
+    Same responses as app.py's static_file(), see static_files.py.
+    """
+    headers = dict(scope["headers"])
+
+    def header(name):
+        value = headers.get(name.lower().encode())
+        return value.decode("latin-1") if value is not None else None
+
+    result = static_files.respond(scope["method"], scope["path"][len("/static/"):], header)
+    await send({
+        "type": "http.response.start",
+        "status": result.status,
+        "headers": [(key.lower().encode(), value.encode()) for key, value in result.headers] + CORS_HEADERS,
+    })
+    if result.path is None:
+        await send({"type": "http.response.body", "body": b""})
+        return
+
+    with result.open() as f:
+        if "http.response.zerocopysend" in scope.get("extensions", {}):
+            await send({
+                "type": "http.response.zerocopysend",
+                "file": f,
+                "offset": result.start,
+                "count": result.length,
+            })
+            return
+        for chunk in result.iter_body(f):
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def readiness_check(scope, receive, send):
+    await send_json(send, readiness.stats(), status=200 if readiness.ready else 503)
+
+
+ROUTES = {
+    ("GET", "/"): lambda scope, receive, send: send_json(send, {**health_payload(), "websocket": ws_chat.stats()}),
+    ("GET", "/livez"): lambda scope, receive, send: send_json(send, {"status": "alive"}),
+    ("GET", "/readyz"): readiness_check,
+    ("GET", "/metrics"): metrics_endpoint,
+    ("POST", "/chat"): chat,
+    ("POST", "/chat/stream"): chat_stream,
+}
+
+
+# -------------------------
+# ASGI application
+# -------------------------
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # gunicorn has already run warm_up() (gunicorn.conf.py);
+                # plain `uvicorn asgi:app` has not
+                if not readiness.ready:
+                    await asyncio.to_thread(warm_up)
+                await warm_up_async()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    if scope["type"] == "websocket":
+        persona_name, path = split_persona(scope["path"])
+        if path == "/ws":
+            await ws_chat.serve(scope, receive, send, persona_name)
+        else:
+            await ws_chat.reject(send)
+        return
+
+    if scope["type"] != "http":
+        return
+
+    method = scope["method"]
+    # /p/<persona>/chat is /chat; read_chat_payload() looks the persona up
+    persona_name, path = split_persona(scope["path"])
+
+    if method == "OPTIONS":
+        await send_preflight(scope, send)
+        return
+
+    # Under /p/<persona>/ only the chat routes exist (as in app.py):
+    # static files, health and metrics are served from the root only
+    if persona_name is None:
+        handler = ROUTES.get((method, path))
+        if handler is None and method in ("GET", "HEAD") and path.startswith("/static/"):
+            handler = static_file
+    else:
+        handler = ROUTES.get((method, path)) if path.startswith("/chat") else None
+    if handler is None:
+        await send_json(send, {"error": "Not found"}, status=404)
+        return
+
+    started = time.perf_counter()
+    try:
+        await handler(scope, receive, send)
+    except AdmissionError as error:
+        # Rate limited or shed before the response started
+        await send_admission_error(send, error)
+    # One label for all static files and one per persona route, like
+    # app.py's url_rule
+    if handler is static_file:
+        route = "/static/<path:filename>"
+    elif persona_name is not None:
+        route = "/p/<persona>" + path
+    else:
+        route = path
+    metrics.REQUEST_SECONDS.labels(route).observe(time.perf_counter() - started)
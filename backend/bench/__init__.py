@@ -0,0 +1,11 @@
+"""
+bench/
+
+Benchmarks for the ArtyBot backend.
+
+Run them from the backend/ folder, e.g.:
+
+    python -m bench.prompt_assembly
+
+They never call the real LLM.
+"""
@@ -0,0 +1,147 @@
+"""
+bench/cold_start.py
+
+How long a cold worker takes to become ready, and what its first chat
+request costs.
+
+Two parts:
+- import profile: `python -X importtime -c "import app"` in a fresh
+  interpreter, with the self time of every module added up per top-level
+  package. Fails if the groq SDK is imported at import time (it should
+  only be imported by the warm-up, see startup.py).
+- cold start: starts gunicorn (one worker) against the local fake Groq
+  server (bench/fake_groq_server.py) and measures the time until /readyz
+  answers 200, then the latency of the first /chat. Runs with the
+  warm-up off, on, and on with GUNICORN_PRELOAD=1.
+
+The fake server is plain HTTP on localhost, so the TLS handshake a real
+cold start saves is NOT in these numbers: they show the import and
+client creation part.
+
+Usage (from backend/):
+
+    python -m bench.cold_start [--top 12]
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import http.client
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from bench.common import BACKEND_DIR, running_server
+from bench.fake_groq_server import start_server
+
+
+_IMPORT_LINE_RE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)$")
+
+# A chat message that needs the LLM (not a ritual, not a cached opener)
+FIRST_MESSAGE = "tell me about the first time we went to the lake together"
+
+MODES = [
+    ("warm-up off", {"STARTUP_WARMUP": "0"}),
+    ("warm-up on", {"STARTUP_WARMUP": "1"}),
+    ("warm-up on + preload", {"STARTUP_WARMUP": "1", "GUNICORN_PRELOAD": "1"}),
+]
+
+
+# -------------------------
+# Import profile
+# -------------------------
+
+def import_profile(module="app", **env):
+    """
+    (total seconds, {top-level package: self seconds}) for importing `module`.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR,
+        env=dict(os.environ, **env),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+        check=True,
+    )
+    packages = defaultdict(float)
+    total = 0.0
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE_RE.match(line)
+        if not match:
+            continue
+        self_us, cumulative_us, indent, name = match.groups()
+        packages[name.split(".")[0]] += int(self_us) / 1e6
+        if name == module and not indent:
+            total = int(cumulative_us) / 1e6
+    return total, packages
+
+
+# -------------------------
+# Cold start
+# -------------------------
+
+def first_chat_seconds(port):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    body = json.dumps({"message": FIRST_MESSAGE, "session_id": "cold-start-bench"})
+    started = time.perf_counter()
+    conn.request("POST", "/chat", body=body, headers={"Content-Type": "application/json"})
+    response = conn.getresponse()
+    response.read()
+    return time.perf_counter() - started, response.status
+
+
+def cold_start(groq_url, env):
+    started = time.perf_counter()
+    with running_server(
+        "app:app",
+        LLM_BACKEND="groq",
+        GROQ_API_KEY="fake",
+        GROQ_BASE_URL=groq_url,
+        WEB_CONCURRENCY=1,
+        **env,
+    ) as port:
+        ready = time.perf_counter() - started
+        first, status = first_chat_seconds(port)
+        second, _ = first_chat_seconds(port)
+    return ready, first, second, status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--top", type=int, default=12, help="packages to list in the import profile")
+    args = parser.parse_args()
+
+    failures = []
+
+    total, packages = import_profile("app", LLM_BACKEND="groq", GROQ_API_KEY="fake")
+    print(f"import app: {total * 1000:.0f} ms")
+    for name, seconds in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {name:28} {seconds * 1000:8.1f} ms")
+    if "groq" in packages:
+        failures.append("the groq SDK is imported at import time")
+
+    server, _ = start_server()
+    groq_url = f"http://127.0.0.1:{server.server_address[1]}"
+    try:
+        print(f"\n{'mode':24} {'ready':>9} {'1st chat':>9} {'2nd chat':>9}")
+        for name, env in MODES:
+            ready, first, second, status = cold_start(groq_url, env)
+            print(f"{name:24} {ready * 1000:7.0f}ms {first * 1000:7.0f}ms {second * 1000:7.0f}ms")
+            if status != 200:
+                failures.append(f"{name}: first /chat answered {status}")
+    finally:
+        server.shutdown()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+bench/common.py
+
+Shared helpers for the benchmarks: starting the server, driving load,
+latency percentiles, and saving / comparing JSON results.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import contextlib
+import http.client
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(BACKEND_DIR, "bench", "results")
+
+# Environment for a server that never talks to Groq.
+# Rate limits are off: every benchmark client comes from 127.0.0.1.
+STUB_ENV = {
+    "LLM_BACKEND": "stub",
+    "GUNICORN_ACCESSLOG": "",
+    "RATE_LIMIT_SESSION_PER_MINUTE": "0",
+    "RATE_LIMIT_IP_PER_MINUTE": "0",
+}
+
+
+# -------------------------
+# Server
+# -------------------------
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def wait_until_up(port, timeout=30, interval=0.2):
+    """
+    Waits until the server reports ready (/readyz → 200).
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/readyz")
+            response = conn.getresponse()
+            response.read()
+            if response.status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(interval)
+    raise RuntimeError(f"server on port {port} did not come up")
+
+
+@contextlib.contextmanager
+def running_server(app_path="app:app", **env):
+    """
+    Runs `gunicorn -c gunicorn.conf.py <app_path>` from backend/ with the
+    stub LLM backend, and yields its port once it answers.
+    """
+    port = free_port()
+
+    # Its own transcript file: benchmark session ids repeat from run to
+    # run, and sessions recorded by an earlier run would be restored
+    transcript_db = os.path.join(tempfile.gettempdir(), f"artybot-transcripts-{port}.db")
+    server_env = dict(os.environ, **STUB_ENV, PORT=str(port), TRANSCRIPT_DB_PATH=transcript_db)
+    server_env.update({key: str(value) for key, value in env.items()})
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", app_path],
+        cwd=BACKEND_DIR,
+        env=server_env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_up(port)
+        yield port
+    finally:
+        server.send_signal(signal.SIGTERM)
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # gthread waits for idle keep-alive clients during a graceful stop
+            server.kill()
+            server.wait()
+        for suffix in ("", "-wal", "-shm"):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(transcript_db + suffix)
+
+
+# -------------------------
+# Load
+# -------------------------
+
+def drive_load(port, concurrency, duration, next_request, path="/chat", on_result=None):
+    """
+    `concurrency` keep-alive clients POSTing to `path` back-to-back.
+
+    next_request(client_index, request_index) → JSON body (dict)
+    on_result(client_index, request_index, seconds, ok) → optional, called
+    after every request (e.g. to split latencies by message category)
+
+    Returns (latencies in seconds, error count, wall-clock seconds).
+    """
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + duration
+
+    def client(n):
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        i = 0
+        while time.monotonic() < deadline:
+            body = json.dumps(next_request(n, i))
+            i += 1
+            start = time.perf_counter()
+            try:
+                conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                response.read()
+                ok = response.status == 200
+            except (OSError, http.client.HTTPException):
+                ok = False
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+                if on_result is not None:
+                    on_result(n, i - 1, elapsed, ok)
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.monotonic() - started
+
+
+# -------------------------
+# Stats
+# -------------------------
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def latency_summary(latencies, elapsed, errors=0):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+# -------------------------
+# Results
+# -------------------------
+
+def save_results(path, results):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"results saved to {path}")
+
+
+def compare_results(current, baseline, max_regression, higher_is_better=("rps",), ignore=("requests", "errors")):
+    """
+    Compares two {metric: value} dicts (nested dicts are walked).
+
+    A metric regresses when it gets worse by more than `max_regression`
+    (a fraction: 0.10 = 10%). Metrics named in `higher_is_better` regress
+    when they go DOWN, all others when they go UP. Plain counts named in
+    `ignore` are not compared.
+
+    Prints a table and returns the list of regressed metric names.
+    """
+    regressions = []
+
+    def walk(cur, base, prefix):
+        for key, value in cur.items():
+            name = f"{prefix}{key}"
+            if isinstance(value, dict):
+                if isinstance(base.get(key), dict):
+                    walk(value, base[key], f"{name}.")
+                continue
+            old = base.get(key)
+            if key in ignore:
+                continue
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+
+            change = (value - old) / old
+            worse = -change if key in higher_is_better else change
+            flag = "REGRESSION" if worse > max_regression else ""
+            if flag:
+                regressions.append(name)
+            print(f"  {name:45} {old:12.3f} → {value:12.3f}  ({change:+7.1%}) {flag}")
+
+    walk(current, baseline, "")
+    return regressions
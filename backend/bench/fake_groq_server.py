@@ -0,0 +1,244 @@
+"""
+bench/fake_groq_server.py
+
+A local fake of Groq's OpenAI-compatible chat API, with fault injection.
+
+What it serves:
+- POST /openai/v1/chat/completions   (normal and stream=true, like Groq)
+- POST /_faults   → change the injected faults (JSON, see FAULT_DEFAULTS)
+- GET  /_stats    → how many requests each model received
+
+Faults (globally, or per model under "models": {"<model>": {...}}):
+- latency_ms     → wait before answering
+- token_delay_ms → wait between streamed tokens
+- error_rate     → probability (0-1) of answering with error_status
+- error_status   → HTTP status of injected errors (429, 500, 503...)
+- fail_next      → fail exactly the next N requests
+- retry_after    → Retry-After header sent with injected errors
+
+Point the Groq SDK at it with GROQ_BASE_URL=http://127.0.0.1:<port>.
+
+Usage (from backend/):
+
+    python -m bench.fake_groq_server [--port 8090] [--latency-ms 200]
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+FAULT_DEFAULTS = {
+    "latency_ms": 0,
+    "token_delay_ms": 0,
+    "error_rate": 0.0,
+    "error_status": 503,
+    "fail_next": 0,
+    "retry_after": None,
+}
+
+FAKE_REPLY = "Hi Boo 👻 how was your day, mister? Tell me everything 🐾"
+
+
+class FakeGroqState:
+    """
+    Current faults + request counters, shared by all handler threads.
+    """
+
+    def __init__(self, **faults):
+        self.lock = threading.Lock()
+        self.faults = dict(FAULT_DEFAULTS, **faults)
+        self.model_faults = {}
+        self.requests = Counter()
+
+    def configure(self, config):
+        with self.lock:
+            models = config.pop("models", None)
+            if config.get("reset"):
+                self.faults = dict(FAULT_DEFAULTS)
+                self.model_faults = {}
+                self.requests = Counter()
+                config.pop("reset")
+            self.faults.update(config)
+            if models:
+                for model, faults in models.items():
+                    self.model_faults.setdefault(model, {}).update(faults)
+
+    def plan(self, model):
+        """
+        Decides how to answer one request: (faults, error_status or None).
+        """
+        with self.lock:
+            self.requests[model] += 1
+            faults = dict(self.faults, **self.model_faults.get(model, {}))
+
+            fail = False
+            scope = self.model_faults.get(model, {})
+            if scope.get("fail_next", 0) > 0:
+                scope["fail_next"] -= 1
+                fail = True
+            elif "fail_next" not in scope and self.faults["fail_next"] > 0:
+                self.faults["fail_next"] -= 1
+                fail = True
+            elif random.random() < faults["error_rate"]:
+                fail = True
+
+        return faults, (faults["error_status"] if fail else None)
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status, data, headers=None):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _read_json(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if self.path == "/_stats":
+                with state.lock:
+                    self._send_json(200, {"requests": dict(state.requests)})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path == "/_faults":
+                state.configure(self._read_json())
+                self._send_json(200, {"ok": True})
+                return
+
+            if not self.path.endswith("/chat/completions"):
+                self._send_json(404, {"error": "not found"})
+                return
+
+            request = self._read_json()
+            model = request.get("model", "unknown")
+            faults, error_status = state.plan(model)
+
+            time.sleep(faults["latency_ms"] / 1000)
+
+            if error_status:
+                headers = {}
+                if faults["retry_after"] is not None:
+                    headers["Retry-After"] = str(faults["retry_after"])
+                self._send_json(error_status, {"error": {"message": "injected fault", "type": "fake"}}, headers)
+                return
+
+            prompt_tokens = sum(len(str(m.get("content", "")).split()) for m in request.get("messages", []))
+            words = FAKE_REPLY.split(" ")
+            usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words), "total_tokens": prompt_tokens + len(words)}
+
+            if not request.get("stream"):
+                self._send_json(200, {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": FAKE_REPLY},
+                        "finish_reason": "stop",
+                    }],
+                    "usage": usage,
+                })
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            for index, word in enumerate(words):
+                chunk = {
+                    "id": "chatcmpl-fake",
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"content": word if index == 0 else " " + word},
+                        "finish_reason": None,
+                    }],
+                }
+                if index == len(words) - 1:
+                    chunk["choices"][0]["finish_reason"] = "stop"
+                    chunk["x_groq"] = {"id": "fake", "usage": usage}
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                time.sleep(faults["token_delay_ms"] / 1000)
+
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+class _QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (timeouts, hedging) is expected here
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_server(port=0, **faults):
+    """
+    Starts the fake server in a background thread.
+
+    Returns (server, state); server.server_address[1] is the port.
+    """
+    state = FakeGroqState(**faults)
+    server = _QuietServer(("127.0.0.1", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--token-delay-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    server, _ = start_server(
+        args.port,
+        latency_ms=args.latency_ms,
+        token_delay_ms=args.token_delay_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    print(f"fake Groq listening on http://127.0.0.1:{server.server_address[1]}  (GROQ_BASE_URL)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+bench/length_policy.py
+
+Tail latency with a fixed max_tokens vs the adaptive length scheduler
+(length_policy.py).
+
+Runs bench/load.py twice against the stub LLM, once with LENGTH_POLICY=fixed
+(every turn may use LLM_MAX_TOKENS) and once with LENGTH_POLICY=adaptive.
+The stub "wants" to talk for --reply-tokens tokens and stops at the turn's
+max_tokens, like a real model that rambles unless it is cut off.
+
+Usage (from backend/):
+
+    python -m bench.length_policy [--duration 15] [--reply-tokens 300]
+                                  [--tokens-per-second 400] [--concurrency 32]
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+
+from bench.load import run_load
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=15)
+    parser.add_argument("--llm-latency-ms", default="300")
+    parser.add_argument("--tokens-per-second", type=float, default=400)
+    parser.add_argument("--reply-tokens", type=int, default=300)
+    args = parser.parse_args()
+
+    print(
+        f"{args.concurrency} clients, {args.duration:.0f}s per policy, stub TTFT {args.llm_latency_ms} ms, "
+        f"{args.tokens_per_second:.0f} tok/s, model wants {args.reply_tokens} tokens"
+    )
+
+    results = {}
+    for policy in ("fixed", "adaptive"):
+        results[policy] = run_load(
+            concurrency=args.concurrency,
+            sessions=args.sessions,
+            duration=args.duration,
+            ttft=args.llm_latency_ms,
+            tokens_per_second=args.tokens_per_second,
+            reply_tokens=args.reply_tokens,
+            # Every request must reach the (stub) LLM
+            env={"LENGTH_POLICY": policy, "REPLY_CACHE_BACKEND": "off"},
+        )["overall"]
+        r = results[policy]
+        print(
+            f"{policy:9} {r['rps']:8.1f} req/s   p50 {r['p50_ms']:7.1f} ms   "
+            f"p95 {r['p95_ms']:7.1f} ms   p99 {r['p99_ms']:7.1f} ms   errors {r['errors']}"
+        )
+
+    fixed, adaptive = results["fixed"], results["adaptive"]
+    print(
+        f"\nadaptive vs fixed: p50 {adaptive['p50_ms'] / fixed['p50_ms'] - 1:+.0%}   "
+        f"p95 {adaptive['p95_ms'] / fixed['p95_ms'] - 1:+.0%}   "
+        f"p99 {adaptive['p99_ms'] / fixed['p99_ms'] - 1:+.0%}   "
+        f"rps {adaptive['rps'] / fixed['rps'] - 1:+.0%}"
+    )
+
+
+if __name__ == "__main__":
+    main()
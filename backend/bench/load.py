@@ -0,0 +1,202 @@
+"""
+bench/load.py
+
+Load test for POST /chat with a realistic message mix.
+
+Starts the app under gunicorn with the stub LLM backend (no Groq calls),
+drives it with many concurrent sessions, and reports throughput and
+p50 / p95 / p99 latency, overall and per message category.
+
+The mix (message_mix.json) is weighted: openers, rituals, everyday chat
+and long vents. Each client rotates through its own sessions, so stages
+advance and the final reveal is part of the run.
+
+Usage (from backend/):
+
+    python -m bench.load [--concurrency 32] [--sessions 200] [--duration 20]
+                         [--llm-latency-ms 300] [--reply-tokens 40] [--app app:app]
+                         [--env KEY=VALUE ...]
+                         [--save results/load.json]
+                         [--compare results/baseline.json --max-regression 0.10]
+
+With --compare, exits non-zero if rps drops, or any latency percentile
+rises, by more than --max-regression (a fraction), so it can gate deploys.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from bench.common import (
+    RESULTS_DIR,
+    compare_results,
+    drive_load,
+    latency_summary,
+    running_server,
+    save_results,
+)
+
+
+MIX_PATH = os.path.join(os.path.dirname(__file__), "message_mix.json")
+
+
+def load_mix(path=MIX_PATH):
+    with open(path, encoding="utf-8") as f:
+        mix = json.load(f)
+    categories = list(mix)
+    weights = [mix[name]["weight"] for name in categories]
+    return mix, categories, weights
+
+
+def run_load(
+    concurrency=32,
+    sessions=200,
+    duration=20,
+    ttft="fixed:300",
+    tokens_per_second=400,
+    reply_tokens=40,
+    app="app:app",
+    workers=2,
+    threads=16,
+    seed=0,
+    mix_path=MIX_PATH,
+    env=None,
+):
+    """
+    One load run. Returns {"overall": summary, "by_category": {...}}.
+    `env` adds / overrides server environment variables.
+    """
+    mix, categories, weights = load_mix(mix_path)
+    if ":" not in ttft:
+        ttft = f"fixed:{ttft}"
+
+    # Every client gets its own RNG and its own slice of the sessions,
+    # so a session never has two requests in flight at once.
+    sent = {}
+    rngs = [random.Random(seed * 1000 + n) for n in range(concurrency)]
+    sessions_per_client = max(1, sessions // concurrency)
+    run_id = int(time.time() * 1000)
+
+    def next_request(n, i):
+        rng = rngs[n]
+        category = rng.choices(categories, weights)[0]
+        message = rng.choice(mix[category]["messages"])
+        session = n * sessions_per_client + i % sessions_per_client
+        sent[n, i] = category
+        return {"message": message, "session_id": f"load-{run_id}-{session}"}
+
+    per_category = {name: [] for name in categories}
+
+    def on_result(n, i, seconds, ok):
+        category = sent.pop((n, i))
+        if ok:
+            per_category[category].append(seconds)
+
+    server_env = dict(
+        WEB_CONCURRENCY=workers,
+        GUNICORN_WORKER_CLASS="uvicorn.workers.UvicornWorker" if app == "asgi:app" else "gthread",
+        GUNICORN_THREADS=threads,
+        STUB_TTFT=ttft,
+        STUB_TOKENS_PER_SECOND=tokens_per_second,
+        STUB_REPLY_TOKENS=reply_tokens,
+        STUB_SEED=seed,
+        LLM_MAX_CONCURRENCY=max(concurrency, 1),
+        **(env or {}),
+    )
+
+    with running_server(app, **server_env) as port:
+        latencies, errors, elapsed = drive_load(port, concurrency, duration, next_request, on_result=on_result)
+
+    return {
+        "overall": latency_summary(latencies, elapsed, errors),
+        "by_category": {
+            name: latency_summary(values, elapsed) for name, values in per_category.items() if values
+        },
+    }
+
+
+def print_results(results):
+    overall = results["overall"]
+    print(
+        f"overall   {overall['rps']:8.1f} req/s   p50 {overall['p50_ms']:7.1f} ms   "
+        f"p95 {overall['p95_ms']:7.1f} ms   p99 {overall['p99_ms']:7.1f} ms   errors {overall['errors']}"
+    )
+    for name, summary in results["by_category"].items():
+        print(
+            f"{name:10} {summary['requests']:7d} req     p50 {summary['p50_ms']:7.1f} ms   "
+            f"p95 {summary['p95_ms']:7.1f} ms   p99 {summary['p99_ms']:7.1f} ms"
+        )
+
+
+def parse_env(pairs):
+    env = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        env[key] = value
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--sessions", type=int, default=200, help="distinct session ids shared by the clients")
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--llm-latency-ms", default="300", help="stub time-to-first-token: ms or a STUB_TTFT spec")
+    parser.add_argument("--tokens-per-second", type=float, default=400)
+    parser.add_argument("--reply-tokens", type=int, default=40, help="how long the stub model wants to talk")
+    parser.add_argument("--app", default="app:app", choices=["app:app", "asgi:app"])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--mix", default=MIX_PATH)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra server setting")
+    parser.add_argument("--save", nargs="?", const=os.path.join(RESULTS_DIR, "load.json"))
+    parser.add_argument("--compare", help="baseline JSON from an earlier --save")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args()
+
+    print(
+        f"{args.concurrency} clients, {args.sessions} sessions, {args.duration:.0f}s, "
+        f"{args.app}, stub TTFT {args.llm_latency_ms}"
+    )
+    results = run_load(
+        concurrency=args.concurrency,
+        sessions=args.sessions,
+        duration=args.duration,
+        ttft=args.llm_latency_ms,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        app=args.app,
+        workers=args.workers,
+        threads=args.threads,
+        seed=args.seed,
+        mix_path=args.mix,
+        env=parse_env(args.env),
+    )
+    results["config"] = {key: value for key, value in vars(args).items() if key not in ("save", "compare")}
+    print_results(results)
+
+    if args.save:
+        save_results(args.save, results)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\ncompared with {args.compare} (max regression {args.max_regression:.0%}):")
+        regressions = compare_results(
+            {"overall": results["overall"]}, {"overall": baseline["overall"]}, args.max_regression
+        )
+        if regressions:
+            print(f"FAIL: {len(regressions)} metric(s) regressed")
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+bench/micro.py
+
+Microbenchmarks for the request hot path, in-process, without a server.
+
+Measures:
+- build_prompt()          → µs per call
+- process_user_message()  → µs per call with a zero-latency stub LLM, so
+                            the number is ArtyBot's own overhead (session
+                            store, rituals, cache lookup, retrieval,
+                            client bookkeeping), not the model's
+- prompt tokens per request (estimated)
+
+Messages come from message_mix.json, so the numbers follow the same mix
+as bench/load.py.
+
+Usage (from backend/):
+
+    python -m bench.micro [--iterations 5000]
+                          [--save results/micro.json]
+                          [--compare results/micro-baseline.json --max-regression 0.10]
+
+With --compare, exits non-zero if any metric gets worse by more than
+--max-regression (a fraction).
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+# Never talk to Groq from a benchmark, and make the stub answer instantly
+# so only ArtyBot's own work is timed.
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ.setdefault("STUB_TTFT", "fixed:0")
+os.environ.setdefault("STUB_TOKENS_PER_SECOND", "1000000000")
+os.environ.setdefault("REPLY_CACHE_BACKEND", "off")
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+import llm  # noqa: E402
+from bench.common import RESULTS_DIR, compare_results, save_results  # noqa: E402
+from bench.load import load_mix  # noqa: E402
+from tokens import estimate_tokens  # noqa: E402
+
+
+def mix_messages():
+    mix, categories, _ = load_mix()
+    return [message for name in categories for message in mix[name]["messages"]]
+
+
+def time_per_call(fn, messages, iterations, repeats=5):
+    """
+    Best-of-`repeats` average time per call, in microseconds.
+    """
+    results = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(iterations):
+            fn(messages[i % len(messages)], i)
+        results.append((time.perf_counter() - start) / iterations * 1e6)
+    return min(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--save", nargs="?", const=os.path.join(RESULTS_DIR, "micro.json"))
+    parser.add_argument("--compare", help="baseline JSON from an earlier --save")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args()
+
+    messages = mix_messages()
+
+    # Sessions rotate so stages (and the final reveal) are exercised too
+    results = {
+        "build_prompt_us": time_per_call(lambda m, i: llm.build_prompt(m), messages, args.iterations),
+        "process_user_message_us": time_per_call(
+            lambda m, i: llm.process_user_message(m, f"micro-{i % 64}"), messages, args.iterations
+        ),
+        "prompt_tokens": statistics.mean(
+            sum(estimate_tokens(part["content"]) for part in llm.build_prompt(m)) for m in messages
+        ),
+    }
+
+    print(f"build_prompt            {results['build_prompt_us']:10.2f} µs/op")
+    print(f"process_user_message    {results['process_user_message_us']:10.2f} µs/op  (zero-latency stub LLM)")
+    print(f"prompt tokens / request ~{results['prompt_tokens']:.0f}")
+
+    if args.save:
+        save_results(args.save, results)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\ncompared with {args.compare} (max regression {args.max_regression:.0%}):")
+        regressions = compare_results(results, baseline, args.max_regression)
+        if regressions:
+            print(f"FAIL: {len(regressions)} metric(s) regressed")
+            sys.exit(1)
+        print("OK")
+
+
+if __name__ == "__main__":
+    main()
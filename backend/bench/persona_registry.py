@@ -0,0 +1,166 @@
+"""
+bench/persona_registry.py
+
+What hosting many personas in one process costs (see personas.py).
+
+Builds --personas synthetic personas (copies of the default one, each
+with a memory of its own) in a temporary PERSONAS_DIR and
+PROMPT_CACHE_DIR, then measures with a registry that keeps at most
+--max-loaded of them:
+
+- cold load   → first message for a persona: read, compile, cache on disk
+- cached load → a persona dropped by the LRU comes back: the compiled
+                bundle is read from PROMPT_CACHE_DIR instead
+- hit         → the persona is loaded already
+- memory      → Python allocations (tracemalloc) while every persona is
+                asked for in turn, compared with one persona's size: the
+                LRU has to keep it bounded, whatever --personas is
+
+Then checks that two personas answering the same session id keep two
+conversations (stages), through llm.process_user_message with the stub.
+
+Fails (exit code 1) when a cached load is not at least --min-speedup
+times faster than a compile, when memory grows past --max-loaded + 1
+personas (plus --memory-slack), or when sessions leak between personas.
+
+Usage (from backend/):
+
+    python -m bench.persona_registry [--personas 40] [--max-loaded 4]
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import gc
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Never talk to Groq from a benchmark; compiled bundles go to a throwaway
+# directory, so the first load of each persona really compiles
+os.environ.setdefault("LLM_BACKEND", "stub")
+_CACHE_DIR = tempfile.mkdtemp(prefix="artybot-bench-prompts-")
+os.environ["PROMPT_CACHE_DIR"] = _CACHE_DIR
+
+import llm  # noqa: E402
+from personas import DEFAULT_PERSONA, PERSONAS_DIR, PersonaRegistry  # noqa: E402
+from prompts import KNOWLEDGE_BASE_FILE  # noqa: E402
+
+
+def make_personas(root, count):
+    """
+    `count` personas in `root`: p00, p01... Returns their names.
+    """
+    source = os.path.join(PERSONAS_DIR, DEFAULT_PERSONA)
+    names = []
+    for i in range(count):
+        name = f"p{i:02d}"
+        directory = os.path.join(root, name)
+        shutil.copytree(source, directory)
+        with open(os.path.join(directory, KNOWLEDGE_BASE_FILE), "a", encoding="utf-8") as f:
+            f.write(f"\n\n[MEMORY]\nPersona {name} was made by bench/persona_registry.py.\n")
+        names.append(name)
+    return names
+
+
+def time_gets(registry, names):
+    """
+    Milliseconds per registry.get(), one call per name.
+    """
+    times = []
+    for name in names:
+        started = time.perf_counter()
+        registry.get(name)
+        times.append((time.perf_counter() - started) * 1000)
+    return times
+
+
+def allocated():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def check_sessions(registry, first, second):
+    """
+    The same session id, two personas: two conversations.
+    """
+    a, b = registry.get(first), registry.get(second)
+    session_id = "bench-persona-session"
+    llm.process_user_message("hi", session_id, persona=a)
+    llm.process_user_message("how are you", session_id, persona=a)
+    llm.process_user_message("hi", session_id, persona=b)
+    left_a, left_b = llm.stages_left(session_id, a), llm.stages_left(session_id, b)
+    print(f"sessions: {first} {left_a} messages before the reveal, {second} {left_b}")
+    return left_a == a.final_stage - 2 and left_b == b.final_stage - 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--personas", type=int, default=40)
+    parser.add_argument("--max-loaded", type=int, default=4)
+    parser.add_argument("--min-speedup", type=float, default=3.0)
+    parser.add_argument("--memory-slack", type=float, default=0.5, help="allowed over the LRU bound, as a fraction")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix="artybot-bench-personas-")
+    failures = []
+    try:
+        names = make_personas(root, args.personas + 1)
+        default, others = names[0], names[1:]
+
+        registry = PersonaRegistry(root, default=default, max_loaded=args.max_loaded, reload_interval=0)
+        cold = time_gets(registry, others)
+        cached = time_gets(registry, others)
+        recent = others[-args.max_loaded:]
+        hits = time_gets(registry, recent * 200)
+
+        # Memory on its own registry: tracemalloc slows everything down
+        tracemalloc.start()
+        baseline = allocated()
+        measured = PersonaRegistry(root, default=default, max_loaded=args.max_loaded, reload_interval=0)
+        one_persona = allocated() - baseline
+        time_gets(measured, others)
+        after_once = allocated() - baseline
+        time_gets(measured, others)
+        after_twice = allocated() - baseline
+        tracemalloc.stop()
+        del measured
+
+        print(f"{args.personas} personas, at most {args.max_loaded} loaded (+ the default one)")
+        print(f"cold load:   median {statistics.median(cold):8.3f} ms   (compile)")
+        print(f"cached load: median {statistics.median(cached):8.3f} ms   (from {_CACHE_DIR})")
+        print(f"hit:         median {statistics.median(hits) * 1000:8.3f} µs")
+        print(f"memory: one persona {one_persona / 1e6:.2f} MB, "
+              f"after every persona once {after_once / 1e6:.2f} MB, twice {after_twice / 1e6:.2f} MB")
+        print(f"registry: {registry.stats()}")
+
+        speedup = statistics.median(cold) / statistics.median(cached)
+        if speedup < args.min_speedup:
+            failures.append(f"cached load only {speedup:.1f}x faster than a compile (want {args.min_speedup}x)")
+
+        bound = (args.max_loaded + 1) * one_persona * (1 + args.memory_slack)
+        if max(after_once, after_twice) > bound:
+            failures.append(
+                f"{max(after_once, after_twice) / 1e6:.2f} MB allocated, over {bound / 1e6:.2f} MB "
+                f"({args.max_loaded + 1} personas + {args.memory_slack:.0%})"
+            )
+
+        if not check_sessions(registry, others[0], others[1]):
+            failures.append("sessions leak between personas")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+        shutil.rmtree(_CACHE_DIR, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+bench/prompt_assembly.py
+
+Measures per-request prompt-assembly cost.
+
+Compares:
+- "before" → the old build_prompt(): one big f-string with the rules AND the
+             entire knowledge base rebuilt on every message, with the user
+             text interpolated at the very end
+- "after"  → the current build_prompt(): precompiled system prompt, the
+             retrieved memories for this message, and a separate user message
+
+Reports both assembly time and estimated prompt tokens per request.
+
+Usage (from backend/):
+
+    python -m bench.prompt_assembly [--iterations 20000]
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import os
+import statistics
+import time
+
+# Never talk to Groq from a benchmark
+os.environ.setdefault("LLM_BACKEND", "stub")
+
+import llm  # noqa: E402
+from tokens import estimate_tokens  # noqa: E402
+
+
+SAMPLE_MESSAGES = [
+    "hi",
+    "hey love, what are you doing?",
+    "did you see the barca match last night, pedri was insane",
+    "i had such a long day at work, my manager is driving me crazy",
+    "QRE",
+]
+
+
+def legacy_build_prompt(user_message):
+    """
+    Same work the old build_prompt() did: copy the rules AND the whole
+    knowledge base into a brand new string, then append the user message.
+    """
+    bundle = llm.persona_registry.default().prompts.current()
+    return f"""{bundle.system_prompt}
+{bundle.knowledge_base}
+USER MESSAGE:
+"{user_message}"
+
+Reply as Artija.
+"""
+
+
+def prompt_tokens(prompt):
+    if isinstance(prompt, str):
+        return estimate_tokens(prompt)
+    return sum(estimate_tokens(message["content"]) for message in prompt)
+
+
+def time_per_call(fn, iterations, repeats=5):
+    """
+    Best-of-`repeats` average time per call, in microseconds.
+    """
+    results = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(iterations):
+            fn(SAMPLE_MESSAGES[i % len(SAMPLE_MESSAGES)])
+        results.append((time.perf_counter() - start) / iterations * 1e6)
+    return min(results), statistics.median(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    bundle = llm.persona_registry.default().prompts.current()
+    print(f"static prefix: {bundle.system_prompt_bytes} bytes, ~{bundle.system_prompt_tokens} tokens")
+
+    before_best, before_median = time_per_call(legacy_build_prompt, args.iterations)
+    after_best, after_median = time_per_call(llm.build_prompt, args.iterations)
+
+    print(f"before (full f-string per message): best {before_best:8.3f} µs   median {before_median:8.3f} µs")
+    print(f"after  (prefix + retrieval):        best {after_best:8.3f} µs   median {after_median:8.3f} µs")
+
+    before_tokens = statistics.mean(prompt_tokens(legacy_build_prompt(m)) for m in SAMPLE_MESSAGES)
+    after_tokens = statistics.mean(prompt_tokens(llm.build_prompt(m)) for m in SAMPLE_MESSAGES)
+    print(f"prompt tokens per request: before ~{before_tokens:.0f}   after ~{after_tokens:.0f}")
+
+
+if __name__ == "__main__":
+    main()
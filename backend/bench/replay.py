@@ -0,0 +1,312 @@
+"""
+bench/replay.py
+
+Offline replay of whole conversations, to catch prompt-size and latency
+regressions before they reach production.
+
+Every edit to the knowledge base, the rules or build_prompt() changes
+how many tokens each turn sends (latency and cost). This replays a corpus
+of conversations through process_user_message(), in-process, and reports
+per turn:
+- stage and source (llm / ritual), and whether it was the final reveal
+- prompt tokens actually sent (as counted by the backend's usage)
+- prompt assembly time (the build_prompt span) and the turn's latency
+- per conversation: the turn and time at which the final reveal fired
+
+Replies come from the stub LLM (default, zero latency) or from a
+cassette of real replies (--cassette). Record one once with
+--record-cassette; after a prompt change, each message still gets the
+reply it got when it was recorded (see llm_backends.CassetteBackend), so
+the conversation history, and the prompts built from it, stay comparable.
+
+Corpus: bench/replay_corpus.json (synthetic), or real conversations from
+the transcripts (--from-transcripts artybot_transcripts.db).
+
+Usage (from backend/):
+
+    python -m bench.replay [--corpus bench/replay_corpus.json | --from-transcripts DB]
+                           [--cassette cassette.json | --record-cassette cassette.json --record-from groq]
+                           [--save results/replay.json]
+                           [--baseline results/replay-baseline.json
+                            --max-token-growth 0.05 --max-latency-growth 0.50]
+
+Fails (exit code 1) if a stage is skipped or repeated, if the final
+reveal fires on a different turn than in the baseline, if the cassette
+has no reply for a message, or if the prompt tokens / latency totals
+grow past the thresholds.
+
+Important:
+- Deterministic: reply cache and idempotency are off, history is
+  summarized on the replay thread (HISTORY_SUMMARY_WORKERS=0) and ritual
+  replies are seeded, so tokens only change when the prompt does
+- Latencies are the best of --repeats runs; they are ArtyBot's own
+  overhead (plus the cassette lookup), never the model's
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import json
+import os
+import sys
+import time
+
+from bench.common import BACKEND_DIR, RESULTS_DIR, percentile, save_results
+
+
+DEFAULT_CORPUS = os.path.join(BACKEND_DIR, "bench", "replay_corpus.json")
+
+# Metrics compared against the baseline, and which threshold applies
+TOKEN_METRICS = ("prompt_tokens_total", "prompt_tokens_mean", "prompt_tokens_max")
+LATENCY_METRICS = ("build_prompt_ms_p50", "build_prompt_ms_p95", "latency_ms_p50", "latency_ms_p95")
+
+
+def configure(args):
+    """
+    Environment for a deterministic, offline replay. Must run before llm
+    is imported.
+    """
+    env = {
+        "LLM_BACKEND": "stub",
+        "STUB_TTFT": "fixed:0",
+        "STUB_TOKENS_PER_SECOND": "1000000000",
+        "STUB_SEED": "0",
+        "RITUALS_SEED": "0",
+        "SESSION_BACKEND": "memory",
+        "HISTORY_BACKEND": "memory",
+        "HISTORY_SUMMARY_WORKERS": "0",
+        "REPLY_CACHE_BACKEND": "off",
+        "IDEMPOTENCY_BACKEND": "off",
+        "TRANSCRIPT_BACKEND": "off",
+        "TRACE_SAMPLE_RATE": "0",
+    }
+    if args.cassette or args.record_cassette:
+        env["LLM_BACKEND"] = "cassette"
+        env["LLM_CASSETTE"] = args.cassette or args.record_cassette
+    if args.record_cassette:
+        env["LLM_CASSETTE_RECORD"] = args.record_from
+    os.environ.update(env)
+
+
+# -------------------------
+# Corpus
+# -------------------------
+
+def load_corpus(args):
+    """
+    [{"name": ..., "turns": [message, ...]}, ...]
+    """
+    if args.from_transcripts:
+        from transcripts import SQLiteTranscriptStore
+
+        store = SQLiteTranscriptStore(args.from_transcripts)
+        sessions = store.recent(0, args.max_conversations, 1000)
+        return [{"name": session_id, "turns": [row["user_message"] for row in rows]} for session_id, rows in sessions]
+
+    with open(args.corpus, encoding="utf-8") as f:
+        return json.load(f)["conversations"][:args.max_conversations]
+
+
+# -------------------------
+# Replay
+# -------------------------
+
+def replay_turn(llm, tracing, message, session_id):
+    trace = tracing.start("replay", sample_rate=1.0)
+    started = time.perf_counter()
+    _, is_final = llm.process_user_message(message, session_id)
+    latency_ms = (time.perf_counter() - started) * 1000
+    # Not written anywhere: only read here
+    tracing.use(None)
+
+    spans = {span["name"]: span["duration_ms"] for span in trace.spans}
+    return {
+        "stage": trace.attrs.get("stage"),
+        "source": trace.attrs.get("source"),
+        "is_final": is_final,
+        "prompt_tokens": trace.attrs.get("prompt_tokens", 0),
+        "build_prompt_ms": spans.get("build_prompt", 0.0),
+        "latency_ms": round(latency_ms, 3),
+    }
+
+
+def replay(llm, tracing, corpus, repeats):
+    """
+    {name: {"turns": [...], "final_turn", "final_ms"}}. Tokens, stages and
+    sources come from the first run; times are the best of all runs.
+    """
+    results = {}
+    for conversation in corpus:
+        runs = []
+        for repeat in range(repeats):
+            session_id = f"replay-{conversation['name']}-{repeat}"[:64]
+            runs.append([replay_turn(llm, tracing, message, session_id) for message in conversation["turns"]])
+
+        turns = runs[0]
+        for index, turn in enumerate(turns):
+            turn["message"] = conversation["turns"][index]
+            for key in ("build_prompt_ms", "latency_ms"):
+                turn[key] = min(run[index][key] for run in runs)
+
+        final_turn = next((index + 1 for index, turn in enumerate(turns) if turn["is_final"]), None)
+        results[conversation["name"]] = {
+            "turns": turns,
+            "final_turn": final_turn,
+            "final_ms": round(sum(turn["latency_ms"] for turn in turns[:final_turn]), 3) if final_turn else None,
+        }
+    return results
+
+
+def totals(conversations):
+    turns = [turn for conversation in conversations.values() for turn in conversation["turns"]]
+    llm_turns = [turn for turn in turns if turn["source"] == "llm"]
+    tokens = [turn["prompt_tokens"] for turn in llm_turns] or [0]
+    build = [turn["build_prompt_ms"] for turn in llm_turns] or [0.0]
+    latency = [turn["latency_ms"] for turn in turns]
+    return {
+        "turns": len(turns),
+        "llm_turns": len(llm_turns),
+        "prompt_tokens_total": sum(tokens),
+        "prompt_tokens_mean": round(sum(tokens) / len(tokens), 1),
+        "prompt_tokens_max": max(tokens),
+        "build_prompt_ms_p50": round(percentile(build, 50), 3),
+        "build_prompt_ms_p95": round(percentile(build, 95), 3),
+        "latency_ms_p50": round(percentile(latency, 50), 3),
+        "latency_ms_p95": round(percentile(latency, 95), 3),
+    }
+
+
+def stage_problems(name, conversation):
+    """
+    Stages must go 1, 2, 3, ... : one per message, never skipped or repeated.
+    """
+    stages = [turn["stage"] for turn in conversation["turns"]]
+    expected = list(range(1, len(stages) + 1))
+    return [] if stages == expected else [f"{name}: stages {stages}, expected {expected}"]
+
+
+# -------------------------
+# Report
+# -------------------------
+
+def print_conversation(name, conversation):
+    print(f"\n{name}")
+    print(f"  {'turn':>4} {'stage':>5} {'source':7} {'tokens':>7} {'build':>9} {'latency':>9}  message")
+    for index, turn in enumerate(conversation["turns"], 1):
+        final = " ← final reveal" if turn["is_final"] and index == conversation["final_turn"] else ""
+        print(
+            f"  {index:4} {turn['stage']:5} {turn['source']:7} {turn['prompt_tokens']:7} "
+            f"{turn['build_prompt_ms']:7.3f}ms {turn['latency_ms']:7.3f}ms  {turn['message'][:40]}{final}"
+        )
+    if conversation["final_turn"]:
+        print(f"  final reveal: turn {conversation['final_turn']}, {conversation['final_ms']:.1f} ms into the conversation")
+    else:
+        print("  final reveal: not reached")
+
+
+def compare(results, baseline, max_token_growth, max_latency_growth):
+    """
+    Prints the diff against `baseline` and returns the failures.
+    """
+    failures = []
+    print(f"\n{'metric':24} {'baseline':>12} {'now':>12} {'change':>8}")
+    for metric in TOKEN_METRICS + LATENCY_METRICS:
+        old, new = baseline["totals"].get(metric), results["totals"][metric]
+        if not old:
+            continue
+        change = (new - old) / old
+        limit = max_token_growth if metric in TOKEN_METRICS else max_latency_growth
+        flag = "REGRESSION" if change > limit else ""
+        print(f"{metric:24} {old:12.3f} {new:12.3f} {change:+8.1%} {flag}")
+        if flag:
+            failures.append(f"{metric} grew {change:+.1%} (limit {limit:.0%})")
+
+    # Where the tokens went: the turns that grew the most
+    grown = []
+    for name, conversation in results["conversations"].items():
+        before = baseline["conversations"].get(name)
+        if before is None:
+            continue
+        for index, (turn, old) in enumerate(zip(conversation["turns"], before["turns"]), 1):
+            if turn["prompt_tokens"] != old["prompt_tokens"]:
+                grown.append((turn["prompt_tokens"] - old["prompt_tokens"], name, index, turn["message"]))
+        if conversation["final_turn"] != before["final_turn"]:
+            failures.append(f"{name}: final reveal moved from turn {before['final_turn']} to {conversation['final_turn']}")
+
+    if grown:
+        print("\nturns whose prompt changed the most:")
+        for delta, name, index, message in sorted(grown, key=lambda item: -abs(item[0]))[:8]:
+            print(f"  {delta:+6} tokens  {name} turn {index}: {message[:50]}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS)
+    parser.add_argument("--from-transcripts", metavar="DB", help="replay recorded conversations instead")
+    parser.add_argument("--max-conversations", type=int, default=100)
+    parser.add_argument("--cassette", help="replay recorded replies from this cassette")
+    parser.add_argument("--record-cassette", metavar="PATH", help="record replies from --record-from into PATH")
+    parser.add_argument("--record-from", default="groq", help="backend to record from")
+    parser.add_argument("--repeats", type=int, default=3, help="runs per conversation; times are the best run")
+    parser.add_argument("--save", nargs="?", const=os.path.join(RESULTS_DIR, "replay.json"))
+    parser.add_argument("--baseline", help="results JSON from an earlier --save")
+    parser.add_argument("--max-token-growth", type=float, default=0.05)
+    parser.add_argument("--max-latency-growth", type=float, default=0.50)
+    parser.add_argument("--quiet", action="store_true", help="totals only, no per-turn tables")
+    args = parser.parse_args()
+
+    configure(args)
+    import llm
+    import tracing
+
+    corpus = load_corpus(args)
+    # Recording pays for real LLM calls: once is enough
+    repeats = 1 if args.record_cassette else max(1, args.repeats)
+    conversations = replay(llm, tracing, corpus, repeats)
+    results = {
+        "settings": {
+            "backend": os.environ["LLM_BACKEND"],
+            "prompt_version": llm.persona_registry.default().prompts.current().version,
+            "conversations": len(corpus),
+        },
+        "conversations": conversations,
+        "totals": totals(conversations),
+    }
+
+    failures = []
+    for name, conversation in conversations.items():
+        if not args.quiet:
+            print_conversation(name, conversation)
+        failures += stage_problems(name, conversation)
+
+    print(f"\nprompt version {results['settings']['prompt_version']}, backend {results['settings']['backend']}")
+    for metric, value in results["totals"].items():
+        print(f"  {metric:24} {value}")
+
+    if args.record_cassette:
+        llm.llm_backend.save()
+        print(f"cassette: {llm.llm_backend.stats()} → {args.record_cassette}")
+    elif args.cassette:
+        stats = llm.llm_backend.stats()
+        print(f"cassette: {stats}")
+        if stats["miss"]:
+            failures.append(f"{stats['miss']} LLM calls had no recorded reply (record the cassette again)")
+
+    if args.save:
+        save_results(args.save, results)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\ncompared with {args.baseline} (prompt {baseline['settings']['prompt_version']}):")
+        failures += compare(results, baseline, args.max_token_growth, args.max_latency_growth)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
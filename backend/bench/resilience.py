@@ -0,0 +1,151 @@
+"""
+bench/resilience.py
+
+Checks the resilient LLM client (llm_client.py) against the local fake
+Groq server (bench/fake_groq_server.py), which injects latency and errors.
+
+Scenarios:
+- healthy           → one call, one request
+- transient 503s    → retried with backoff, then succeeds
+- 429 + Retry-After → waits at least Retry-After, then succeeds
+- bad request (400) → NOT retried
+- outage            → circuit breaker opens, later calls fail fast
+- broken primary    → fallback model answers
+- slow primary      → hedged request to the fallback model wins
+- hung upstream     → the call gives up at its deadline
+- streaming         → retried before the first chunk, then streams
+
+Usage (from backend/):
+
+    python -m bench.resilience
+
+Exits non-zero if any scenario fails.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import asyncio
+import sys
+import time
+
+from bench.fake_groq_server import start_server
+from llm_backends import GroqBackend
+from llm_client import CircuitOpenError, LLMUnavailableError, ResilientClient
+
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+def make_client(base_url, **overrides):
+    settings = dict(
+        model="primary",
+        fallback_model=None,
+        deadline=3.0,
+        attempt_timeout=1.0,
+        max_retries=2,
+        backoff_base=0.05,
+        backoff_cap=0.2,
+        hedge_after=None,
+        breaker_threshold=3,
+        breaker_reset=60,
+    )
+    settings.update(overrides)
+    model = settings.pop("model")
+    return ResilientClient(GroqBackend(api_key="fake", base_url=base_url), model, **settings)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    try:
+        return fn(), None, time.perf_counter() - start
+    except Exception as error:
+        return None, error, time.perf_counter() - start
+
+
+def main():
+    server, state = start_server()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    results = []
+
+    def check(name, ok, detail):
+        results.append(ok)
+        print(f"{'PASS' if ok else 'FAIL'}  {name:20} {detail}")
+
+    def reset(**faults):
+        state.configure({"reset": True, **faults})
+
+    # Healthy
+    reset()
+    client = make_client(base_url)
+    response, error, elapsed = timed(lambda: client.create(MESSAGES))
+    check("healthy", error is None and state.requests["primary"] == 1, f"{elapsed * 1000:.0f} ms")
+
+    # Transient 503s
+    reset(fail_next=2, error_status=503)
+    client = make_client(base_url)
+    response, error, elapsed = timed(lambda: client.create(MESSAGES))
+    check("transient 503s", error is None and client.stats()["retries"] == 2, f"retries={client.stats()['retries']}")
+
+    # 429 with Retry-After
+    reset(fail_next=1, error_status=429, retry_after=0.4)
+    client = make_client(base_url)
+    response, error, elapsed = timed(lambda: client.create(MESSAGES))
+    check("429 + Retry-After", error is None and elapsed >= 0.4, f"{elapsed * 1000:.0f} ms")
+
+    # Non-retryable
+    reset(fail_next=1, error_status=400)
+    client = make_client(base_url)
+    response, error, elapsed = timed(lambda: client.create(MESSAGES))
+    check("bad request", isinstance(error, LLMUnavailableError) and state.requests["primary"] == 1, "1 request, no retry")
+
+    # Outage → breaker opens → fail fast
+    reset(error_rate=1.0, error_status=500)
+    client = make_client(base_url, max_retries=5)
+    timed(lambda: client.create(MESSAGES))
+    sent = state.requests["primary"]
+    _, error, elapsed = timed(lambda: client.create(MESSAGES))
+    check(
+        "outage",
+        isinstance(error, CircuitOpenError) and state.requests["primary"] == sent and elapsed < 0.01,
+        f"breaker={client.stats()['breakers']['primary']}, rejected in {elapsed * 1e6:.0f} µs",
+    )
+
+    # Fallback model
+    reset(models={"primary": {"error_rate": 1.0, "error_status": 503}})
+    client = make_client(base_url, fallback_model="backup", max_retries=1)
+    response, error, elapsed = timed(lambda: client.create(MESSAGES))
+    check("broken primary", error is None and response.model == "backup", f"answered by {getattr(response, 'model', None)}")
+
+    # Hedging
+    reset(models={"primary": {"latency_ms": 1500}})
+    client = make_client(base_url, fallback_model="backup", hedge_after=0.2, attempt_timeout=2.5)
+    response, error, elapsed = timed(lambda: client.create(MESSAGES))
+    check("slow primary", error is None and response.model == "backup" and elapsed < 1.0, f"{elapsed * 1000:.0f} ms via {getattr(response, 'model', None)}")
+
+    # Async hedging
+    reset(models={"primary": {"latency_ms": 1500}})
+    client = make_client(base_url, fallback_model="backup", hedge_after=0.2, attempt_timeout=2.5)
+    response, error, elapsed = timed(lambda: asyncio.run(client.acreate(MESSAGES)))
+    check("slow primary (async)", error is None and response.model == "backup" and elapsed < 1.0, f"{elapsed * 1000:.0f} ms")
+
+    # Deadline
+    reset(latency_ms=5000)
+    client = make_client(base_url, deadline=1.0, attempt_timeout=5.0)
+    _, error, elapsed = timed(lambda: client.create(MESSAGES))
+    check("hung upstream", isinstance(error, LLMUnavailableError) and elapsed < 1.5, f"gave up after {elapsed * 1000:.0f} ms")
+
+    # Streaming, retried before the first chunk
+    reset(fail_next=1, error_status=502)
+    client = make_client(base_url)
+    text, error, elapsed = timed(lambda: "".join(c.choices[0].delta.content or "" for c in client.stream(MESSAGES)))
+    check("streaming", error is None and text.startswith("Hi Boo") and client.stats()["retries"] == 1, repr((text or "")[:20]))
+
+    server.shutdown()
+    print(f"\n{sum(results)}/{len(results)} scenarios passed")
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
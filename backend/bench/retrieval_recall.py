@@ -0,0 +1,66 @@
+"""
+bench/retrieval_recall.py
+
+Recall check for the knowledge-base retrieval (knowledge.py).
+
+For every case in recall_cases.json, the facts that MUST be retrieved are
+listed by a snippet of their text. Recall = how many of those facts end up
+in the memory actually sent with the message (top-k, under the token budget).
+
+Usage (from backend/):
+
+    python -m bench.retrieval_recall [--mode bm25|vector|hybrid] [--min-recall 0.9]
+
+Exits non-zero if recall drops below --min-recall, so it can gate deploys.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import json
+import os
+import sys
+
+from knowledge import KnowledgeIndex
+from personas import DEFAULT_PERSONA, PERSONAS_DIR
+from prompts import read_persona
+
+
+CASES_PATH = os.path.join(os.path.dirname(__file__), "recall_cases.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", default="bm25", choices=["bm25", "vector", "hybrid"])
+    parser.add_argument("--min-recall", type=float, default=0.9)
+    args = parser.parse_args()
+
+    knowledge_base, _template = read_persona(os.path.join(PERSONAS_DIR, DEFAULT_PERSONA))
+    index = KnowledgeIndex.from_text(knowledge_base, mode=args.mode)
+    with open(CASES_PATH, encoding="utf-8") as f:
+        cases = json.load(f)
+
+    found = total = 0
+    for case in cases:
+        selected = index.select(case["query"])
+        texts = [chunk.text for chunk in selected]
+        tokens = sum(chunk.tokens for chunk in selected)
+
+        for snippet in case["expect"]:
+            total += 1
+            hit = any(snippet in text for text in texts)
+            found += hit
+            mark = "ok  " if hit else "MISS"
+            print(f"{mark} {case['query']!r:55} → {snippet!r}  ({len(selected)} chunks, ~{tokens} tokens)")
+
+    recall = found / total if total else 1.0
+    print(f"\nmode={args.mode}  recall={recall:.2%} ({found}/{total})")
+
+    if recall < args.min_recall:
+        print(f"FAIL: recall below {args.min_recall:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
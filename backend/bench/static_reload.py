@@ -0,0 +1,128 @@
+"""
+bench/static_reload.py
+
+Bytes transferred for /static on a first visit vs a warm reload.
+
+Copies a few of the frontend's media files into a temporary STATIC_DIR
+(one under a fingerprinted name, text files precompressed with
+static_files.precompress), starts the server, then plays a browser:
+
+- cold:   GET every file with "Accept-Encoding: br, gzip"
+- warm:   reload with the cache filled by the cold visit. Immutable files
+          are not requested at all; the rest are revalidated with
+          If-None-Match and should come back as 304 with no body
+- seek:   a Range request into an MP3, as an <audio> seek does
+
+Fails (exit code 1) when the warm reload transfers any body bytes, or
+when the range request doesn't return exactly the requested bytes.
+
+Usage (from backend/):
+
+    python -m bench.static_reload [--app app:app]
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import http.client
+import os
+import shutil
+import sys
+import tempfile
+
+from bench.common import BACKEND_DIR, running_server
+from static_files import precompress
+
+
+FRONTEND_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "frontend")
+
+# (file in frontend/, name under /static)
+SAMPLE_FILES = [
+    ("script.js", "script.js"),
+    ("style.css", "style.css"),
+    ("shinchan.gif", "shinchan.5e1e50020b.gif"),
+    ("receive.mp3", "receive.mp3"),
+]
+SEEK_FILE = "receive.mp3"
+SEEK_RANGE = (10000, 19999)
+
+
+def get(conn, path, headers=None):
+    """
+    (status, response headers (case-insensitive), body bytes, header bytes) for one GET.
+    """
+    conn.request("GET", path, headers=headers or {})
+    response = conn.getresponse()
+    body = response.read()
+    header_bytes = sum(len(k) + len(v) + 4 for k, v in response.getheaders())
+    return response.status, response.headers, body, header_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", default="app:app", choices=["app:app", "asgi:app"])
+    args = parser.parse_args()
+
+    static_dir = tempfile.mkdtemp(prefix="artybot-static-")
+    try:
+        for source, name in SAMPLE_FILES:
+            shutil.copyfile(os.path.join(FRONTEND_DIR, source), os.path.join(static_dir, name))
+        precompress(static_dir)
+
+        worker_class = "uvicorn.workers.UvicornWorker" if args.app == "asgi:app" else "gthread"
+        with running_server(args.app, STATIC_DIR=static_dir, WEB_CONCURRENCY=1, GUNICORN_WORKER_CLASS=worker_class) as port:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            accept = {"Accept-Encoding": "br, gzip"}
+
+            # Cold visit
+            cache = {}
+            cold_body = cold_headers = 0
+            print(f"{'file':28} {'cold':>10} {'warm':>10}")
+            for _, name in SAMPLE_FILES:
+                status, headers, body, header_bytes = get(conn, f"/static/{name}", accept)
+                assert status == 200, (name, status)
+                cache[name] = headers
+                cold_body += len(body)
+                cold_headers += header_bytes
+
+            # Warm reload
+            warm_body = warm_headers = 0
+            for _, name in SAMPLE_FILES:
+                cached = cache[name]
+                if "immutable" in cached.get("Cache-Control", ""):
+                    print(f"{name:28} {int(cached['Content-Length']):10} {'(cache)':>10}")
+                    continue
+                status, _, body, header_bytes = get(conn, f"/static/{name}", {**accept, "If-None-Match": cached["ETag"]})
+                warm_body += len(body)
+                warm_headers += header_bytes
+                print(f"{name:28} {int(cached['Content-Length']):10} {len(body):10}  ({status})")
+
+            print(
+                f"{'total body bytes':28} {cold_body:10} {warm_body:10}\n"
+                f"{'total header bytes':28} {cold_headers:10} {warm_headers:10}"
+            )
+
+            # Seek
+            first, last = SEEK_RANGE
+            status, headers, body, _ = get(conn, f"/static/{SEEK_FILE}", {"Range": f"bytes={first}-{last}"})
+            with open(os.path.join(static_dir, SEEK_FILE), "rb") as f:
+                f.seek(first)
+                expected = f.read(last - first + 1)
+            print(f"range {first}-{last} of {SEEK_FILE}: {status}, {len(body)} bytes, {headers.get('Content-Range')}")
+
+            failures = []
+            if warm_body:
+                failures.append(f"warm reload transferred {warm_body} body bytes (expected 0)")
+            if status != 206 or body != expected:
+                failures.append("range request did not return exactly the requested bytes")
+    finally:
+        shutil.rmtree(static_dir, ignore_errors=True)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+bench/transcripts.py
+
+What recording transcripts costs a request, and how fast they come back.
+
+In-process, against a temporary SQLite file (or --backend jsonl):
+- per turn: TranscriptLog.record() (what chat() pays) vs writing the
+  same row synchronously, one transaction per turn (what chat() would
+  pay without the background writer)
+- burst: more turns at once than the queue holds; every turn must be
+  either written or counted as dropped, and the writer's throughput
+  is reported
+- restore: --sessions sessions of 6 turns each, read back with recent()
+  and put into an empty session store, as startup.py does
+
+Fails (exit code 1) if record() p99 is not below the synchronous write
+p50, if the burst loses a turn without counting it, or if a restored
+session has the wrong stage.
+
+Usage (from backend/):
+
+    python -m bench.transcripts [--turns 2000] [--sessions 5000] [--backend sqlite]
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from bench.common import percentile
+from session_store import MemorySessionBackend
+from transcripts import JSONLTranscriptStore, SQLiteTranscriptStore, TranscriptLog, _row
+
+
+def turn(i, session_id="bench", stage=1):
+    return dict(
+        session_id=session_id,
+        stage=stage,
+        is_final=stage >= 6,
+        source="llm",
+        prompt_version="bench",
+        messages=[{"role": "system", "content": "x" * 12000}, {"role": "user", "content": f"message {i}"}],
+        user_message=f"message {i}",
+        reply="Hiii my Boo 👻 how was your day, mister? Tell me everything 🐾",
+        prompt_tokens=4500,
+        completion_tokens=40,
+        latency_ms=250.0,
+    )
+
+
+def make_store(backend, directory, name):
+    if backend == "jsonl":
+        return JSONLTranscriptStore(os.path.join(directory, name))
+    return SQLiteTranscriptStore(os.path.join(directory, f"{name}.db"))
+
+
+def per_turn(backend, directory, count):
+    """
+    (record() latencies, synchronous write latencies), in seconds. The two
+    alternate, so both run under the same conditions.
+    """
+    log = TranscriptLog(make_store(backend, directory, "async"))
+    store = make_store(backend, directory, "sync")
+    queued, synchronous = [], []
+    for i in range(count):
+        started = time.perf_counter()
+        log.record(**turn(i))
+        queued.append(time.perf_counter() - started)
+
+        record = turn(i)
+        record["ts"] = time.time()
+        started = time.perf_counter()
+        store.write([_row(record)])
+        synchronous.append(time.perf_counter() - started)
+
+        # About one turn per ms, so the queue never fills
+        time.sleep(0.001)
+    log.flush(timeout=30)
+    return queued, synchronous
+
+
+def burst(backend, directory, count, queue_size):
+    log = TranscriptLog(make_store(backend, directory, "burst"), queue_size=queue_size)
+    started = time.perf_counter()
+    for i in range(count):
+        log.record(**turn(i))
+    log.flush(timeout=60)
+    return log.stats(), time.perf_counter() - started
+
+
+def restore(backend, directory, sessions, turns_each=6):
+    store = make_store(backend, directory, "restore")
+    now = time.time()
+    rows = []
+    for n in range(sessions):
+        for stage in range(1, turns_each + 1):
+            record = turn(stage, f"session-{n}", stage)
+            record["ts"] = now - 600 + n * 0.01 + stage * 0.001
+            rows.append(_row(record))
+    for start in range(0, len(rows), 1000):
+        store.write(rows[start:start + 1000])
+
+    sessions_store = MemorySessionBackend(max_sessions=sessions)
+    started = time.perf_counter()
+    recent = store.recent(now - 3600, sessions, 3)
+    for session_id, session_rows in recent:
+        sessions_store.restore(session_id, session_rows[-1]["stage"], now - session_rows[-1]["ts"])
+    elapsed = time.perf_counter() - started
+
+    wrong = sum(sessions_store.get_stage(f"session-{n}") != turns_each for n in range(sessions))
+    return elapsed, len(recent), wrong
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=2000)
+    parser.add_argument("--sessions", type=int, default=5000)
+    parser.add_argument("--backend", choices=("sqlite", "jsonl"), default="sqlite")
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        queued, synchronous = per_turn(args.backend, directory, args.turns)
+        print(f"{'per turn':24} {'p50':>9} {'p99':>9}")
+        for name, latencies in (("record() (queued)", queued), ("synchronous write", synchronous)):
+            print(f"{name:24} {percentile(latencies, 50) * 1e6:7.1f}µs {percentile(latencies, 99) * 1e6:7.1f}µs")
+        if percentile(queued, 99) >= percentile(synchronous, 50):
+            failures.append("record() p99 is not below a synchronous write")
+
+        count = args.turns * 10
+        stats, seconds = burst(args.backend, directory, count, queue_size=args.turns)
+        print(
+            f"\nburst of {count}: {stats['written']} written in {stats['batches']} batches, "
+            f"{stats['dropped']} dropped, {stats['written'] / seconds:.0f} turns/s"
+        )
+        if stats["written"] + stats["dropped"] != count or stats["write_errors"]:
+            failures.append(f"burst: {count - stats['written'] - stats['dropped']} turns unaccounted for")
+
+        elapsed, restored, wrong = restore(args.backend, directory, args.sessions)
+        print(f"restore: {restored} sessions in {elapsed * 1000:.0f} ms")
+        if restored != args.sessions or wrong:
+            failures.append(f"restore: {restored} of {args.sessions} sessions, {wrong} with the wrong stage")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+bench/transport.py
+
+Per-message round-trip overhead: POST /chat/stream (what the frontend
+used for every message) vs the WebSocket channel (/ws).
+
+Starts asgi:app (uvicorn worker) with a stub LLM that answers instantly,
+so what is measured is the transport, not the model. Sends the same
+number of messages, one after another, four ways:
+
+- POST, new connection  → TCP connect + CORS preflight + POST per message
+                          (a phone whose idle connection was dropped)
+- POST, preflight       → keep-alive, but OPTIONS + POST per message
+                          (browsers cache a preflight for seconds only)
+- POST, keep-alive      → POST only: the best case for HTTP
+- WebSocket             → one frame each way on an open connection
+
+Both stream the reply token by token. Every request carries a typical
+browser header set, so the byte counts are close to what a browser would
+send. The bytes are approximate: HTTP headers + bodies, WebSocket frame
+headers + payloads. The WebSocket handshake is paid once per session
+and is not counted.
+
+On localhost a round trip costs almost nothing, so the table also
+estimates each transport at a mobile round-trip time (--rtt-ms):
+local latency + extra round trips x RTT. Preflight is one extra round
+trip. A new connection adds two more (TCP + TLS 1.3).
+
+Fails (exit code 1) on any error, or if the WebSocket isn't faster than
+POST with a preflight.
+
+Usage (from backend/):
+
+    python -m bench.transport [--messages 200] [--rtt-ms 150]
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import http.client
+import json
+import sys
+import time
+
+from websockets.sync.client import connect
+
+from bench.common import percentile, running_server
+
+
+# What Chrome on Android sends with a fetch() from the Netlify frontend
+BROWSER_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Linux; Android 14; Pixel 7) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/126.0.0.0 Mobile Safari/537.36"
+    ),
+    "Accept": "*/*",
+    "Accept-Language": "en-IN,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate, br, zstd",
+    "Origin": "https://artybot.netlify.app",
+    "Referer": "https://artybot.netlify.app/",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "cross-site",
+    "Sec-Fetch-Dest": "empty",
+}
+
+PREFLIGHT_HEADERS = {
+    **BROWSER_HEADERS,
+    "Access-Control-Request-Method": "POST",
+    "Access-Control-Request-Headers": "content-type,idempotency-key",
+}
+
+# Extra round trips per message, on top of the one every transport needs
+EXTRA_ROUND_TRIPS = {
+    "POST, new connection": 3,
+    "POST, preflight": 1,
+    "POST, keep-alive": 0,
+    "WebSocket": 0,
+}
+
+
+def message(i):
+    # Distinct messages: no reply cache hits, no coalescing
+    return f"message {i}: tell me something about our last trip"
+
+
+def header_bytes(first_line, headers):
+    return len(first_line) + 2 + sum(len(k) + len(v) + 4 for k, v in headers) + 2
+
+
+# -------------------------
+# HTTP
+# -------------------------
+
+def http_exchange(conn, method, path, headers, body=b""):
+    """
+    One request; returns (status, approximate bytes both ways).
+    """
+    conn.request(method, path, body=body or None, headers=headers)
+    response = conn.getresponse()
+    payload = response.read()
+    sent = header_bytes(f"{method} {path} HTTP/1.1", [("Host", "artybot-backend.onrender.com"), *headers.items()])
+    received = header_bytes("HTTP/1.1 200 OK", response.getheaders())
+    return response.status, sent + len(body) + received + len(payload)
+
+
+def run_http(port, count, mode, session_id):
+    latencies, total_bytes, errors = [], 0, 0
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    for i in range(count):
+        body = json.dumps({"message": message(i), "session_id": session_id}).encode()
+        headers = {**BROWSER_HEADERS, "Content-Type": "application/json", "Idempotency-Key": f"{session_id}-{i}"}
+        started = time.perf_counter()
+        if mode == "POST, new connection":
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        if mode != "POST, keep-alive":
+            status, size = http_exchange(conn, "OPTIONS", "/chat/stream", PREFLIGHT_HEADERS)
+            total_bytes += size
+            errors += status not in (200, 204)
+        status, size = http_exchange(conn, "POST", "/chat/stream", headers, body)
+        latencies.append(time.perf_counter() - started)
+        total_bytes += size
+        errors += status != 200
+    conn.close()
+    return latencies, total_bytes, errors
+
+
+# -------------------------
+# WebSocket
+# -------------------------
+
+def frame_bytes(payload, masked):
+    size = len(payload.encode("utf-8"))
+    header = 2 if size < 126 else 4
+    return size + header + (4 if masked else 0)
+
+
+def run_websocket(port, count, session_id):
+    latencies, total_bytes, errors = [], 0, 0
+    with connect(f"ws://127.0.0.1:{port}/ws", additional_headers={"Origin": BROWSER_HEADERS["Origin"]}) as ws:
+        ws.send(json.dumps({"type": "hello", "session_id": session_id}))
+        if json.loads(ws.recv(timeout=10))["type"] != "ready":
+            raise RuntimeError("no ready frame")
+
+        for i in range(count):
+            outgoing = json.dumps({"type": "message", "id": f"{session_id}-{i}", "message": message(i)})
+            started = time.perf_counter()
+            ws.send(outgoing)
+            total_bytes += frame_bytes(outgoing, masked=True)
+            while True:
+                incoming = ws.recv(timeout=30)
+                total_bytes += frame_bytes(incoming, masked=False)
+                kind = json.loads(incoming)["type"]
+                if kind in ("done", "final"):
+                    break
+                if kind in ("busy", "error"):
+                    errors += 1
+                    break
+            latencies.append(time.perf_counter() - started)
+    return latencies, total_bytes, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--rtt-ms", type=float, default=150, help="mobile round-trip time for the estimate")
+    args = parser.parse_args()
+
+    env = dict(
+        GUNICORN_WORKER_CLASS="uvicorn.workers.UvicornWorker",
+        WEB_CONCURRENCY=1,
+        STUB_TTFT="fixed:0",
+        STUB_TOKENS_PER_SECOND=1000000,
+        STUB_REPLY_TOKENS=20,
+        REPLY_CACHE_BACKEND="off",
+    )
+    results = {}
+    with running_server("asgi:app", **env) as port:
+        for mode in EXTRA_ROUND_TRIPS:
+            session_id = f"transport-{mode.split(',')[0].lower()}-{len(results)}"
+            if mode == "WebSocket":
+                results[mode] = run_websocket(port, args.messages, session_id)
+            else:
+                results[mode] = run_http(port, args.messages, mode, session_id)
+
+    print(f"{'transport':22} {'p50':>8} {'p95':>8} {'bytes/msg':>10} {f'est. @{args.rtt_ms:.0f}ms RTT':>18}")
+    failures = []
+    p50 = {}
+    for mode, (latencies, total_bytes, errors) in results.items():
+        p50[mode] = percentile(latencies, 50)
+        estimate = p50[mode] * 1000 + (1 + EXTRA_ROUND_TRIPS[mode]) * args.rtt_ms
+        print(
+            f"{mode:22} {p50[mode] * 1000:6.2f}ms {percentile(latencies, 95) * 1000:6.2f}ms "
+            f"{total_bytes / args.messages:10.0f} {estimate:16.0f}ms"
+        )
+        if errors:
+            failures.append(f"{mode}: {errors} errors")
+
+    if p50["WebSocket"] >= p50["POST, preflight"]:
+        failures.append("WebSocket round trip is not faster than POST with a preflight")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+bench/worker_models.py
+
+Compares gunicorn worker models for /chat against a stubbed LLM.
+
+For each worker model, starts gunicorn with gunicorn.conf.py, drives /chat
+with N concurrent clients for a fixed time, and reports requests/sec and
+p50 / p99 latency. The LLM is the local stub backend (LLM_BACKEND=stub)
+with a fixed latency, so the numbers show how many slow LLM calls each
+model can hold.
+
+Usage (from backend/):
+
+    python -m bench.worker_models [--concurrency 64] [--duration 10]
+                                  [--llm-latency-ms 300] [--workers 2]
+                                  [--models sync,gthread,gevent,uvicorn]
+
+Worker models whose package is not installed (gevent, uvicorn) are skipped.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import importlib.util
+import json
+
+from bench.common import drive_load, latency_summary, running_server
+
+
+# name → (worker class, app module, python package that must be installed)
+WORKER_MODELS = {
+    "sync": ("sync", "app:app", None),
+    "gthread": ("gthread", "app:app", None),
+    "gevent": ("gevent", "app:app", "gevent"),
+    "uvicorn": ("uvicorn.workers.UvicornWorker", "asgi:app", "uvicorn"),
+}
+
+
+def run_model(name, args):
+    worker_class, app_path, package = WORKER_MODELS[name]
+    if package and importlib.util.find_spec(package) is None:
+        print(f"{name:8} skipped ({package} not installed)")
+        return None
+
+    env = dict(
+        WEB_CONCURRENCY=args.workers,
+        GUNICORN_WORKER_CLASS=worker_class,
+        # gunicorn silently turns "sync" into "gthread" when threads > 1
+        GUNICORN_THREADS=1 if name == "sync" else args.threads,
+        STUB_TTFT=f"fixed:{args.llm_latency_ms}",
+        STUB_TOKENS_PER_SECOND=1000000,
+        LLM_MAX_CONCURRENCY=max(args.concurrency, 1),
+        # Every request must reach the (stub) LLM
+        REPLY_CACHE_BACKEND="off",
+    )
+    try:
+        with running_server(app_path, **env) as port:
+            latencies, errors, elapsed = drive_load(
+                port,
+                args.concurrency,
+                args.duration,
+                lambda n, i: {"message": "hi", "session_id": f"bench-{n}"},
+            )
+    except RuntimeError as e:
+        print(f"{name:8} failed to start ({e}); run gunicorn by hand to see why")
+        return None
+
+    result = {"model": name, **latency_summary(latencies, elapsed, errors)}
+    print(
+        f"{name:8} {result['rps']:8.1f} req/s   p50 {result['p50_ms']:8.1f} ms   "
+        f"p99 {result['p99_ms']:8.1f} ms   errors {result['errors']}"
+    )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--models", default="sync,gthread,gevent,uvicorn")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    print(
+        f"{args.concurrency} clients, {args.duration:.0f}s per model, "
+        f"LLM latency {args.llm_latency_ms:.0f} ms, {args.workers} workers"
+    )
+    results = [run_model(name.strip(), args) for name in args.models.split(",")]
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump([r for r in results if r], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+gunicorn.conf.py
+
+Production server settings for ArtyBot (picked up automatically by
+`gunicorn app:app` when run from backend/, or pass `-c gunicorn.conf.py`).
+
+Worker models (set GUNICORN_WORKER_CLASS):
+- "gthread" (default) → each worker runs GUNICORN_THREADS threads, so a
+  slow Groq call blocks one thread, not the whole worker
+- "gevent"            → green threads; thousands of waiting calls per
+  worker (needs `pip install gevent`)
+- "sync"              → the old behaviour: one request per worker
+- "uvicorn.workers.UvicornWorker" → fully async; use with `asgi:app`
+
+Cold start (see startup.py):
+- Every worker warms up (LLM SDK imported, prompt built, connection to
+  Groq open) BEFORE it accepts its first request
+- GUNICORN_PRELOAD=1 imports the app once in the master and forks the
+  workers from it: they start faster and share that memory (the
+  compiled persona prompt included, see prompts.py). The LLM client is
+  still created in each worker, after the fork.
+
+Every setting can be overridden with an environment variable, so the
+Render start command can stay `gunicorn app:app`.
+"""
+
+import os
+import shutil
+import tempfile
+
+# Render passes the port in $PORT
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+
+# A small Render instance has 0.5-1 CPU: a couple of workers is plenty,
+# concurrency comes from threads / green threads / async instead
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+
+# gthread only: threads per worker
+threads = int(os.getenv("GUNICORN_THREADS", "8"))
+
+# gevent / async only: max simultaneous connections per worker
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# Streaming replies can take a while; don't kill workers mid-stream
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = 30
+
+# Keep connections from the frontend open between messages
+keepalive = 5
+
+# Import the app in the master, before forking the workers
+preload_app = os.getenv("GUNICORN_PRELOAD", "0") == "1"
+
+# "-" = stdout (Render logs); set GUNICORN_ACCESSLOG="" to turn it off
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-") or None
+
+# Prometheus multiprocess mode (see metrics.py): every worker writes its
+# metrics to files here and /metrics adds them up. Must be set before the
+# workers import the app.
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), f"artybot-metrics-{bind.rsplit(':', 1)[1]}")
+)
+
+# With preload_app the master imports the app (and creates its metrics)
+# before on_starting runs, so the directory has to exist already
+os.makedirs(metrics_dir, exist_ok=True)
+
+
+def on_starting(server):
+    # Values left over from a previous run would be added to this one
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid, metrics_dir)
+
+
+def when_ready(server):
+    # Preloaded: do the fork-safe part of the warm-up once, here in the
+    # master, so every worker inherits it
+    if server.cfg.preload_app:
+        import gc
+
+        import startup
+
+        startup.prepare()
+        # What the master built (compiled prompt, knowledge index...) is
+        # never collected: the GC stops touching it, so workers keep
+        # sharing those pages instead of copying them on their first GC
+        gc.freeze()
+
+
+def post_worker_init(worker):
+    # Runs in the worker before it accepts requests
+    import startup
+
+    startup.warm_up()
+
+
+def worker_exit(server, worker):
+    # Write the transcripts still queued (restarts, deploys, max_requests)
+    import llm
+
+    llm.transcript_log.flush(timeout=5)
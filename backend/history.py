@@ -0,0 +1,556 @@
+"""
+history.py
+
+Per-session conversation history for ArtyBot, kept under a token budget.
+
+What this file does:
+- Remembers what Tapas and Artija said, per session
+- Keeps the most recent messages word for word
+- Once those grow past HISTORY_RECENT_TOKENS, the oldest ones are folded
+  into a short rolling summary by a background thread, so the request
+  that triggered it does not wait for the summarizer
+- Turns a session's history into chat messages that fit a token budget
+  (summary first, then as many recent messages as fit, newest kept)
+
+Backends (HISTORY_BACKEND, defaults to SESSION_BACKEND):
+- "memory" → per worker process
+- "sqlite" → the shared SQLite file (WAL), same approach as session_store.py
+
+Important:
+- This file does NOT call the LLM: llm.py passes in a `summarize`
+  function (previous summary + old messages → new summary)
+- If summarizing fails, the messages stay and are retried after the
+  next turn; the prompt budget is still enforced when rendering
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from session_store import SESSION_BACKEND, SESSION_DB_PATH, SESSION_MAX, SESSION_TTL_SECONDS
+from tokens import estimate_tokens, truncate_to_tokens
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+HISTORY_BACKEND = os.getenv("HISTORY_BACKEND", SESSION_BACKEND)
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", SESSION_DB_PATH)
+
+# Verbatim messages are compacted once they add up to more than this
+HISTORY_RECENT_TOKENS = int(os.getenv("HISTORY_RECENT_TOKENS", "800"))
+
+# How many of the newest messages compaction always leaves verbatim
+HISTORY_KEEP_MESSAGES = int(os.getenv("HISTORY_KEEP_MESSAGES", "6"))
+
+# Hard cap on stored messages per session, in case summarizing keeps failing
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "60"))
+
+# Background summarizer threads per worker process (0 = summarize on the
+# request thread, so a replay is deterministic: bench/replay.py)
+HISTORY_SUMMARY_WORKERS = int(os.getenv("HISTORY_SUMMARY_WORKERS", "1"))
+
+# A compaction claimed longer ago than this is assumed dead (sqlite)
+COMPACTION_LEASE_SECONDS = 120
+
+
+# -------------------------
+# Snapshots and rendering
+# -------------------------
+
+class HistoryMessage:
+    __slots__ = ("seq", "role", "content", "tokens")
+
+    def __init__(self, seq, role, content, tokens):
+        self.seq = seq
+        self.role = role
+        self.content = content
+        self.tokens = tokens
+
+
+class HistorySnapshot:
+    """
+    A session's history at one moment: the rolling summary and the
+    messages kept verbatim (oldest first).
+    """
+
+    __slots__ = ("summary", "messages")
+
+    def __init__(self, summary="", messages=()):
+        self.summary = summary
+        self.messages = list(messages)
+
+    def __bool__(self):
+        return bool(self.summary or self.messages)
+
+    def recent_tokens(self):
+        return sum(m.tokens for m in self.messages)
+
+    def to_messages(self, token_budget):
+        """
+        Chat messages for the prompt, within `token_budget` (estimated).
+
+        The summary gets at most half the budget; recent messages fill the
+        rest from newest to oldest, and stop at the first one that does not
+        fit (skipping one would leave a confusing gap).
+        """
+        out, used = [], 0
+
+        if self.summary:
+            summary = truncate_to_tokens(self.summary, token_budget // 2)
+            used += estimate_tokens(summary)
+            out.append({"role": "system", "content": "CONVERSATION SO FAR (summary):\n" + summary})
+
+        recent = []
+        for message in reversed(self.messages):
+            if used + message.tokens > token_budget:
+                break
+            recent.append({"role": message.role, "content": message.content})
+            used += message.tokens
+
+        out.extend(reversed(recent))
+        return out
+
+
+def _overflow(messages, recent_tokens, keep_messages):
+    """
+    Oldest messages to compact so the rest fit `recent_tokens`, always
+    leaving the newest `keep_messages` alone. Returns a prefix of `messages`.
+    """
+    total = sum(m.tokens for m in messages)
+    count = 0
+    while total > recent_tokens and count < len(messages) - keep_messages:
+        total -= messages[count].tokens
+        count += 1
+    return messages[:count]
+
+
+# -------------------------
+# In-process backend
+# -------------------------
+
+class _Conversation:
+    __slots__ = ("summary", "messages", "next_seq", "last_seen", "compacting")
+
+    def __init__(self, now):
+        self.summary = ""
+        self.messages = []
+        self.next_seq = 1
+        self.last_seen = now
+        self.compacting = False
+
+
+class MemoryHistoryBackend:
+    """
+    LRU + TTL conversations inside one worker process.
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl_seconds=SESSION_TTL_SECONDS, max_messages=HISTORY_MAX_MESSAGES, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self._clock = clock
+        self._conversations = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def _live(self, session_id, now):
+        conversation = self._conversations.get(session_id)
+        if conversation is not None and now - conversation.last_seen > self.ttl_seconds:
+            del self._conversations[session_id]
+            conversation = None
+        return conversation
+
+    def snapshot(self, session_id):
+        with self._lock:
+            conversation = self._live(session_id, self._clock())
+            if conversation is None:
+                return HistorySnapshot()
+            return HistorySnapshot(conversation.summary, conversation.messages)
+
+    def append(self, session_id, pairs):
+        """
+        Stores [(role, content), ...] and returns the verbatim token total.
+        """
+        now = self._clock()
+        with self._lock:
+            conversation = self._live(session_id, now)
+            if conversation is None:
+                conversation = _Conversation(now)
+                self._conversations[session_id] = conversation
+            self._conversations.move_to_end(session_id)
+            conversation.last_seen = now
+
+            for role, content in pairs:
+                conversation.messages.append(
+                    HistoryMessage(conversation.next_seq, role, content, estimate_tokens(content))
+                )
+                conversation.next_seq += 1
+            del conversation.messages[:-self.max_messages]
+
+            while len(self._conversations) > self.max_sessions:
+                self._conversations.popitem(last=False)
+
+            return sum(m.tokens for m in conversation.messages)
+
+    def claim_compaction(self, session_id, recent_tokens, keep_messages):
+        """
+        Returns (summary, messages to fold in) and marks the session as
+        being compacted, or None if there is nothing to do.
+        """
+        with self._lock:
+            conversation = self._live(session_id, self._clock())
+            if conversation is None or conversation.compacting:
+                return None
+            overflow = _overflow(conversation.messages, recent_tokens, keep_messages)
+            if not overflow:
+                return None
+            conversation.compacting = True
+            return conversation.summary, list(overflow)
+
+    def finish_compaction(self, session_id, summary, upto_seq):
+        """
+        Replaces the summary and drops the messages it now covers.
+        summary=None only releases the claim (summarizing failed).
+        """
+        with self._lock:
+            conversation = self._conversations.get(session_id)
+            if conversation is None:
+                return
+            conversation.compacting = False
+            if summary is not None:
+                conversation.summary = summary
+                conversation.messages = [m for m in conversation.messages if m.seq > upto_seq]
+
+    def reset(self, session_id):
+        with self._lock:
+            self._conversations.pop(session_id, None)
+
+
+# -------------------------
+# Shared SQLite backend
+# -------------------------
+
+class SQLiteHistoryBackend:
+    """
+    Conversations in the shared SQLite file, next to the sessions table.
+
+    - history_messages: one row per message, keyed by (session_id, seq)
+    - history_sessions: the rolling summary, the next seq, and a
+      compaction lease so only one worker summarizes a session at a time
+    """
+
+    def __init__(
+        self,
+        path=HISTORY_DB_PATH,
+        max_sessions=SESSION_MAX,
+        ttl_seconds=SESSION_TTL_SECONDS,
+        max_messages=HISTORY_MAX_MESSAGES,
+        prune_every=256,
+        clock=time.time,
+    ):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self.prune_every = prune_every
+        self._clock = clock
+        self._local = threading.local()
+        self._writes = 0
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS history_sessions (
+                session_id       TEXT PRIMARY KEY,
+                summary          TEXT    NOT NULL,
+                next_seq         INTEGER NOT NULL,
+                compacting_since REAL,
+                last_seen        REAL    NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS history_messages (
+                session_id TEXT    NOT NULL,
+                seq        INTEGER NOT NULL,
+                role       TEXT    NOT NULL,
+                content    TEXT    NOT NULL,
+                tokens     INTEGER NOT NULL,
+                PRIMARY KEY (session_id, seq)
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS history_sessions_last_seen ON history_sessions (last_seen)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # A forked worker must not reuse the parent's connection
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM history_sessions").fetchone()[0]
+
+    def _messages(self, conn, session_id):
+        return [
+            HistoryMessage(*row)
+            for row in conn.execute(
+                "SELECT seq, role, content, tokens FROM history_messages WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            )
+        ]
+
+    def snapshot(self, session_id):
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT summary, last_seen FROM history_sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or self._clock() - row[1] > self.ttl_seconds:
+            return HistorySnapshot()
+        return HistorySnapshot(row[0], self._messages(conn, session_id))
+
+    def append(self, session_id, pairs):
+        now = self._clock()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT next_seq, last_seen FROM history_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM history_messages WHERE session_id = ?", (session_id,))
+                row = None
+            next_seq = 1 if row is None else row[0]
+
+            conn.executemany(
+                "INSERT INTO history_messages (session_id, seq, role, content, tokens) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (session_id, next_seq + offset, role, content, estimate_tokens(content))
+                    for offset, (role, content) in enumerate(pairs)
+                ],
+            )
+            next_seq += len(pairs)
+
+            conn.execute(
+                """
+                INSERT INTO history_sessions (session_id, summary, next_seq, last_seen) VALUES (?, '', ?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    summary = CASE WHEN ? THEN '' ELSE summary END,
+                    next_seq = excluded.next_seq,
+                    last_seen = excluded.last_seen
+                """,
+                (session_id, next_seq, now, row is None),
+            )
+            conn.execute(
+                "DELETE FROM history_messages WHERE session_id = ? AND seq < ?",
+                (session_id, next_seq - self.max_messages),
+            )
+            (total,) = conn.execute(
+                "SELECT COALESCE(SUM(tokens), 0) FROM history_messages WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune(now)
+
+        return total
+
+    def claim_compaction(self, session_id, recent_tokens, keep_messages):
+        now = self._clock()
+        conn = self._connection()
+
+        # Takes the lease atomically, so two workers never summarize the
+        # same session at once
+        row = conn.execute(
+            """
+            UPDATE history_sessions SET compacting_since = ?
+            WHERE session_id = ? AND (compacting_since IS NULL OR compacting_since < ?)
+            RETURNING summary
+            """,
+            (now, session_id, now - COMPACTION_LEASE_SECONDS),
+        ).fetchone()
+        if row is None:
+            return None
+
+        overflow = _overflow(self._messages(conn, session_id), recent_tokens, keep_messages)
+        if not overflow:
+            conn.execute("UPDATE history_sessions SET compacting_since = NULL WHERE session_id = ?", (session_id,))
+            return None
+        return row[0], overflow
+
+    def finish_compaction(self, session_id, summary, upto_seq):
+        conn = self._connection()
+        if summary is None:
+            conn.execute("UPDATE history_sessions SET compacting_since = NULL WHERE session_id = ?", (session_id,))
+            return
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "UPDATE history_sessions SET summary = ?, compacting_since = NULL WHERE session_id = ?",
+                (summary, session_id),
+            )
+            conn.execute(
+                "DELETE FROM history_messages WHERE session_id = ? AND seq <= ?", (session_id, upto_seq)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def prune(self, now=None):
+        """
+        Deletes expired conversations and trims to `max_sessions`.
+        """
+        now = self._clock() if now is None else now
+        conn = self._connection()
+        conn.execute("DELETE FROM history_sessions WHERE last_seen < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            """
+            DELETE FROM history_sessions WHERE session_id IN (
+                SELECT session_id FROM history_sessions
+                ORDER BY last_seen DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_sessions,),
+        )
+        conn.execute(
+            """
+            DELETE FROM history_messages
+            WHERE session_id NOT IN (SELECT session_id FROM history_sessions)
+            """
+        )
+
+    def reset(self, session_id):
+        conn = self._connection()
+        conn.execute("DELETE FROM history_sessions WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM history_messages WHERE session_id = ?", (session_id,))
+
+
+# -------------------------
+# History with background summarization
+# -------------------------
+
+class ConversationHistory:
+    """
+    What llm.py uses: read a snapshot, record a finished turn.
+
+    summarize(previous_summary, messages) → new summary text
+    (runs on a background thread; may raise)
+    """
+
+    def __init__(
+        self,
+        backend,
+        summarize,
+        recent_tokens=HISTORY_RECENT_TOKENS,
+        keep_messages=HISTORY_KEEP_MESSAGES,
+        summary_workers=HISTORY_SUMMARY_WORKERS,
+    ):
+        self.backend = backend
+        self.summarize = summarize
+        self.recent_tokens = recent_tokens
+        self.keep_messages = keep_messages
+        self.summary_workers = summary_workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._stats = {"compactions": 0, "summary_failures": 0}
+
+    def snapshot(self, session_id):
+        return self.backend.snapshot(session_id)
+
+    def record(self, session_id, user_message, reply):
+        """
+        Stores one exchange; schedules compaction if the verbatim part
+        has outgrown its budget. Never waits for the summarizer.
+        """
+        total = self.backend.append(session_id, [("user", user_message), ("assistant", reply)])
+        if total > self.recent_tokens:
+            self._submit(session_id)
+
+    def restore(self, session_id, pairs):
+        """
+        Puts back [(role, content), ...] from before a restart (see
+        llm.restore_sessions), without compacting.
+        """
+        self.backend.append(session_id, pairs)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _submit(self, session_id):
+        if self.summary_workers <= 0:
+            self.compact(session_id)
+            return
+
+        # Threads do not survive a fork: each gunicorn worker gets its own pool
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.summary_workers, thread_name_prefix="history-summary")
+                self._pid = os.getpid()
+            executor = self._executor
+        executor.submit(self.compact, session_id)
+
+    def compact(self, session_id):
+        """
+        Folds the oldest verbatim messages into the rolling summary.
+        """
+        job = self.backend.claim_compaction(session_id, self.recent_tokens, self.keep_messages)
+        if job is None:
+            return
+        summary, messages = job
+
+        try:
+            new_summary = self.summarize(summary, messages)
+        except Exception as e:
+            print("History summary error:", e)
+            new_summary = None
+
+        with self._lock:
+            self._stats["compactions" if new_summary else "summary_failures"] += 1
+        self.backend.finish_compaction(session_id, new_summary or None, messages[-1].seq)
+
+    def reset(self, session_id):
+        self.backend.reset(session_id)
+
+
+# -------------------------
+# Factory
+# -------------------------
+
+def create_history(summarize, backend=None):
+    """
+    Builds the conversation history selected by HISTORY_BACKEND.
+    """
+    backend = backend or HISTORY_BACKEND
+
+    if backend == "memory":
+        return ConversationHistory(MemoryHistoryBackend(), summarize)
+    if backend == "sqlite":
+        return ConversationHistory(SQLiteHistoryBackend(), summarize)
+
+    raise ValueError(f"Unknown HISTORY_BACKEND: {backend!r} (expected 'memory' or 'sqlite')")
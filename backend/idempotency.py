@@ -0,0 +1,238 @@
+"""
+idempotency.py
+
+Stored replies for chat requests sent with an `Idempotency-Key` header.
+
+Why:
+- When a POST to /chat times out on the client side, the browser sends it
+  again. Without a key, the retry advances the stage a second time and
+  generates a brand new reply
+- With a key, the first request stores its (reply, is_final) here and the
+  retry gets exactly that back, without touching the stage or the LLM
+
+Backends (IDEMPOTENCY_BACKEND):
+- "memory" → per worker process (default)
+- "sqlite" → a local SQLite file in WAL mode shared by all gunicorn
+             workers, so a retry that lands on another worker still hits
+- "off"    → keys are accepted but nothing is stored
+
+Important:
+- Keys are scoped to the session: one session can never read another's reply
+- Bounded: LRU eviction by key count, TTL expiry
+- The "something glitched" fallback is never stored, so retrying after
+  a failure really retries
+- This file does NOT call the LLM
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+IDEMPOTENCY_DB_PATH = os.getenv("IDEMPOTENCY_DB_PATH", "artybot_idempotency.db")
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "10000"))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "3600"))
+
+# The frontend sends a UUID; anything much longer is not ours
+MAX_IDEMPOTENCY_KEY_LENGTH = 128
+
+
+def is_valid_idempotency_key(key):
+    """
+    True if `key` looks like something the frontend generated.
+    """
+    return (
+        isinstance(key, str)
+        and 0 < len(key) <= MAX_IDEMPOTENCY_KEY_LENGTH
+        and key.isprintable()
+    )
+
+
+def _store_key(session_id, key):
+    return f"{session_id}|{key}"
+
+
+# -------------------------
+# In-process backend
+# -------------------------
+
+class MemoryIdempotencyStore:
+    """
+    LRU + TTL map of (session, key) → (reply, is_final) inside one worker.
+    """
+
+    def __init__(self, max_keys=IDEMPOTENCY_MAX_KEYS, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, clock=time.monotonic):
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, session_id, key):
+        """
+        (reply, is_final) stored for this key, or None.
+        """
+        store_key = _store_key(session_id, key)
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(store_key)
+            if entry is None:
+                return None
+            if now - entry[2] > self.ttl_seconds:
+                del self._entries[store_key]
+                return None
+            return entry[0], entry[1]
+
+    def put(self, session_id, key, reply, is_final):
+        store_key = _store_key(session_id, key)
+        now = self._clock()
+        with self._lock:
+            self._entries[store_key] = (reply, is_final, now)
+            self._entries.move_to_end(store_key)
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+
+# -------------------------
+# Shared SQLite backend
+# -------------------------
+
+class SQLiteIdempotencyStore:
+    """
+    Stored replies in a local SQLite file (WAL), shared by gunicorn workers.
+
+    Same approach as session_store.SQLiteSessionBackend: per-thread
+    connections, single-statement writes, periodic pruning.
+    """
+
+    def __init__(
+        self,
+        path=IDEMPOTENCY_DB_PATH,
+        max_keys=IDEMPOTENCY_MAX_KEYS,
+        ttl_seconds=IDEMPOTENCY_TTL_SECONDS,
+        prune_every=256,
+        clock=time.time,
+    ):
+        self.path = path
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self._clock = clock
+        self._local = threading.local()
+        self._writes = 0
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS idempotency (
+                store_key TEXT PRIMARY KEY,
+                reply     TEXT    NOT NULL,
+                is_final  INTEGER NOT NULL,
+                created   REAL    NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idempotency_created ON idempotency (created)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+
+    def get(self, session_id, key):
+        row = self._connection().execute(
+            "SELECT reply, is_final FROM idempotency WHERE store_key = ? AND created >= ?",
+            (_store_key(session_id, key), self._clock() - self.ttl_seconds),
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], bool(row[1])
+
+    def put(self, session_id, key, reply, is_final):
+        now = self._clock()
+        self._connection().execute(
+            """
+            INSERT INTO idempotency (store_key, reply, is_final, created) VALUES (?, ?, ?, ?)
+            ON CONFLICT (store_key) DO UPDATE SET
+                reply = excluded.reply,
+                is_final = excluded.is_final,
+                created = excluded.created
+            """,
+            (_store_key(session_id, key), reply, int(is_final), now),
+        )
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune(now)
+
+    def prune(self, now=None):
+        now = self._clock() if now is None else now
+        conn = self._connection()
+        conn.execute("DELETE FROM idempotency WHERE created < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            """
+            DELETE FROM idempotency WHERE store_key IN (
+                SELECT store_key FROM idempotency
+                ORDER BY created DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_keys,),
+        )
+
+
+class DisabledIdempotencyStore:
+    """
+    IDEMPOTENCY_BACKEND=off: never stores, never replays.
+    """
+
+    def __len__(self):
+        return 0
+
+    def get(self, session_id, key):
+        return None
+
+    def put(self, session_id, key, reply, is_final):
+        pass
+
+
+# -------------------------
+# Factory
+# -------------------------
+
+def create_idempotency_store(backend=None):
+    """
+    Builds the store selected by IDEMPOTENCY_BACKEND.
+    """
+    backend = backend or IDEMPOTENCY_BACKEND
+
+    if backend == "memory":
+        return MemoryIdempotencyStore()
+    if backend == "sqlite":
+        return SQLiteIdempotencyStore()
+    if backend == "off":
+        return DisabledIdempotencyStore()
+
+    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {backend!r} (expected 'memory', 'sqlite' or 'off')")
@@ -0,0 +1,415 @@
+"""
+knowledge.py
+
+Retrieval over ArtyBot's long-term memory.
+
+What this file does:
+- Splits the knowledge base into sections and individual facts (chunks)
+- Builds an in-memory BM25 inverted index over those chunks at startup
+- Optionally scores chunks with a dependency-free vector embedding
+  (hashed character n-grams + cosine similarity), which is forgiving
+  of typos like "biriyani" vs "biryani"
+- Picks the top-k chunks for a message under a token budget
+
+Why:
+- Sending the ENTIRE knowledge base with every "hi" wastes input tokens
+  and slows down time-to-first-token
+- Only the memories relevant to the current message are sent,
+  plus an always-included core persona chunk
+
+Important:
+- This file does NOT call the LLM
+- llm.py builds one index at import and calls `index.select(...)` per message
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import math
+import os
+import re
+import zlib
+from collections import Counter, defaultdict
+
+from tokens import estimate_tokens
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+# "bm25" (default), "vector", or "hybrid" (both, scores blended)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "bm25")
+
+# At most this many memory chunks are injected per message
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "8"))
+
+# Token budget for the injected (non-core) memory chunks
+KNOWLEDGE_TOKEN_BUDGET = int(os.getenv("KNOWLEDGE_TOKEN_BUDGET", "700"))
+
+# Sections whose title starts with one of these are the core persona
+# (Artija's personality + how she texts). They are always sent as part of
+# the static system prompt and never retrieved.
+CORE_SECTION_PREFIXES = ("1.", "2.")
+
+# Chunks scoring below this fraction of the best match are dropped as noise
+RETRIEVAL_MIN_SCORE_RATIO = float(os.getenv("RETRIEVAL_MIN_SCORE_RATIO", "0.35"))
+
+# BM25 parameters (standard values)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Dimensions of the hashed n-gram vectors
+VECTOR_DIMENSIONS = 4096
+
+# Words that carry no meaning for retrieval
+STOPWORDS = frozenset("""
+a an and are as at be but by did do does for from had has have he her him his
+how i if in is it its just me my of on or our she so that the their them then
+there they this to u ur was we were what when where which who will with would
+you your yours im i'm its it's dont don't
+""".split())
+
+# How Tapas actually texts vs how the memory is written.
+# A query word on the left also searches for the words on the right.
+QUERY_ALIASES = {
+    "barca": ["fcb", "barcelona", "football"],
+    "barcelona": ["fcb", "football"],
+    "match": ["football"],
+    "game": ["football"],
+    "soccer": ["football"],
+    "madrid": ["real", "football"],
+    "messi": ["football", "argentina"],
+    "biryani": ["biriyani", "food"],
+    "hungry": ["hangry", "food"],
+    "eat": ["food"],
+    "dinner": ["food"],
+    "lunch": ["food"],
+    "song": ["music"],
+    "songs": ["music"],
+    "listening": ["music"],
+    "band": ["music", "bands"],
+    "film": ["movies"],
+    "movie": ["movies"],
+    "show": ["shows"],
+    "watch": ["movies", "shows"],
+    "watching": ["movies", "shows"],
+    "trip": ["travel"],
+    "trek": ["mountains", "travel"],
+    "hills": ["mountains"],
+    "love": ["puchi", "purpuri", "qre"],
+    "paw": ["paw-paw", "gestures"],
+    "meow": ["meowing", "meow"],
+    "puppy": ["dogs"],
+    "dog": ["dogs"],
+    "cat": ["cats", "animals"],
+    "plushie": ["plushies", "claw"],
+}
+
+
+# -------------------------
+# Text helpers
+# -------------------------
+
+_WORD_RE = re.compile(r"[a-z0-9]+(?:[-'][a-z0-9]+)*")
+
+
+def tokenize(text):
+    """
+    Lowercase words with stopwords removed and a very light plural stem.
+    """
+    words = []
+    for word in _WORD_RE.findall(text.lower()):
+        if word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def expand_query(text):
+    """
+    Query terms plus their aliases from QUERY_ALIASES.
+    """
+    terms = []
+    for word in _WORD_RE.findall(text.lower()):
+        terms.extend(tokenize(word))
+        for alias in QUERY_ALIASES.get(word, ()):
+            terms.extend(tokenize(alias))
+    return terms
+
+
+def embed(text):
+    """
+    Hashed character-trigram vector for `text`, L2-normalised.
+
+    Returned as a sparse {dimension: weight} dict.
+    """
+    counts = Counter()
+    for word in tokenize(text):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            counts[zlib.crc32(padded[i:i + 3].encode()) % VECTOR_DIMENSIONS] += 1
+
+    norm = math.sqrt(sum(v * v for v in counts.values())) or 1.0
+    return {dim: v / norm for dim, v in counts.items()}
+
+
+def cosine(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(weight * b.get(dim, 0.0) for dim, weight in a.items())
+
+
+# -------------------------
+# Chunking
+# -------------------------
+
+class Chunk:
+    """
+    One retrievable piece of memory.
+
+    kind:
+    - "fact"    → a single bullet / line
+    - "section" → a whole section kept together (e.g. the sample chat)
+    """
+
+    __slots__ = ("chunk_id", "section", "kind", "text", "tokens")
+
+    def __init__(self, chunk_id, section, kind, text):
+        self.chunk_id = chunk_id
+        self.section = section
+        self.kind = kind
+        self.text = text
+        # +1 for the "- " bullet it is rendered with
+        self.tokens = estimate_tokens(text) + 1
+
+    def __repr__(self):
+        return f"Chunk({self.chunk_id}, {self.section!r}, {self.text[:40]!r})"
+
+
+_DIALOG_LINE_RE = re.compile(r"^[A-Z]\s*:")
+
+# Very long paragraphs are split into sentence groups of about this size
+_MAX_FACT_CHARS = 500
+
+
+def _is_heading(line):
+    return (
+        not line.startswith("-")
+        and len(line) < 120
+        and (line.endswith("-") or line.endswith(":"))
+    )
+
+
+def _clean_title(line):
+    line = re.sub(r"\s*\([^)]*\)", "", line)
+    return line.rstrip("-: ").strip("* ").strip()
+
+
+def _split_long(text):
+    if len(text) <= _MAX_FACT_CHARS:
+        return [text]
+
+    parts, current = [], ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        if current and len(current) + len(sentence) > _MAX_FACT_CHARS:
+            parts.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}".strip()
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_sections(text):
+    """
+    Splits the knowledge base into (title, [lines]) sections.
+
+    - Lines ending in "-" or ":" are headings
+    - Short headings ("Likes -", "*Traits*:") are sub-sections, so they
+      are titled "<parent> › <heading>" to keep their context
+    """
+    sections = []
+    parent = "General"
+    title, lines = "General", []
+
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+
+        if _is_heading(line):
+            if lines:
+                sections.append((title, lines))
+            heading = _clean_title(line)
+            if len(heading.split()) <= 3:
+                title = f"{parent} › {heading}"
+            else:
+                parent = title = heading
+            lines = []
+        else:
+            lines.append(line)
+
+    if lines:
+        sections.append((title, lines))
+    return sections
+
+
+def split_knowledge_base(text, core_prefixes=CORE_SECTION_PREFIXES):
+    """
+    Turns the raw knowledge base into (core_text, chunks).
+
+    - core_text: the core persona sections, as one block of text
+    - chunks:    every other section, split into facts
+    """
+    core_parts = []
+    chunks = []
+
+    for title, lines in split_sections(text):
+        if title.startswith(core_prefixes):
+            core_parts.append("\n".join([title] + lines))
+            continue
+
+        # A sample chat only makes sense as a whole
+        dialog_lines = sum(1 for line in lines if _DIALOG_LINE_RE.match(line))
+        if dialog_lines * 2 > len(lines):
+            chunks.append(Chunk(len(chunks), title, "section", "\n".join(lines)))
+            continue
+
+        for line in lines:
+            for part in _split_long(line.lstrip("- ").strip()):
+                chunks.append(Chunk(len(chunks), title, "fact", part))
+
+    return "\n\n".join(core_parts), chunks
+
+
+# -------------------------
+# Index
+# -------------------------
+
+class KnowledgeIndex:
+    """
+    In-memory BM25 inverted index (+ optional hashed vectors) over chunks.
+    """
+
+    def __init__(self, chunks, core_text="", mode=RETRIEVAL_MODE):
+        if mode not in ("bm25", "vector", "hybrid"):
+            raise ValueError(f"Unknown RETRIEVAL_MODE: {mode!r} (expected 'bm25', 'vector' or 'hybrid')")
+
+        self.chunks = chunks
+        self.core_text = core_text
+        self.mode = mode
+
+        # term → [(chunk_id, term frequency), ...]
+        self.postings = defaultdict(list)
+        self.lengths = []
+        for chunk in chunks:
+            terms = tokenize(f"{chunk.section} {chunk.text}")
+            self.lengths.append(len(terms))
+            for term, tf in Counter(terms).items():
+                self.postings[term].append((chunk.chunk_id, tf))
+
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        n = len(chunks)
+        self.idf = {
+            term: math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            for term, posting in self.postings.items()
+        }
+
+        self.vectors = None
+        if mode in ("vector", "hybrid"):
+            self.vectors = [embed(f"{chunk.section} {chunk.text}") for chunk in chunks]
+
+    @classmethod
+    def from_text(cls, text, mode=RETRIEVAL_MODE):
+        core_text, chunks = split_knowledge_base(text)
+        return cls(chunks, core_text, mode)
+
+    # -------------------------
+    # Scoring
+    # -------------------------
+
+    def bm25_scores(self, query):
+        scores = defaultdict(float)
+        for term in set(expand_query(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = self.idf[term]
+            for chunk_id, tf in posting:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / self.avg_length)
+                scores[chunk_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return scores
+
+    def vector_scores(self, query):
+        query_vector = embed(" ".join(expand_query(query)))
+        if not query_vector:
+            return {}
+        scores = {}
+        for chunk_id, vector in enumerate(self.vectors):
+            score = cosine(query_vector, vector)
+            if score > 0.15:
+                scores[chunk_id] = score
+        return scores
+
+    def scores(self, query):
+        if self.mode == "bm25":
+            return self.bm25_scores(query)
+        if self.mode == "vector":
+            return self.vector_scores(query)
+
+        # hybrid: normalise each score set to [0, 1] and blend
+        blended = defaultdict(float)
+        for part in (self.bm25_scores(query), self.vector_scores(query)):
+            top = max(part.values(), default=0.0) or 1.0
+            for chunk_id, score in part.items():
+                blended[chunk_id] += score / top
+        return blended
+
+    def search(self, query, k=RETRIEVAL_TOP_K):
+        """
+        Top-k (chunk, score) pairs for `query`, best first.
+        """
+        ranked = sorted(self.scores(query).items(), key=lambda item: (-item[1], item[0]))
+        if not ranked:
+            return []
+
+        floor = ranked[0][1] * RETRIEVAL_MIN_SCORE_RATIO
+        return [(self.chunks[chunk_id], score) for chunk_id, score in ranked[:k] if score >= floor]
+
+    def select(self, query, k=RETRIEVAL_TOP_K, token_budget=KNOWLEDGE_TOKEN_BUDGET):
+        """
+        Best chunks for `query` that fit inside `token_budget`.
+
+        Chunks that would overflow the budget are skipped (a smaller,
+        lower-ranked fact may still fit). Returned in knowledge-base order
+        so related facts read naturally.
+        """
+        picked, used = [], 0
+        for chunk, _score in self.search(query, k=len(self.chunks)):
+            if len(picked) >= k:
+                break
+            if used + chunk.tokens > token_budget:
+                continue
+            picked.append(chunk)
+            used += chunk.tokens
+
+        picked.sort(key=lambda chunk: chunk.chunk_id)
+        return picked
+
+
+def render_chunks(chunks):
+    """
+    Formats selected chunks for the prompt, grouped under their section title.
+    """
+    lines = []
+    section = None
+    for chunk in chunks:
+        if chunk.section != section:
+            section = chunk.section
+            lines.append(f"{section}:")
+        lines.append(f"- {chunk.text}" if chunk.kind == "fact" else chunk.text)
+    return "\n".join(lines)
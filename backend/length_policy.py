@@ -0,0 +1,147 @@
+"""
+length_policy.py
+
+Decides how long each ArtyBot reply should be, BEFORE the LLM is called.
+
+Why:
+- The persona asks for brief-medium replies most of the time and a long
+  one "every 3-4 messages", but a fixed max_tokens=250 left it all to the
+  model. Long generations are what make slow turns slow.
+- Here every turn gets a length class, which sets both `max_tokens` and a
+  one-line length directive placed right before Tapas's message
+
+How a turn's class is chosen:
+- greeting ("hi", "good night") or ritual → brief
+- emotional vent (sad / tired words, or a long message) → long
+- the final reveal turn → long
+- otherwise, every 3rd or 4th turn of the session → long
+  (3 or 4 is fixed per session, so the rhythm feels natural)
+- questions → medium, everything else → brief
+
+Settings (environment variables):
+- LENGTH_POLICY      → "adaptive" (default) or "fixed" (old behaviour:
+                       LLM_MAX_TOKENS for every turn, no directive)
+- LENGTH_BRIEF_MAX_TOKENS / LENGTH_MEDIUM_MAX_TOKENS / LENGTH_LONG_MAX_TOKENS
+  (90 / 160 / 250: no class goes past the old fixed cap of 250)
+
+Important:
+- Pure functions of (session id, turn number, message): no storage, the
+  turn number is the session's stage counter
+- This file does NOT call the LLM
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import os
+import re
+import zlib
+
+
+LENGTH_POLICY = os.getenv("LENGTH_POLICY", "adaptive")
+
+if LENGTH_POLICY not in ("adaptive", "fixed"):
+    raise ValueError(f"Unknown LENGTH_POLICY: {LENGTH_POLICY!r} (expected 'adaptive' or 'fixed')")
+
+
+class LengthClass:
+    __slots__ = ("name", "max_tokens", "directive")
+
+    def __init__(self, name, max_tokens, directive):
+        self.name = name
+        self.max_tokens = max_tokens
+        self.directive = directive
+
+    def __repr__(self):
+        return f"LengthClass({self.name!r}, max_tokens={self.max_tokens})"
+
+
+BRIEF = LengthClass(
+    "brief",
+    int(os.getenv("LENGTH_BRIEF_MAX_TOKENS", "90")),
+    "LENGTH FOR THIS REPLY: brief - one or two short WhatsApp-style lines.",
+)
+MEDIUM = LengthClass(
+    "medium",
+    int(os.getenv("LENGTH_MEDIUM_MAX_TOKENS", "160")),
+    "LENGTH FOR THIS REPLY: medium - two to four sentences.",
+)
+LONG = LengthClass(
+    "long",
+    int(os.getenv("LENGTH_LONG_MAX_TOKENS", "250")),
+    "LENGTH FOR THIS REPLY: long - a warm, detailed reply of five to eight sentences.",
+)
+
+LENGTH_CLASSES = {c.name: c for c in (BRIEF, MEDIUM, LONG)}
+
+
+# -------------------------
+# Message types
+# -------------------------
+
+_GREETING_RE = re.compile(
+    r"^\W*(hi+|hey+|hello+|hola|yo|good\s*(morning|night|evening|afternoon)|gm|gn|morning|night)\b",
+    re.IGNORECASE,
+)
+
+_VENT_RE = re.compile(
+    r"\b(sad|tired|exhausted|stressed|stress|upset|cry|crying|cried|lonely|alone|hurt|anxious|anxiety|"
+    r"depressed|overwhelmed|frustrated|angry|scared|worried|miss you|bad day|can't sleep|cant sleep)\b",
+    re.IGNORECASE,
+)
+
+# Messages at least this many words long are treated as vents
+VENT_MIN_WORDS = 35
+
+# Greetings longer than this are really conversations that start with "hi"
+GREETING_MAX_WORDS = 5
+
+
+def classify_message(message, is_ritual=False):
+    """
+    "greeting", "ritual", "vent", "question" or "chat".
+    """
+    if is_ritual:
+        return "ritual"
+
+    words = len(message.split())
+    if words >= VENT_MIN_WORDS or _VENT_RE.search(message):
+        return "vent"
+    if words <= GREETING_MAX_WORDS and _GREETING_RE.match(message):
+        return "greeting"
+    if "?" in message:
+        return "question"
+    return "chat"
+
+
+def long_every(session_id):
+    """
+    3 or 4: how often this session gets an unprompted long reply.
+    """
+    return 3 + (zlib.crc32(session_id.encode("utf-8")) & 1)
+
+
+# -------------------------
+# Scheduler
+# -------------------------
+
+def choose_length(session_id, turn, message, final_stage, is_ritual=False):
+    """
+    Length class for this turn (None when LENGTH_POLICY is "fixed").
+
+    turn: the session's stage after advancing (1 for the first message)
+    """
+    if LENGTH_POLICY == "fixed":
+        return None
+
+    kind = classify_message(message, is_ritual)
+
+    if kind in ("greeting", "ritual"):
+        return BRIEF
+    if kind == "vent" or turn >= final_stage:
+        return LONG
+    if turn % long_every(session_id) == 0:
+        return LONG
+    if kind == "question":
+        return MEDIUM
+    return BRIEF
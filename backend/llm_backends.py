@@ -0,0 +1,491 @@
+"""
+llm_backends.py
+
+Where ArtyBot's replies actually come from.
+
+What this file does:
+- Defines the small backend interface llm_client.py talks to:
+    complete(model=..., messages=..., timeout=..., stream=False, **params)
+    acomplete(...)   (same, async)
+  Both return Groq-shaped objects: `response.choices[0].message.content`,
+  or an iterator of chunks with `chunk.choices[0].delta.content`
+- GroqBackend → the real Groq API (default)
+- StubBackend → a deterministic local fake with configurable latency
+  distributions, token rate, streaming and failure injection, for load
+  tests and benchmarks without a network or API key
+- CassetteBackend → replays replies recorded from a real backend
+  (bench/replay.py), instantly and without a network
+
+Selected with LLM_BACKEND=groq|stub|cassette.
+
+Stub settings (environment variables):
+- STUB_TTFT          → time to first token, as a distribution:
+                       "fixed:300", "uniform:100:500", "normal:300:50"
+                       or "lognormal:300:0.5" (median ms, sigma)
+- STUB_TOKENS_PER_SECOND → generation speed after the first token
+- STUB_REPLY_TOKENS  → how many tokens each reply has (cut at the
+                       request's max_tokens, like a real model)
+- STUB_ERROR_RATE    → probability (0-1) of an injected API error
+- STUB_ERROR_STATUS  → HTTP status of injected errors (429, 500, 503...)
+- STUB_TIMEOUT_RATE  → probability of hanging until the request times out
+- STUB_SEED          → seed for the random draws (reproducible runs)
+
+Cassette settings:
+- LLM_CASSETTE        → the cassette file (JSON)
+- LLM_CASSETTE_RECORD → a backend name ("groq"): answer from it and record
+                        its replies into the cassette, instead of replaying
+
+Warm-up (see startup.py):
+- prepare() → imports what the backend needs; safe before a fork
+- connect() / aconnect() → opens the connection pool (TLS to Groq), so
+  the first user request doesn't pay for it
+
+Important:
+- Errors raised by the stub are real groq exception types, so retries,
+  the circuit breaker and fallback behave exactly as with Groq
+- The groq SDK (a quarter of a second of imports) is only imported when
+  it is used: never by a stub server that injects no errors
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+
+from tokens import estimate_tokens
+
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "groq")
+
+
+# -------------------------
+# Groq
+# -------------------------
+
+class GroqBackend:
+    """
+    The real thing. Retries are disabled in the SDK (max_retries=0)
+    because llm_client.ResilientClient owns them.
+
+    The SDK clients are created on first use, once per process: their
+    connection pools (sockets, TLS sessions) must not be shared across
+    gunicorn's fork when the app is preloaded.
+    """
+
+    name = "groq"
+
+    def __init__(self, api_key=None, base_url=None):
+        self.api_key = api_key or os.getenv("GROQ_API_KEY")
+        self.base_url = base_url
+        self._lock = threading.Lock()
+        self._pid = None
+        self._client = None
+        self._async_client = None
+
+    def _ensure_clients(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            import groq
+
+            self._client = groq.Groq(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+            self._async_client = groq.AsyncGroq(api_key=self.api_key, base_url=self.base_url, max_retries=0)
+            self._pid = os.getpid()
+
+    @property
+    def client(self):
+        self._ensure_clients()
+        return self._client
+
+    @property
+    def async_client(self):
+        self._ensure_clients()
+        return self._async_client
+
+    def prepare(self):
+        import groq  # noqa: F401 (the import is the point)
+
+    def connect(self, timeout):
+        """
+        Opens a pooled connection with one cheap request (GET /models).
+        """
+        import groq
+
+        try:
+            self.client.models.list(timeout=timeout)
+        except groq.APIStatusError:
+            # Any HTTP answer means the connection is up (and kept alive)
+            pass
+
+    async def aconnect(self, timeout):
+        import groq
+
+        try:
+            await self.async_client.models.list(timeout=timeout)
+        except groq.APIStatusError:
+            pass
+
+    def complete(self, **request):
+        return self.client.chat.completions.create(**request)
+
+    async def acomplete(self, **request):
+        return await self.async_client.chat.completions.create(**request)
+
+
+# -------------------------
+# Local stub
+# -------------------------
+
+def parse_distribution(spec):
+    """
+    "lognormal:300:0.5" → a function returning a random delay in SECONDS.
+    """
+    kind, *params = spec.split(":")
+    values = [float(p) for p in params]
+
+    if kind == "fixed":
+        return lambda rng: values[0] / 1000
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1]) / 1000
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1])) / 1000
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda rng: rng.lognormvariate(mu, values[1]) / 1000
+
+    raise ValueError(f"Unknown latency distribution: {spec!r}")
+
+
+STUB_REPLIES = [
+    "Hiii my Boo 👻 how was your day, mister? Tell me everything 🐾",
+    "Ghontu!! Did you eat properly or was it coffee again? 😾💗",
+    "Hmm someone's being cute today 🤭 what's up, Specsy?",
+    "Aww Bhutu 🥺 come here, tell me what happened 🫂",
+    "Mr Saha, you forgot an apostrophe there 😹 but I love you anyway 💕",
+]
+
+
+def _status_error(status):
+    """
+    A real groq exception for an injected HTTP error.
+    """
+    import groq
+    import httpx
+
+    request = httpx.Request("POST", "http://stub.local/openai/v1/chat/completions")
+    response = httpx.Response(status, request=request)
+    if status == 429:
+        return groq.RateLimitError("stub: injected rate limit", response=response, body=None)
+    if status >= 500:
+        return groq.InternalServerError("stub: injected server error", response=response, body=None)
+    return groq.APIStatusError("stub: injected error", response=response, body=None)
+
+
+class StubBackend:
+    """
+    Deterministic local fake LLM.
+
+    - The reply text depends only on the last user message
+    - Latency: time-to-first-token drawn from `ttft`, then one token per
+      1 / tokens_per_second seconds
+    - Honours the request `timeout` like the real client would
+    """
+
+    name = "stub"
+
+    def __init__(
+        self,
+        ttft=os.getenv("STUB_TTFT", "fixed:300"),
+        tokens_per_second=float(os.getenv("STUB_TOKENS_PER_SECOND", "400")),
+        reply_tokens=int(os.getenv("STUB_REPLY_TOKENS", "40")),
+        error_rate=float(os.getenv("STUB_ERROR_RATE", "0")),
+        error_status=int(os.getenv("STUB_ERROR_STATUS", "503")),
+        timeout_rate=float(os.getenv("STUB_TIMEOUT_RATE", "0")),
+        seed=os.getenv("STUB_SEED"),
+    ):
+        self.ttft = parse_distribution(ttft)
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.timeout_rate = timeout_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+
+    # Nothing to import or connect to
+    def prepare(self):
+        pass
+
+    def connect(self, timeout):
+        pass
+
+    async def aconnect(self, timeout):
+        pass
+
+    # -------------------------
+    # Planning one reply
+    # -------------------------
+
+    def _reply_text(self, messages, max_tokens=None):
+        last = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+        base = STUB_REPLIES[zlib.crc32(last.encode("utf-8")) % len(STUB_REPLIES)]
+
+        # Pad / trim to the configured length so token rates are meaningful;
+        # a real model also stops at max_tokens
+        length = min(self.reply_tokens, max_tokens or self.reply_tokens)
+        words = base.split(" ")
+        while len(words) < length:
+            words += base.split(" ")
+        return " ".join(words[:length])
+
+    def _plan(self, request):
+        """
+        Returns (first-token delay, outcome) where outcome is None for a
+        normal reply, or the exception to raise.
+        """
+        with self._rng_lock:
+            delay = self.ttft(self._rng)
+            roll = self._rng.random()
+
+        timeout = request.get("timeout")
+        if roll < self.timeout_rate or (timeout is not None and delay > timeout):
+            import groq
+            import httpx
+
+            return (timeout if timeout is not None else delay), groq.APITimeoutError(
+                request=httpx.Request("POST", "http://stub.local")
+            )
+        if roll < self.timeout_rate + self.error_rate:
+            return min(delay, 0.01), _status_error(self.error_status)
+        return delay, None
+
+    def _usage(self, messages, text):
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        completion_tokens = len(text.split(" "))
+        return SimpleNamespace(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )
+
+    def _response(self, model, messages, text):
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(message=SimpleNamespace(role="assistant", content=text), finish_reason="stop")],
+            usage=self._usage(messages, text),
+        )
+
+    def _chunk(self, model, text, usage=None):
+        chunk = SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(delta=SimpleNamespace(content=text), finish_reason=None)],
+            x_groq=None,
+        )
+        if usage is not None:
+            chunk.choices[0].finish_reason = "stop"
+            chunk.x_groq = SimpleNamespace(usage=usage)
+        return chunk
+
+    # -------------------------
+    # Sync
+    # -------------------------
+
+    def complete(self, model, messages, stream=False, **request):
+        delay, error = self._plan(request)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+
+        text = self._reply_text(messages, request.get("max_tokens"))
+        if not stream:
+            time.sleep(len(text.split(" ")) / self.tokens_per_second)
+            return self._response(model, messages, text)
+        return self._stream(model, messages, text)
+
+    def _stream(self, model, messages, text):
+        words = text.split(" ")
+        usage = self._usage(messages, text)
+        for index, word in enumerate(words):
+            if index:
+                time.sleep(1 / self.tokens_per_second)
+            last = index == len(words) - 1
+            yield self._chunk(model, word if index == 0 else " " + word, usage if last else None)
+
+    # -------------------------
+    # Async
+    # -------------------------
+
+    async def acomplete(self, model, messages, stream=False, **request):
+        delay, error = self._plan(request)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+
+        text = self._reply_text(messages, request.get("max_tokens"))
+        if not stream:
+            await asyncio.sleep(len(text.split(" ")) / self.tokens_per_second)
+            return self._response(model, messages, text)
+        return self._astream(model, messages, text)
+
+    async def _astream(self, model, messages, text):
+        words = text.split(" ")
+        usage = self._usage(messages, text)
+        for index, word in enumerate(words):
+            if index:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            last = index == len(words) - 1
+            yield self._chunk(model, word if index == 0 else " " + word, usage if last else None)
+
+
+# -------------------------
+# Cassette
+# -------------------------
+
+LLM_CASSETTE = os.getenv("LLM_CASSETTE", "cassette.json")
+LLM_CASSETTE_RECORD = os.getenv("LLM_CASSETTE_RECORD", "")
+
+
+def _cassette_keys(messages):
+    """
+    (exact key, fallback key): the whole prompt, and only the last user
+    message. After a prompt change the exact key misses, but the same
+    message still gets the reply it got when it was recorded.
+    """
+    exact = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    last = next((m["content"] for m in reversed(messages) if m["role"] == "user"), "")
+    return (
+        "prompt:" + hashlib.sha256(exact.encode("utf-8")).hexdigest()[:16],
+        "message:" + hashlib.sha256(last.encode("utf-8")).hexdigest()[:16],
+    )
+
+
+class CassetteBackend(StubBackend):
+    """
+    Replays recorded replies with zero latency; the stub's reply where
+    nothing was recorded (counted as a miss).
+
+    With `inner` set, answers from `inner` instead and records every
+    reply; save() writes the cassette.
+
+    Usage is reported like the stub's: prompt tokens estimated from the
+    prompt actually sent, so a replay measures the CURRENT prompt.
+    """
+
+    name = "cassette"
+
+    def __init__(self, path=LLM_CASSETTE, inner=None):
+        super().__init__(ttft="fixed:0", tokens_per_second=1e9, error_rate=0, timeout_rate=0)
+        self.path = path
+        self.inner = inner
+        self.entries = {}
+        self.counts = {"exact": 0, "message": 0, "miss": 0, "recorded": 0}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f)["entries"]
+
+    def prepare(self):
+        if self.inner is not None:
+            self.inner.prepare()
+
+    def connect(self, timeout):
+        if self.inner is not None:
+            self.inner.connect(timeout)
+
+    async def aconnect(self, timeout):
+        if self.inner is not None:
+            await self.inner.aconnect(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self.entries), **self.counts}
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries}, f, ensure_ascii=False, indent=1, sort_keys=True)
+
+    def _count(self, outcome):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def _reply_text(self, messages, max_tokens=None):
+        exact, fallback = _cassette_keys(messages)
+        for outcome, key in (("exact", exact), ("message", fallback)):
+            if key in self.entries:
+                self._count(outcome)
+                return self.entries[key]
+        self._count("miss")
+        return super()._reply_text(messages, max_tokens)
+
+    def _record(self, messages, text):
+        with self._lock:
+            for key in _cassette_keys(messages):
+                self.entries[key] = text
+            self.counts["recorded"] += 1
+
+    def _recorded_stream(self, messages, stream):
+        pieces = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                pieces.append(chunk.choices[0].delta.content)
+            yield chunk
+        self._record(messages, "".join(pieces))
+
+    def complete(self, model, messages, stream=False, **request):
+        if self.inner is None:
+            return super().complete(model, messages, stream=stream, **request)
+
+        response = self.inner.complete(model=model, messages=messages, stream=stream, **request)
+        if stream:
+            return self._recorded_stream(messages, response)
+        self._record(messages, response.choices[0].message.content)
+        return response
+
+    async def acomplete(self, model, messages, stream=False, **request):
+        if self.inner is None:
+            return await super().acomplete(model, messages, stream=stream, **request)
+
+        response = await self.inner.acomplete(model=model, messages=messages, stream=stream, **request)
+        if stream:
+            return self._arecorded_stream(messages, response)
+        self._record(messages, response.choices[0].message.content)
+        return response
+
+    async def _arecorded_stream(self, messages, stream):
+        pieces = []
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                pieces.append(chunk.choices[0].delta.content)
+            yield chunk
+        self._record(messages, "".join(pieces))
+
+
+# -------------------------
+# Factory
+# -------------------------
+
+def create_backend(name=None):
+    """
+    Builds the backend selected by LLM_BACKEND.
+    """
+    name = name or LLM_BACKEND
+
+    if name == "groq":
+        return GroqBackend()
+    if name == "stub":
+        return StubBackend()
+    if name == "cassette":
+        return CassetteBackend(inner=create_backend(LLM_CASSETTE_RECORD) if LLM_CASSETTE_RECORD else None)
+
+    raise ValueError(f"Unknown LLM_BACKEND: {name!r} (expected 'groq', 'stub' or 'cassette')")
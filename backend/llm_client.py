@@ -0,0 +1,525 @@
+"""
+llm_client.py
+
+Resilient wrapper around the LLM backend (Groq or the local stub).
+
+What this file does:
+- Gives every LLM call a hard DEADLINE (total time, across retries)
+- Retries only errors worth retrying (429, 5xx, timeouts, connection
+  drops), with jittered exponential backoff, honouring Retry-After
+- Trips a CIRCUIT BREAKER after repeated failures, so during a Groq
+  outage calls fail in microseconds instead of piling up worker threads
+- Optionally falls back to a second model (LLM_FALLBACK_MODEL) and/or
+  HEDGES a slow request by racing a second one (LLM_HEDGE_AFTER_SECONDS)
+
+Why:
+- The plain Groq call had no deadline and no protection, so one slow or
+  broken upstream blocked every worker
+
+Important:
+- The backend (llm_backends.py) must not retry on its own: retries live here
+- Raises LLMUnavailableError when nothing worked; llm.py turns that into
+  the usual "something glitched" reply
+- bench/fake_groq_server.py + bench/resilience.py exercise all of this
+  against a local fake server that injects latency and errors
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+# Total time budget for one reply, retries and fallback included (seconds)
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "15"))
+
+# Timeout for a single attempt (capped by what is left of the deadline)
+LLM_ATTEMPT_TIMEOUT_SECONDS = float(os.getenv("LLM_ATTEMPT_TIMEOUT_SECONDS", "8"))
+
+# Retries per model after the first attempt
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# Backoff: random(0, min(cap, base * 2^attempt)) seconds ("full jitter")
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.25"))
+LLM_BACKOFF_CAP_SECONDS = float(os.getenv("LLM_BACKOFF_CAP_SECONDS", "2"))
+
+# Circuit breaker: open after this many consecutive failures ...
+LLM_BREAKER_THRESHOLD = int(os.getenv("LLM_BREAKER_THRESHOLD", "5"))
+# ... and let one probe request through after this long
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Second model to use when the main one is failing (empty = no fallback)
+LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL", "")
+
+# If a (non-streaming) reply takes longer than this, race a second request
+# against it (to the fallback model if set). Empty = no hedging.
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS") or 0) or None
+
+
+class LLMUnavailableError(Exception):
+    """
+    No model produced a reply within the deadline.
+    """
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """
+    Every model's circuit breaker is open: failing fast without calling Groq.
+    """
+
+
+def is_retryable(error):
+    """
+    True for errors that may succeed on a second try.
+    """
+    # Not imported at startup (see llm_backends.py): if nothing has
+    # imported the SDK yet, this can't be one of its errors
+    groq = sys.modules.get("groq")
+    if groq is None:
+        return False
+    if isinstance(error, groq.APIConnectionError):   # includes timeouts
+        return True
+    if isinstance(error, groq.APIStatusError):
+        return error.status_code in (408, 409, 429) or error.status_code >= 500
+    return False
+
+
+def retry_after_seconds(error):
+    """
+    Server-requested wait from a Retry-After header, if any.
+    """
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# -------------------------
+# Circuit breaker
+# -------------------------
+
+class CircuitBreaker:
+    """
+    closed    → calls go through; consecutive failures are counted
+    open      → calls are refused until `reset_timeout` has passed
+    half-open → ONE probe call is let through; success closes the
+                breaker, failure opens it again. A probe that ends
+                without either (deadline, non-retryable error,
+                cancelled) is handed back with release(), so the next
+                call probes instead.
+    """
+
+    def __init__(self, failure_threshold=LLM_BREAKER_THRESHOLD, reset_timeout=LLM_BREAKER_RESET_SECONDS, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._probe_owner = None
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._clock() - self._opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow(self, owner=None):
+        """
+        True if a call may go through. `owner` marks who holds the probe
+        when this call is one (see release()).
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._clock() - self._opened_at < self.reset_timeout or self._probing:
+                return False
+            self._probing = True
+            self._probe_owner = owner
+            return True
+
+    def release(self, owner):
+        """
+        Hands back `owner`'s probe without a verdict: the breaker stays
+        half-open and the next call becomes the probe.
+        """
+        with self._lock:
+            if self._probing and self._probe_owner is owner:
+                self._probing = False
+                self._probe_owner = None
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+            self._probe_owner = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._probing = False
+            self._probe_owner = None
+
+
+# -------------------------
+# Resilient client
+# -------------------------
+
+class ResilientClient:
+    """
+    Deadline + retries + circuit breaker + fallback/hedging around an
+    LLM backend's complete() / acomplete().
+    """
+
+    def __init__(
+        self,
+        backend,
+        model,
+        fallback_model=LLM_FALLBACK_MODEL,
+        deadline=LLM_DEADLINE_SECONDS,
+        attempt_timeout=LLM_ATTEMPT_TIMEOUT_SECONDS,
+        max_retries=LLM_MAX_RETRIES,
+        backoff_base=LLM_BACKOFF_BASE_SECONDS,
+        backoff_cap=LLM_BACKOFF_CAP_SECONDS,
+        hedge_after=LLM_HEDGE_AFTER_SECONDS,
+        breaker_threshold=LLM_BREAKER_THRESHOLD,
+        breaker_reset=LLM_BREAKER_RESET_SECONDS,
+        on_event=None,
+    ):
+        self.backend = backend
+        self.model = model
+        self.fallback_model = fallback_model or None
+        self.deadline = deadline
+        self.attempt_timeout = attempt_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.hedge_after = hedge_after
+
+        self.breakers = {
+            name: CircuitBreaker(breaker_threshold, breaker_reset)
+            for name in filter(None, (model, self.fallback_model))
+        }
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "retries": 0, "fallbacks": 0, "hedges": 0, "breaker_rejections": 0, "failures": 0}
+        self._hedge_pool = None
+        self._hedge_pool_pid = None
+
+        # Optional callback, called with the stat name on every event
+        # (llm.py feeds these into metrics.py)
+        self.on_event = on_event
+
+    # -------------------------
+    # Stats
+    # -------------------------
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+        if self.on_event is not None:
+            self.on_event(key)
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["breakers"] = {name: breaker.state for name, breaker in self.breakers.items()}
+        return stats
+
+    # -------------------------
+    # Planning
+    # -------------------------
+
+    def _models(self):
+        return [self.model] + ([self.fallback_model] if self.fallback_model else [])
+
+    def _backoff(self, attempt, error):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        server_wait = retry_after_seconds(error)
+        if server_wait is not None:
+            delay = max(delay, server_wait)
+        return delay
+
+    def _attempts(self, deadline_at, models):
+        """
+        Yields (model, attempt number, timeout) for every attempt allowed by
+        the breakers and the deadline. The caller reports each outcome via
+        .send(error_or_None); yielding stops on success.
+        """
+        last_error = None
+        # Identifies this call's probe, if it gets one (see release())
+        owner = object()
+        for index, model in enumerate(models):
+            breaker = self.breakers[model]
+            if not breaker.allow(owner):
+                self._count("breaker_rejections")
+                continue
+            if index > 0:
+                self._count("fallbacks")
+
+            try:
+                for attempt in range(self.max_retries + 1):
+                    remaining = deadline_at - time.monotonic()
+                    if remaining <= 0:
+                        break
+
+                    error = yield model, attempt, min(self.attempt_timeout, remaining)
+                    if error is None:
+                        breaker.record_success()
+                        return
+
+                    last_error = error
+                    if not is_retryable(error):
+                        # Bad request / auth: the fallback would fail the same way
+                        raise LLMUnavailableError(str(error)) from error
+
+                    breaker.record_failure()
+                    if not breaker.allow(owner):
+                        break
+
+                    delay = self._backoff(attempt, error)
+                    if attempt < self.max_retries and time.monotonic() + delay < deadline_at:
+                        self._count("retries")
+                        yield "sleep", delay, None
+                    else:
+                        break
+            finally:
+                # Out of time, a non-retryable error, or the caller went
+                # away (closed / cancelled): a probe without a verdict
+                # must not keep the breaker half-open forever
+                breaker.release(owner)
+
+        if last_error is None:
+            raise CircuitOpenError("LLM circuit breaker open")
+        raise LLMUnavailableError(str(last_error)) from last_error
+
+    def _run(self, call, deadline_at, models):
+        """
+        Drives _attempts() with a blocking `call(model, timeout)`.
+        """
+        plan = self._attempts(deadline_at, models)
+        try:
+            step = next(plan)
+            while True:
+                model, attempt, timeout = step
+                if model == "sleep":
+                    time.sleep(attempt)
+                    step = next(plan)
+                    continue
+                try:
+                    result = call(model, timeout)
+                except Exception as error:
+                    step = plan.send(error)
+                    continue
+                try:
+                    plan.send(None)
+                except StopIteration:
+                    pass
+                return result
+        finally:
+            # Runs _attempts()'s cleanup now, also on KeyboardInterrupt & co
+            plan.close()
+
+    async def _run_async(self, call, deadline_at, models):
+        plan = self._attempts(deadline_at, models)
+        try:
+            step = next(plan)
+            while True:
+                model, attempt, timeout = step
+                if model == "sleep":
+                    await asyncio.sleep(attempt)
+                    step = next(plan)
+                    continue
+                try:
+                    result = await call(model, timeout)
+                except Exception as error:
+                    step = plan.send(error)
+                    continue
+                try:
+                    plan.send(None)
+                except StopIteration:
+                    pass
+                return result
+        finally:
+            # A cancelled task (CancelledError is not an Exception) ends here
+            plan.close()
+
+    # -------------------------
+    # Sync API
+    # -------------------------
+
+    def create(self, messages, **params):
+        """
+        Non-streaming completion (the Groq response object).
+        """
+        self._count("calls")
+        deadline_at = time.monotonic() + self.deadline
+
+        def call(model, timeout):
+            return self.backend.complete(model=model, messages=messages, timeout=timeout, **params)
+
+        try:
+            if self.hedge_after and self.hedge_after < self.deadline:
+                return self._hedged(call, deadline_at)
+            return self._run(call, deadline_at, self._models())
+        except LLMUnavailableError:
+            self._count("failures")
+            raise
+
+    def _hedged(self, call, deadline_at):
+        """
+        Starts the normal call; if it has not finished after `hedge_after`,
+        races a second call (fallback model if configured) and returns
+        whichever succeeds first.
+        """
+        # Threads do not survive a fork: one pool per process
+        if self._hedge_pool is None or self._hedge_pool_pid != os.getpid():
+            self._hedge_pool = ThreadPoolExecutor(max_workers=32, thread_name_prefix="llm-hedge")
+            self._hedge_pool_pid = os.getpid()
+
+        primary = self._hedge_pool.submit(self._run, call, deadline_at, self._models())
+        done, _ = wait([primary], timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        hedge_models = [self.fallback_model] if self.fallback_model else [self.model]
+        hedge = self._hedge_pool.submit(self._run, call, deadline_at, hedge_models)
+
+        pending = {primary, hedge}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    return future.result()
+                except LLMUnavailableError as error:
+                    last_error = error
+        raise last_error or LLMUnavailableError("LLM deadline exceeded")
+
+    def stream(self, messages, **params):
+        """
+        Streaming completion: an iterator of Groq chunks.
+
+        Retries and fallback only happen BEFORE the first chunk arrives;
+        a stream that breaks halfway raises to the caller.
+        """
+        self._count("calls")
+        deadline_at = time.monotonic() + self.deadline
+
+        def call(model, timeout):
+            stream = self.backend.complete(
+                model=model, messages=messages, timeout=timeout, stream=True, **params
+            )
+            iterator = iter(stream)
+            # Pull the first chunk here so failures before it are retried
+            first = next(iterator, None)
+            return first, iterator
+
+        try:
+            first, iterator = self._run(call, deadline_at, self._models())
+        except LLMUnavailableError:
+            self._count("failures")
+            raise
+
+        if first is not None:
+            yield first
+        yield from iterator
+
+    # -------------------------
+    # Async API
+    # -------------------------
+
+    async def acreate(self, messages, **params):
+        self._count("calls")
+        deadline_at = time.monotonic() + self.deadline
+
+        async def call(model, timeout):
+            return await self.backend.acomplete(
+                model=model, messages=messages, timeout=timeout, **params
+            )
+
+        try:
+            if self.hedge_after and self.hedge_after < self.deadline:
+                return await self._hedged_async(call, deadline_at)
+            return await self._run_async(call, deadline_at, self._models())
+        except LLMUnavailableError:
+            self._count("failures")
+            raise
+
+    async def _hedged_async(self, call, deadline_at):
+        primary = asyncio.ensure_future(self._run_async(call, deadline_at, self._models()))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        hedge_models = [self.fallback_model] if self.fallback_model else [self.model]
+        hedge = asyncio.ensure_future(self._run_async(call, deadline_at, hedge_models))
+
+        pending = {primary, hedge}
+        last_error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0.0, deadline_at - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in done:
+                    try:
+                        return task.result()
+                    except LLMUnavailableError as error:
+                        last_error = error
+        finally:
+            for task in pending:
+                task.cancel()
+        raise last_error or LLMUnavailableError("LLM deadline exceeded")
+
+    async def astream(self, messages, **params):
+        self._count("calls")
+        deadline_at = time.monotonic() + self.deadline
+
+        async def call(model, timeout):
+            stream = await self.backend.acomplete(
+                model=model, messages=messages, timeout=timeout, stream=True, **params
+            )
+            iterator = stream.__aiter__()
+            try:
+                first = await iterator.__anext__()
+            except StopAsyncIteration:
+                first = None
+            return first, iterator
+
+        try:
+            first, iterator = await self._run_async(call, deadline_at, self._models())
+        except LLMUnavailableError:
+            self._count("failures")
+            raise
+
+        if first is not None:
+            yield first
+        async for chunk in iterator:
+            yield chunk
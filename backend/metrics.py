@@ -0,0 +1,183 @@
+"""
+metrics.py
+
+Prometheus metrics for ArtyBot, served as text at GET /metrics.
+
+What this file does:
+- Latency histograms for whole requests (per route) and for the phases
+  inside them: prompt build, LLM call, LLM time-to-first-token (streams),
+  and JSON encoding of the reply
+- Counts prompt / completion tokens from the Groq `usage` field
+- Counts LLM errors (by exception type), fallback replies, and the
+  resilient client's retries / model fallbacks / hedges / breaker rejections
+- Counts turns per conversation stage, and how each was answered
+  (ritual, reply cache, or the LLM)
+- Counts duplicate requests that shared another request's reply
+  (coalesced while in flight, or replayed for an Idempotency-Key)
+- Counts requests turned away by admission control (rate limits, a
+  full or too-slow LLM queue), and how long calls waited for an LLM slot
+
+Multiple gunicorn workers:
+- Each worker only sees its own requests, so with PROMETHEUS_MULTIPROC_DIR
+  set (gunicorn.conf.py does it) every worker writes its values to small
+  mmap'd files in that directory, and /metrics adds them all up
+- gunicorn.conf.py empties the directory on startup and cleans up after
+  workers that exit
+
+Important:
+- PROMETHEUS_MULTIPROC_DIR must be set BEFORE this module is imported
+- Recording a value is a dict lookup and an add under a lock: cheap
+  enough for the request path
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+
+# From ~50 µs (prompt build, encoding) up to the LLM deadline
+LATENCY_BUCKETS = (
+    0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+    0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+)
+
+
+# -------------------------
+# Metrics
+# -------------------------
+
+REQUEST_SECONDS = Histogram(
+    "artybot_request_seconds",
+    "Time to handle an HTTP request (app.py streams: until the response starts)",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+
+PHASE_SECONDS = Histogram(
+    "artybot_phase_seconds",
+    "Time spent in each phase of a chat turn",
+    ["phase"],
+    buckets=LATENCY_BUCKETS,
+)
+
+# Children are looked up once here, not on every request
+BUILD_PROMPT_SECONDS = PHASE_SECONDS.labels("build_prompt")
+LLM_SECONDS = PHASE_SECONDS.labels("llm")
+LLM_FIRST_TOKEN_SECONDS = PHASE_SECONDS.labels("llm_first_token")
+LLM_QUEUE_SECONDS = PHASE_SECONDS.labels("llm_queue")
+ENCODE_SECONDS = PHASE_SECONDS.labels("encode")
+
+LLM_TOKENS = Counter(
+    "artybot_llm_tokens",
+    "Tokens reported by the LLM API",
+    ["kind"],
+)
+PROMPT_TOKENS = LLM_TOKENS.labels("prompt")
+COMPLETION_TOKENS = LLM_TOKENS.labels("completion")
+
+LLM_ERRORS = Counter(
+    "artybot_llm_errors",
+    "LLM calls that failed after retries, by exception type",
+    ["error"],
+)
+
+FALLBACK_REPLIES = Counter(
+    "artybot_fallback_replies",
+    "Times FALLBACK_REPLY was sent instead of an LLM reply",
+)
+
+LLM_CLIENT_EVENTS = Counter(
+    "artybot_llm_client_events",
+    "Resilient client events: calls, retries, fallbacks, hedges, breaker_rejections, failures",
+    ["event"],
+)
+
+TURNS = Counter(
+    "artybot_turns",
+    "Chat turns by conversation stage and by what answered them",
+    ["stage", "source"],
+)
+
+DEDUPED_REQUESTS = Counter(
+    "artybot_deduped_requests",
+    "Chat requests answered with another request's reply, by reason",
+    ["reason"],
+)
+COALESCED_REQUESTS = DEDUPED_REQUESTS.labels("in_flight")
+REPLAYED_REQUESTS = DEDUPED_REQUESTS.labels("idempotency_key")
+
+ADMISSION_REJECTIONS = Counter(
+    "artybot_admission_rejections",
+    "Requests turned away: session_rate / ip_rate (429), queue_full / deadline / queue_timeout (503)",
+    ["reason"],
+)
+
+
+# -------------------------
+# Recording helpers
+# -------------------------
+
+def record_usage(usage):
+    """
+    Adds a Groq `usage` object (prompt_tokens, completion_tokens) to the
+    token counters. Missing usage (some errors, old SDKs) is ignored.
+    """
+    if usage is None:
+        return
+    PROMPT_TOKENS.inc(getattr(usage, "prompt_tokens", 0) or 0)
+    COMPLETION_TOKENS.inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def record_llm_error(error):
+    LLM_ERRORS.labels(type(error).__name__).inc()
+
+
+def record_client_event(event):
+    """
+    Passed to llm_client.ResilientClient as on_event.
+    """
+    LLM_CLIENT_EVENTS.labels(event).inc()
+
+
+def record_rejection(reason):
+    """
+    Passed to admission.py's limiters and LLM gates as on_reject.
+    """
+    ADMISSION_REJECTIONS.labels(reason).inc()
+
+
+def record_turn(stage, final_stage, source):
+    """
+    Stages past the final one are all counted as the final stage, so the
+    label stays small.
+    """
+    TURNS.labels(str(min(stage, final_stage)), source).inc()
+
+
+# -------------------------
+# Exposition
+# -------------------------
+
+def render_metrics():
+    """
+    Returns (body bytes, content type) for GET /metrics.
+
+    In multiprocess mode, a fresh registry collects every worker's files.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
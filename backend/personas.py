@@ -0,0 +1,348 @@
+"""
+personas.py
+
+Several personas served by one process.
+
+What this file does:
+- Every directory in PERSONAS_DIR (personas/ by default) is a persona,
+  named after its directory:
+    knowledge_base.txt, system_prompt.txt → its prompt (see prompts.py)
+    rituals.json (optional)  → its call-and-response rituals (rituals.py)
+    persona.json (optional)  → when and how the final reveal happens:
+        final_stage           messages before the reveal (default 6)
+        final_photo_url       the photo, e.g. "/static/final_photo.jpg"
+        final_photo_manifest  its responsive variants, a file in
+                              STATIC_DIR written by reveal_photo.py
+        final_note            the note shown under it
+- PersonaRegistry.get(name) loads a persona the first time a message
+  asks for it and keeps at most PERSONA_CACHE_SIZE of them (plus the
+  default one): the least recently used is dropped to make room
+- One watcher thread per process reloads the prompt of every loaded
+  persona when its files change (prompts.PromptSource.check())
+
+Why:
+- One knowledge base, one stage threshold and one reveal per process
+  meant one deployment per persona: as many cold starts, and as many
+  copies of the whole server in memory
+
+Important:
+- Which persona a message is for: /p/<name>/chat (/chat/stream, /ws),
+  else the X-Persona header, else DEFAULT_PERSONA (see app.py)
+- Stages, history, rate limits and idempotency keys are per persona:
+  the default persona's sessions keep their plain id (so sessions and
+  transcripts from before still match), the others' are stored as
+  "<name>:<session id>"
+- A dropped persona is loaded again on its next message, from the
+  compiled bundle in PROMPT_CACHE_DIR when it is still there (about a
+  millisecond). A turn keeps its bundle even if its persona is dropped.
+- persona.json and rituals.json are read when a persona is loaded; only
+  the prompt files are reloaded on edit
+
+Usage (from backend/), to check every persona before a deploy:
+
+    python personas.py
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from prompts import PROMPT_RELOAD_INTERVAL_SECONDS, PromptSource
+from reveal_photo import load_reveal_photo
+from rituals import RitualEngine
+from session_store import PERSONA_SEPARATOR
+from static_files import STATIC_DIR
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+PERSONAS_DIR = os.getenv("PERSONAS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "personas"))
+
+# Served when a message names no persona; always loaded, never dropped
+DEFAULT_PERSONA = os.getenv("DEFAULT_PERSONA", "artija")
+
+# Other personas kept loaded at once (prompt, knowledge index, rituals)
+PERSONA_CACHE_SIZE = int(os.getenv("PERSONA_CACHE_SIZE", "16"))
+
+# After how many messages the final reveal triggers, unless persona.json says
+DEFAULT_FINAL_STAGE = 6
+
+PERSONA_FILE = "persona.json"
+RITUALS_FILE = "rituals.json"
+
+# Names come from URLs and headers: only these are ever looked up on disk
+_NAME_RE = re.compile(r"^[a-z0-9][a-z0-9_-]{0,31}$")
+
+
+class UnknownPersona(LookupError):
+    """
+    No persona with that name (or it could not be loaded).
+    """
+
+
+# -------------------------
+# One persona
+# -------------------------
+
+class Persona:
+    """
+    Everything one persona needs to answer, built once when it is loaded.
+
+    - prompts: prompts.PromptSource (current() → the compiled bundle)
+    - rituals: rituals.RitualEngine (no rules if it has no rituals.json)
+    - final_stage: messages before the final reveal
+    - session_prefix: "" for the default persona, else "<name>:"
+    - reveal_*: the final reveal, ready to send (see app.py):
+        reveal_payload → {"is_final": true, "photo_url", "note", "photo"?}
+        reveal_fields  → that payload as JSON, without its braces
+        reveal_event   → the "final" Server-Sent Event of /chat/stream
+        reveal_preload → what the frontend needs to load the photo early
+    """
+
+    __slots__ = (
+        "name", "directory", "prompts", "rituals", "final_stage", "session_prefix",
+        "reveal_payload", "reveal_fields", "reveal_event", "reveal_preload",
+    )
+
+    def __init__(self, name, directory, prompts, rituals, final_stage, photo_url, note, photo=None, default=False):
+        self.name = name
+        self.directory = directory
+        self.prompts = prompts
+        self.rituals = rituals
+        self.final_stage = final_stage
+        self.session_prefix = "" if default else f"{name}{PERSONA_SEPARATOR}"
+
+        payload = {"is_final": True, "photo_url": photo_url, "note": note}
+        if photo is not None:
+            payload["photo_url"] = photo["src"]
+            payload["photo"] = photo  # srcset per format, sizes, placeholder
+        encoded = json.dumps(payload, ensure_ascii=False)
+        self.reveal_payload = payload
+        self.reveal_fields = encoded[1:-1]
+        self.reveal_event = f"event: final\ndata: {encoded}\n\n"
+        self.reveal_preload = {"photo": photo} if photo is not None else {"photo_url": photo_url}
+
+    def session_key(self, session_id):
+        """
+        The key this persona's session is stored under.
+        """
+        return self.session_prefix + session_id
+
+
+def _read_config(directory):
+    path = os.path.join(directory, PERSONA_FILE)
+    try:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as error:
+        raise ValueError(f"{path}: {error}") from None
+
+    if not isinstance(config, dict):
+        raise ValueError(f"{path}: expected a JSON object")
+    final_stage = config.get("final_stage", DEFAULT_FINAL_STAGE)
+    if not isinstance(final_stage, int) or isinstance(final_stage, bool) or final_stage < 1:
+        raise ValueError(f"{path}: final_stage must be a whole number of messages, at least 1")
+    for key in ("final_photo_url", "final_photo_manifest", "final_note"):
+        if not isinstance(config.get(key, ""), str):
+            raise ValueError(f"{path}: {key} must be a string")
+    return config
+
+
+def load_persona(name, directory, salt=(), default=False):
+    """
+    Reads, validates and compiles one persona. Raises ValueError
+    (prompts.PromptError for the prompt files).
+    """
+    config = _read_config(directory)
+
+    rituals_path = os.path.join(directory, RITUALS_FILE)
+    if os.path.exists(rituals_path):
+        try:
+            rituals = RitualEngine.from_file(rituals_path)
+        except (OSError, ValueError, KeyError) as error:
+            raise ValueError(f"{rituals_path}: {error!r}") from None
+    else:
+        rituals = RitualEngine([], [])
+
+    manifest = config.get("final_photo_manifest")
+    return Persona(
+        name,
+        directory,
+        # The name is part of the version: personas never share cached replies
+        PromptSource(directory, salt=[name, *salt]),
+        rituals,
+        config.get("final_stage", DEFAULT_FINAL_STAGE),
+        config.get("final_photo_url", f"/static/{name}/final_photo.jpg"),
+        config.get("final_note", ""),
+        load_reveal_photo(os.path.join(STATIC_DIR, manifest)) if manifest else None,
+        default,
+    )
+
+
+# -------------------------
+# Registry
+# -------------------------
+
+class PersonaRegistry:
+    """
+    The personas of this process, loaded on first use, least recently
+    used dropped first. The default persona is loaded in the constructor
+    (raises if it is invalid) and kept.
+    """
+
+    def __init__(
+        self,
+        directory=PERSONAS_DIR,
+        default=DEFAULT_PERSONA,
+        max_loaded=PERSONA_CACHE_SIZE,
+        salt=(),
+        reload_interval=PROMPT_RELOAD_INTERVAL_SECONDS,
+    ):
+        self.directory = directory
+        self.max_loaded = max_loaded
+        self.salt = tuple(salt)
+        self.reload_interval = reload_interval
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+        self.load_errors = 0
+        self._loaded = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._default = load_persona(default, self._path(default), self.salt, default=True)
+
+    def default(self):
+        return self._default
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def names(self):
+        """
+        Every persona on disk, sorted.
+        """
+        return sorted(
+            name for name in os.listdir(self.directory)
+            if _NAME_RE.match(name) and os.path.isdir(self._path(name))
+        )
+
+    def get(self, name=None):
+        """
+        The persona called `name` (None → the default one).
+        Raises UnknownPersona.
+        """
+        if name is None or name == self._default.name:
+            return self._default
+
+        with self._lock:
+            persona = self._loaded.get(name)
+            if persona is not None:
+                self._loaded.move_to_end(name)
+                self.hits += 1
+                return persona
+
+        if not _NAME_RE.match(name) or not os.path.isdir(self._path(name)):
+            raise UnknownPersona(name)
+
+        # Compiled outside the lock: the other personas keep answering.
+        # Two first messages at once may both load it; one copy is kept.
+        try:
+            persona = load_persona(name, self._path(name), self.salt)
+        except ValueError as error:
+            self.load_errors += 1
+            print(f"Persona {name} could not be loaded: {error}")
+            raise UnknownPersona(name) from error
+
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                return self._loaded[name]
+            self._loaded[name] = persona
+            self.loads += 1
+            while len(self._loaded) > self.max_loaded:
+                self._loaded.popitem(last=False)
+                self.evictions += 1
+        return persona
+
+    def loaded(self):
+        with self._lock:
+            return [self._default, *self._loaded.values()]
+
+    # -------------------------
+    # Reloading
+    # -------------------------
+
+    def watch(self):
+        """
+        Starts reloading edited prompts in this process (once per process;
+        threads don't survive a fork). No-op if reload_interval is 0.
+        """
+        if self.reload_interval <= 0 or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            thread = threading.Thread(target=self._watch, name="persona-watcher", daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            for persona in self.loaded():
+                try:
+                    persona.prompts.check()
+                except Exception as error:
+                    print(f"Persona watcher failed on {persona.name}:", error)
+
+    def stats(self):
+        with self._lock:
+            loaded = list(self._loaded)
+        return {
+            "default": self._default.name,
+            "loaded": loaded,
+            "max_loaded": self.max_loaded,
+            "hits": self.hits,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "load_errors": self.load_errors,
+        }
+
+
+def main():
+    failures = 0
+    for name in sorted(os.listdir(PERSONAS_DIR)):
+        directory = os.path.join(PERSONAS_DIR, name)
+        if not os.path.isdir(directory):
+            continue
+        if not _NAME_RE.match(name):
+            print(f"{name}: INVALID name (lowercase letters, digits, - and _, at most 32)")
+            failures += 1
+            continue
+        try:
+            persona = load_persona(name, directory)
+        except ValueError as error:
+            print(f"{name}: INVALID: {error}")
+            failures += 1
+            continue
+        bundle = persona.prompts.current()
+        print(
+            f"{name}: OK  ~{bundle.system_prompt_tokens} prompt tokens, {len(bundle.index.chunks)} memories, "
+            f"{len(persona.rituals.rules)} rituals, reveal after {persona.final_stage} messages"
+        )
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,406 @@
+"""
+prompts.py
+
+ArtyBot's persona files, compiled into versioned prompt bundles that are
+swapped in without a restart.
+
+What this file does:
+- Loads a persona's prompt files from its directory (see personas.py):
+    knowledge_base.txt → long-term memory (format: see knowledge.py)
+    system_prompt.txt  → identity, rules and style; {core_memory} marks
+                         where the core persona sections go
+- Validates them: a PromptError says which file is wrong and why
+- Compiles them into a PromptBundle: the system prompt, the knowledge
+  index, and a version hash of everything that shapes a prompt
+- PromptSource.current() is the bundle to use. check() polls the files
+  and swaps in a new bundle when they change (personas.PersonaRegistry
+  runs one watcher thread per process for all the loaded personas).
+
+Why:
+- The knowledge base was a string literal in llm.py: every memory edit
+  needed a redeploy, and so a cold start
+
+Important:
+- A turn takes current() ONCE and uses that bundle to the end (prompt,
+  reply cache key, transcript): a reload never mixes two versions in one
+  reply, and replies cached under an older version are never served
+- A bundle is never changed after it is compiled; the swap is one
+  reference assignment
+- A broken edit is logged and counted (stats()), and the previous bundle
+  stays in use. At startup it raises instead.
+- Files are picked up once they have stopped changing for one poll, so a
+  half-saved file is not compiled
+- Compiled bundles are kept in PROMPT_CACHE_DIR, by version: the first
+  worker to see an edit compiles it, the other workers (and restarts)
+  load the result. With GUNICORN_PRELOAD=1 the first bundle is compiled
+  once in the gunicorn master and inherited by every worker.
+
+Usage (from backend/), to check one persona's files:
+
+    python prompts.py personas/artija
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+import knowledge
+import tokens
+from knowledge import KnowledgeIndex
+from tokens import estimate_tokens
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+KNOWLEDGE_BASE_FILE = "knowledge_base.txt"
+SYSTEM_PROMPT_FILE = "system_prompt.txt"
+
+# Replaced by the core persona sections of the knowledge base
+CORE_MEMORY_PLACEHOLDER = "{core_memory}"
+
+# The compiled system prompt must fit in this many tokens (the persona's
+# share of the prompt, see the budgets in llm.py)
+PERSONA_TOKEN_BUDGET = int(os.getenv("PERSONA_TOKEN_BUDGET", "5000"))
+
+# How often the persona files are checked for edits; 0 = never reload
+PROMPT_RELOAD_INTERVAL_SECONDS = float(os.getenv("PROMPT_RELOAD_INTERVAL_SECONDS", "2"))
+
+# Compiled bundles, shared by the workers; "" = compile in every process
+PROMPT_CACHE_DIR = os.getenv("PROMPT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "artybot-prompts"))
+
+# Compiled bundles kept there (the most recently used ones): a few per
+# persona, so a persona dropped from memory (see personas.py) comes back
+# from here instead of being compiled again
+PROMPT_CACHE_KEEP = int(os.getenv("PROMPT_CACHE_KEEP", "64"))
+
+
+class PromptError(ValueError):
+    """
+    The persona files can't be compiled into a prompt.
+    """
+
+
+# -------------------------
+# Compiled bundle
+# -------------------------
+
+class PromptBundle:
+    """
+    One compiled version of the persona. Read-only once built.
+
+    - version:       12 hex chars; changes with the files, the retrieval
+                     mode and the model settings llm.py passes as `salt`
+    - system_prompt: the static system message, byte-for-byte the same on
+                     every request (Groq's prompt cache reuses it)
+    - index:         knowledge.KnowledgeIndex over the other memories
+    """
+
+    __slots__ = (
+        "version", "system_prompt", "system_prompt_bytes", "system_prompt_tokens", "knowledge_base", "index",
+    )
+
+    def __init__(self, version, system_prompt, knowledge_base, index):
+        self.version = version
+        self.system_prompt = system_prompt
+        self.system_prompt_bytes = len(system_prompt.encode("utf-8"))
+        self.system_prompt_tokens = estimate_tokens(system_prompt)
+        self.knowledge_base = knowledge_base
+        self.index = index
+
+
+def prompt_version(knowledge_base, template, salt=()):
+    return hashlib.sha256(
+        "\x00".join([knowledge_base, template, knowledge.RETRIEVAL_MODE, *salt]).encode("utf-8")
+    ).hexdigest()[:12]
+
+
+def compile_bundle(knowledge_base, template, version, token_budget=PERSONA_TOKEN_BUDGET):
+    """
+    Validates the persona files' contents and compiles them.
+
+    Raises PromptError.
+    """
+    if template.count(CORE_MEMORY_PLACEHOLDER) != 1:
+        raise PromptError(f"{SYSTEM_PROMPT_FILE} must contain {CORE_MEMORY_PLACEHOLDER} exactly once")
+
+    index = KnowledgeIndex.from_text(knowledge_base)
+    if not index.core_text:
+        raise PromptError(
+            f"{KNOWLEDGE_BASE_FILE} has no core persona section "
+            f"(titles starting with {' or '.join(knowledge.CORE_SECTION_PREFIXES)})"
+        )
+    if not index.chunks:
+        raise PromptError(f"{KNOWLEDGE_BASE_FILE} has no memories besides the core persona")
+
+    bundle = PromptBundle(
+        version, template.replace(CORE_MEMORY_PLACEHOLDER, index.core_text), knowledge_base, index,
+    )
+    if bundle.system_prompt_tokens > token_budget:
+        raise PromptError(
+            f"the system prompt is ~{bundle.system_prompt_tokens} tokens, over PERSONA_TOKEN_BUDGET={token_budget}"
+        )
+    return bundle
+
+
+def read_persona(directory):
+    """
+    (knowledge_base, template) from `directory`. Raises PromptError.
+    """
+    texts = []
+    for name in (KNOWLEDGE_BASE_FILE, SYSTEM_PROMPT_FILE):
+        path = os.path.join(directory, name)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as error:
+            raise PromptError(f"{path}: {error}") from None
+        if not text.strip():
+            raise PromptError(f"{path} is empty")
+        texts.append(text)
+    return tuple(texts)
+
+
+def _code_version():
+    """
+    Hash of the code that compiles a bundle: a cached bundle from older
+    code is not loaded.
+    """
+    digest = hashlib.sha256()
+    for module_path in (__file__, knowledge.__file__, tokens.__file__):
+        with open(module_path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+# -------------------------
+# Current bundle + reloading
+# -------------------------
+
+class PromptSource:
+    """
+    One persona's prompt: current() is the bundle to build this turn's
+    prompt with.
+
+    The first bundle is compiled in the constructor (PromptError if the
+    files are invalid). Reloads happen in check(), called by a watcher.
+    """
+
+    def __init__(self, directory, salt=(), token_budget=PERSONA_TOKEN_BUDGET, cache_dir=PROMPT_CACHE_DIR):
+        self.directory = directory
+        self.salt = tuple(salt)
+        self.token_budget = token_budget
+        self.cache_dir = _private_dir(cache_dir)
+        self.reloads = 0
+        self.reload_errors = 0
+        self.last_error = None
+        self.compiled = 0
+        self.loaded_from_cache = 0
+        self.last_load_ms = 0.0
+        self._pending = None
+        self._fingerprint, self._bundle = self._load()
+
+    def current(self):
+        return self._bundle
+
+    # -------------------------
+    # Loading
+    # -------------------------
+
+    def _stat(self):
+        """
+        (mtime, size) of each persona file; None for a missing one.
+        """
+        fingerprint = []
+        for name in (KNOWLEDGE_BASE_FILE, SYSTEM_PROMPT_FILE):
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+                fingerprint.append((stat.st_mtime_ns, stat.st_size))
+            except OSError:
+                fingerprint.append(None)
+        return tuple(fingerprint)
+
+    def _load(self):
+        """
+        (fingerprint, bundle) for the files as they are now. Raises PromptError.
+        """
+        # Taken before reading: an edit made while reading is seen next poll
+        fingerprint = self._stat()
+        started = time.perf_counter()
+        knowledge_base, template = read_persona(self.directory)
+        version = prompt_version(knowledge_base, template, self.salt)
+
+        bundle = self._load_cached(version)
+        if bundle is None:
+            bundle = compile_bundle(knowledge_base, template, version, self.token_budget)
+            self._store_cached(bundle)
+            self.compiled += 1
+        else:
+            self.loaded_from_cache += 1
+        self.last_load_ms = round((time.perf_counter() - started) * 1000, 3)
+        return fingerprint, bundle
+
+    def _cache_path(self, version):
+        return os.path.join(self.cache_dir, f"{version}-{_CODE_VERSION}.pickle") if self.cache_dir else None
+
+    def _load_cached(self, version):
+        path = self._cache_path(version)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                bundle = pickle.load(f)
+        except Exception as error:
+            # Truncated or unreadable: compile it again (and overwrite it)
+            print(f"Ignoring cached prompt {path}: {error}")
+            return None
+        if not isinstance(bundle, PromptBundle) or bundle.system_prompt_tokens > self.token_budget:
+            return None
+        try:
+            # Used: _prune() keeps the most recently used bundles
+            os.utime(path)
+        except OSError:
+            pass
+        return bundle
+
+    def _store_cached(self, bundle):
+        path = self._cache_path(bundle.version)
+        if path is None:
+            return
+        # Written under a temporary name, then renamed: never seen half-written
+        temporary = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "wb") as f:
+                pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temporary, path)
+            _prune(self.cache_dir, PROMPT_CACHE_KEEP)
+        except OSError as error:
+            print(f"Could not cache the compiled prompt in {self.cache_dir}: {error}")
+
+    # -------------------------
+    # Reloading
+    # -------------------------
+
+    def check(self):
+        """
+        One poll. Reloads when the files changed and then stayed the same
+        for one poll. True if a new version was swapped in.
+        """
+        fingerprint = self._stat()
+        if fingerprint == self._fingerprint:
+            self._pending = None
+            return False
+        if fingerprint != self._pending:
+            # Still being written? Look again next poll
+            self._pending = fingerprint
+            return False
+        return self.reload()
+
+    def reload(self):
+        """
+        Compiles the files now and swaps the result in. True if the version
+        changed. A broken edit keeps the current bundle.
+        """
+        try:
+            fingerprint, bundle = self._load()
+        except PromptError as error:
+            # Not retried until the files change again
+            self._fingerprint = self._pending or self._stat()
+            self.reload_errors += 1
+            self.last_error = str(error)
+            print(f"Prompt reload failed, still on {self._bundle.version}: {error}")
+            return False
+
+        self._fingerprint = fingerprint
+        self._pending = None
+        if bundle.version == self._bundle.version:
+            return False
+
+        previous = self._bundle
+        self._bundle = bundle
+        self.reloads += 1
+        self.last_error = None
+        print(
+            f"Prompt reloaded: {previous.version} → {bundle.version} "
+            f"({bundle.system_prompt_bytes} bytes, ~{bundle.system_prompt_tokens} tokens, {self.last_load_ms} ms)"
+        )
+        return True
+
+    def stats(self):
+        bundle = self._bundle
+        return {
+            "version": bundle.version,
+            "bytes": bundle.system_prompt_bytes,
+            "tokens": bundle.system_prompt_tokens,
+            "memories": len(bundle.index.chunks),
+            "directory": self.directory,
+            "reloads": self.reloads,
+            "reload_errors": self.reload_errors,
+            "last_error": self.last_error,
+            "compiled": self.compiled,
+            "loaded_from_cache": self.loaded_from_cache,
+            "last_load_ms": self.last_load_ms,
+        }
+
+
+def _private_dir(path):
+    """
+    `path`, created if needed, or None when it can't be used. Bundles are
+    unpickled from it, so it must belong to this user.
+    """
+    if not path:
+        return None
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        if hasattr(os, "getuid") and os.stat(path).st_uid != os.getuid():
+            print(f"Not caching compiled prompts in {path}: owned by another user")
+            return None
+    except OSError as error:
+        print(f"Not caching compiled prompts in {path}: {error}")
+        return None
+    return path
+
+
+def _prune(directory, keep):
+    paths = sorted(
+        (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".pickle")),
+        key=os.path.getmtime,
+    )
+    # Not paths[:-keep]: with keep=0 that is empty and nothing is removed
+    for path in paths[:max(0, len(paths) - keep)]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_CODE_VERSION = _code_version()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validates and compiles the persona files.")
+    parser.add_argument("directory", help="a persona directory")
+    args = parser.parse_args()
+
+    try:
+        knowledge_base, template = read_persona(args.directory)
+        bundle = compile_bundle(knowledge_base, template, prompt_version(knowledge_base, template))
+    except PromptError as error:
+        print(f"INVALID: {error}")
+        sys.exit(1)
+
+    print(f"{args.directory}: OK")
+    print(f"  system prompt {bundle.system_prompt_bytes} bytes, ~{bundle.system_prompt_tokens} tokens")
+    print(f"  {len(bundle.index.chunks)} memories in {len({c.section for c in bundle.index.chunks})} sections")
+
+
+if __name__ == "__main__":
+    main()
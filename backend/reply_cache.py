@@ -0,0 +1,367 @@
+"""
+reply_cache.py
+
+Cache of LLM replies for short, repeated messages ("hi", "good night").
+
+What this file does:
+- Normalises a message ("Heyyy love!!" → "hey love") into a cache key,
+  together with the prompt version
+- Keeps a POOL of several different replies per key and rotates through
+  them, so cached answers don't feel canned
+- Bounded: LRU eviction by key count, TTL expiry
+- Counts hits / misses and how many LLM tokens the hits saved
+
+Backends (REPLY_CACHE_BACKEND):
+- "memory" → per worker process (default)
+- "sqlite" → a local SQLite file in WAL mode shared by all gunicorn workers
+- "off"    → no caching
+
+How the pool fills up:
+- The first REPLY_CACHE_VARIANTS requests for a key are misses; each
+  new LLM reply is added to the pool
+- After that, requests are hits and rotate through the pool
+
+Important:
+- A first-turn cache: only the FIRST message of a session (stage 1, no
+  history or summary yet) is looked up and stored. Later replies are
+  written from the session's history, which is not part of the key, so
+  they are never shared (see llm.start_turn)
+- Only short messages are cached (long ones are never repeated verbatim)
+- This file does NOT call the LLM
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+REPLY_CACHE_BACKEND = os.getenv("REPLY_CACHE_BACKEND", "memory")
+REPLY_CACHE_DB_PATH = os.getenv("REPLY_CACHE_DB_PATH", "artybot_reply_cache.db")
+REPLY_CACHE_MAX_KEYS = int(os.getenv("REPLY_CACHE_MAX_KEYS", "2000"))
+REPLY_CACHE_TTL_SECONDS = float(os.getenv("REPLY_CACHE_TTL_SECONDS", str(6 * 3600)))
+
+# How many different replies are kept (and rotated) per key
+REPLY_CACHE_VARIANTS = int(os.getenv("REPLY_CACHE_VARIANTS", "4"))
+
+# Only messages with at most this many words are cached
+REPLY_CACHE_MAX_WORDS = int(os.getenv("REPLY_CACHE_MAX_WORDS", "4"))
+
+
+# -------------------------
+# Keys
+# -------------------------
+
+_NON_WORD_RE = re.compile(r"[^a-z0-9 ]+")
+_REPEAT_RE = re.compile(r"(.)\1{2,}")
+
+
+def normalize_message(message):
+    """
+    "Heyyy love!! 💗" → "hey love"
+
+    Lowercase, emoji/punctuation dropped, letters repeated 3+ times squashed,
+    whitespace collapsed.
+    """
+    text = _REPEAT_RE.sub(r"\1", message.lower())
+    text = _NON_WORD_RE.sub(" ", text)
+    return " ".join(text.split())
+
+
+def make_key(message, prompt_version):
+    """
+    Cache key for a session's first message, or None if the message
+    should not be cached.
+    """
+    normalized = normalize_message(message)
+    if not normalized or len(normalized.split()) > REPLY_CACHE_MAX_WORDS:
+        return None
+    return f"{prompt_version}|{normalized}"
+
+
+# -------------------------
+# Stats (shared by all backends)
+# -------------------------
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_tokens = 0
+
+    def record(self, hit, saved_tokens=0):
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.saved_tokens += saved_tokens
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "saved_tokens": self.saved_tokens,
+            }
+
+
+# -------------------------
+# In-process backend
+# -------------------------
+
+class _Entry:
+    __slots__ = ("replies", "cursor", "created")
+
+    def __init__(self, created):
+        self.replies = []   # [(reply, token_cost), ...]
+        self.cursor = 0
+        self.created = created
+
+
+class MemoryReplyCache:
+    """
+    LRU + TTL reply pools inside one worker process.
+    """
+
+    def __init__(
+        self,
+        max_keys=REPLY_CACHE_MAX_KEYS,
+        ttl_seconds=REPLY_CACHE_TTL_SECONDS,
+        variants=REPLY_CACHE_VARIANTS,
+        clock=time.monotonic,
+    ):
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self.variants = variants
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = CacheStats()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Next reply from the pool for `key`, or None while the pool is still filling.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.created > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+
+            if entry is None or len(entry.replies) < self.variants:
+                self.stats.record(hit=False)
+                return None
+
+            self._entries.move_to_end(key)
+            reply, token_cost = entry.replies[entry.cursor % len(entry.replies)]
+            entry.cursor += 1
+
+        self.stats.record(hit=True, saved_tokens=token_cost)
+        return reply
+
+    def put(self, key, reply, token_cost=0):
+        """
+        Adds a freshly generated reply to the pool for `key`.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or now - entry.created > self.ttl_seconds:
+                entry = _Entry(now)
+                self._entries[key] = entry
+            self._entries.move_to_end(key)
+
+            if len(entry.replies) < self.variants and reply not in (r for r, _ in entry.replies):
+                entry.replies.append((reply, token_cost))
+
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+
+
+# -------------------------
+# Shared SQLite backend
+# -------------------------
+
+class SQLiteReplyCache:
+    """
+    Reply pools in a local SQLite file (WAL), shared by gunicorn workers.
+
+    Same approach as session_store.SQLiteSessionBackend: per-thread
+    connections, short single-statement writes, periodic pruning.
+    Hit/miss stats are counted per worker process.
+    """
+
+    def __init__(
+        self,
+        path=REPLY_CACHE_DB_PATH,
+        max_keys=REPLY_CACHE_MAX_KEYS,
+        ttl_seconds=REPLY_CACHE_TTL_SECONDS,
+        variants=REPLY_CACHE_VARIANTS,
+        prune_every=256,
+        clock=time.time,
+    ):
+        self.path = path
+        self.max_keys = max_keys
+        self.ttl_seconds = ttl_seconds
+        self.variants = variants
+        self.prune_every = prune_every
+        self._clock = clock
+        self._local = threading.local()
+        self._writes = 0
+        self.stats = CacheStats()
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS reply_cache (
+                cache_key TEXT PRIMARY KEY,
+                replies   TEXT    NOT NULL,
+                cursor    INTEGER NOT NULL,
+                created   REAL    NOT NULL,
+                last_used REAL    NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS reply_cache_last_used ON reply_cache (last_used)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM reply_cache").fetchone()[0]
+
+    def get(self, key):
+        now = self._clock()
+        row = self._connection().execute(
+            """
+            UPDATE reply_cache SET cursor = cursor + 1, last_used = ?
+            WHERE cache_key = ? AND created >= ? AND json_array_length(replies) >= ?
+            RETURNING replies, cursor - 1
+            """,
+            (now, key, now - self.ttl_seconds, self.variants),
+        ).fetchone()
+
+        if row is None:
+            self.stats.record(hit=False)
+            return None
+
+        replies = json.loads(row[0])
+        reply, token_cost = replies[row[1] % len(replies)]
+        self.stats.record(hit=True, saved_tokens=token_cost)
+        return reply
+
+    def put(self, key, reply, token_cost=0):
+        now = self._clock()
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT replies, created FROM reply_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+
+            if row is None or now - row[1] > self.ttl_seconds:
+                replies, created = [], now
+            else:
+                replies, created = json.loads(row[0]), row[1]
+
+            if len(replies) < self.variants and reply not in (r for r, _ in replies):
+                replies.append([reply, token_cost])
+
+            conn.execute(
+                """
+                INSERT INTO reply_cache (cache_key, replies, cursor, created, last_used)
+                VALUES (?, ?, 0, ?, ?)
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    replies = excluded.replies,
+                    created = excluded.created,
+                    last_used = excluded.last_used
+                """,
+                (key, json.dumps(replies, ensure_ascii=False), created, now),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune(now)
+
+    def prune(self, now=None):
+        now = self._clock() if now is None else now
+        conn = self._connection()
+        conn.execute("DELETE FROM reply_cache WHERE created < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            """
+            DELETE FROM reply_cache WHERE cache_key IN (
+                SELECT cache_key FROM reply_cache
+                ORDER BY last_used DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_keys,),
+        )
+
+
+class DisabledReplyCache:
+    """
+    REPLY_CACHE_BACKEND=off: never hits, never stores.
+    """
+
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def __len__(self):
+        return 0
+
+    def get(self, key):
+        return None
+
+    def put(self, key, reply, token_cost=0):
+        pass
+
+
+# -------------------------
+# Factory
+# -------------------------
+
+def create_reply_cache(backend=None):
+    """
+    Builds the reply cache selected by REPLY_CACHE_BACKEND.
+    """
+    backend = backend or REPLY_CACHE_BACKEND
+
+    if backend == "memory":
+        return MemoryReplyCache()
+    if backend == "sqlite":
+        return SQLiteReplyCache()
+    if backend == "off":
+        return DisabledReplyCache()
+
+    raise ValueError(f"Unknown REPLY_CACHE_BACKEND: {backend!r} (expected 'memory', 'sqlite' or 'off')")
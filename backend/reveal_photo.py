@@ -0,0 +1,216 @@
+"""
+reveal_photo.py
+
+Responsive variants of the final-reveal photo.
+
+Why:
+- The reveal pointed at one full-size /static/final_photo.jpg. A phone
+  on mobile data downloaded the whole camera photo for a ~300px wide
+  bubble, and showed nothing until the last byte arrived, at the most
+  important moment of the chat.
+
+What this file does:
+- `python reveal_photo.py photo.jpg` (build / deploy time, needs Pillow):
+    - resizes the photo to REVEAL_WIDTHS (never upscaled)
+    - saves every width as AVIF (when this Pillow can write it), WebP and
+      progressive JPEG
+    - fingerprinted names ("final_photo.768.3f9a1c2b7d.webp") in
+      STATIC_DIR, so static_files.py serves them as immutable
+    - a tiny blurred JPEG as a data: URI, shown while the photo loads
+    - writes STATIC_DIR/final_photo.json describing all of the above
+- `python reveal_photo.py photo.jpg --out static/<persona>`: the same,
+  for another persona (its persona.json then names
+  "final_photo_manifest": "<persona>/final_photo.json", see personas.py).
+  --out must be inside STATIC_DIR, or nothing would serve the files
+- load_reveal_photo() (when a persona is loaded): reads final_photo.json
+  into the "photo" part of the reveal payload (<picture> sources with
+  srcset, sizes, intrinsic size, placeholder)
+
+Important:
+- The server does NOT need Pillow: it only reads the JSON
+- Without final_photo.json the reveal falls back to the single
+  /static/final_photo.jpg
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import re
+
+from static_files import STATIC_DIR
+
+
+REVEAL_PHOTO_NAME = "final_photo"
+REVEAL_PHOTO_MANIFEST = os.getenv("REVEAL_PHOTO_MANIFEST", os.path.join(STATIC_DIR, f"{REVEAL_PHOTO_NAME}.json"))
+
+# Widths to build (CSS px x device pixel ratio of the phones it's seen on)
+REVEAL_WIDTHS = (480, 768, 1080, 1600)
+
+# The reveal bubble is 75% of the chat column, which is 420px at most
+# (style.css): the browser picks a width from srcset using this
+REVEAL_SIZES = "(max-width: 440px) 75vw, 315px"
+
+# Width of the <img src> for browsers without srcset
+FALLBACK_WIDTH = 1080
+
+# Placeholder: this many pixels wide, stretched and blurred by the browser
+PLACEHOLDER_WIDTH = 16
+
+# (Pillow format, MIME type, extension, save options). Order matters in
+# <picture>: the first type the browser supports wins.
+FORMATS = (
+    ("AVIF", "image/avif", ".avif", {"quality": 50}),
+    ("WEBP", "image/webp", ".webp", {"quality": 78, "method": 6}),
+    ("JPEG", "image/jpeg", ".jpg", {"quality": 80, "progressive": True, "optimize": True}),
+)
+
+# Files written by an earlier build: "final_photo.<width>.<hash>.<ext>"
+_VARIANT_RE = re.compile(rf"^{REVEAL_PHOTO_NAME}\.\d+\.[0-9a-f]{{10}}\.[a-z]+$")
+
+
+# -------------------------
+# Build (needs Pillow)
+# -------------------------
+
+def _encode(image, pillow_format, options):
+    out = io.BytesIO()
+    image.save(out, pillow_format, **options)
+    return out.getvalue()
+
+
+def _placeholder(image):
+    """
+    A ~16px wide JPEG as a data: URI (a few hundred bytes).
+    """
+    from PIL import ImageFilter
+
+    height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    tiny = image.resize((PLACEHOLDER_WIDTH, height)).filter(ImageFilter.GaussianBlur(1))
+    data = _encode(tiny, "JPEG", {"quality": 40})
+    return "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
+
+
+def build_reveal_photo(source, out_dir=STATIC_DIR, widths=REVEAL_WIDTHS):
+    """
+    Writes the variants and final_photo.json for `source` into `out_dir`.
+    Returns the manifest, plus a "report" list of (file name, bytes).
+    """
+    # A persona's photo goes in its own directory, e.g. static/<persona>/.
+    # Outside STATIC_DIR the files would not be served at all
+    url_dir = os.path.relpath(os.path.abspath(out_dir), os.path.abspath(STATIC_DIR)).replace(os.sep, "/")
+    if url_dir == ".." or url_dir.startswith("../"):
+        raise ValueError(f"{out_dir} is not inside {STATIC_DIR}, so it is not served under /static/")
+    url_prefix = "/static/" if url_dir == "." else f"/static/{url_dir}/"
+
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise SystemExit("reveal_photo.py needs Pillow: pip install Pillow")
+
+    with Image.open(source) as original:
+        # Phone photos are often stored sideways with an EXIF rotation
+        image = ImageOps.exif_transpose(original).convert("RGB")
+
+    os.makedirs(out_dir, exist_ok=True)
+    for name in os.listdir(out_dir):
+        if _VARIANT_RE.match(name):
+            os.remove(os.path.join(out_dir, name))
+
+    widths = sorted({min(width, image.width) for width in widths})
+    resized = {
+        width: image if width == image.width else image.resize(
+            (width, round(image.height * width / image.width)), Image.LANCZOS
+        )
+        for width in widths
+    }
+
+    sources, report = [], []
+    for pillow_format, mime, ext, options in FORMATS:
+        # Every width is encoded before any is written: a format that
+        # fails halfway leaves no files behind
+        try:
+            encoded = [(width, _encode(variant, pillow_format, options)) for width, variant in resized.items()]
+        except (KeyError, OSError, ValueError):
+            # This Pillow can't write the format (AVIF needs libavif)
+            continue
+
+        srcset = []
+        for width, data in encoded:
+            name = f"{REVEAL_PHOTO_NAME}.{width}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+            with open(os.path.join(out_dir, name), "wb") as f:
+                f.write(data)
+            srcset.append([url_prefix + name, width])
+            report.append((name, len(data)))
+        sources.append({"type": mime, "srcset": srcset})
+
+    jpeg = next(entry for entry in sources if entry["type"] == "image/jpeg")
+    fallback = [url for url, width in jpeg["srcset"] if width <= FALLBACK_WIDTH] or [jpeg["srcset"][0][0]]
+
+    manifest = {
+        "src": fallback[-1],
+        "width": image.width,
+        "height": image.height,
+        "placeholder": _placeholder(image),
+        "sources": sources,
+    }
+    with open(os.path.join(out_dir, f"{REVEAL_PHOTO_NAME}.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return {**manifest, "report": report}
+
+
+# -------------------------
+# Load (server start)
+# -------------------------
+
+def load_reveal_photo(path=REVEAL_PHOTO_MANIFEST):
+    """
+    The reveal payload's "photo" object, or None when no variants were built.
+
+    {
+        "src": "/static/final_photo.1080.….jpg",
+        "width": 3024, "height": 4032,
+        "sizes": "(max-width: 440px) 75vw, 315px",
+        "placeholder": "data:image/jpeg;base64,…",
+        "sources": [{"type": "image/avif", "srcset": [["/static/…", 480], …]}, …]
+    }
+    """
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring reveal photo manifest {path}: {e}")
+        return None
+
+    return {
+        "src": manifest["src"],
+        "width": manifest["width"],
+        "height": manifest["height"],
+        "sizes": REVEAL_SIZES,
+        "placeholder": manifest.get("placeholder"),
+        "sources": manifest["sources"],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="the full-size photo")
+    parser.add_argument("--out", default=STATIC_DIR)
+    args = parser.parse_args()
+
+    original_bytes = os.path.getsize(args.source)
+    try:
+        built = build_reveal_photo(args.source, args.out)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"{os.path.basename(args.source):40} {original_bytes:10} bytes (original)")
+    for name, size in built["report"]:
+        print(f"{name:40} {size:10} bytes")
+    print(f"placeholder: {len(built['placeholder'])} bytes inline")
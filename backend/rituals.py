@@ -0,0 +1,174 @@
+"""
+rituals.py
+
+Local fast path for ArtyBot's fixed call-and-response rituals.
+
+What this file does:
+- Recognises ritual messages like "QRE", "Alaabu", "paw-paw" and
+  "La Puchi Purpuri" (any casing, any number of repeated letters:
+  "alaaabuuu", "QREEE", "pawww-paw")
+- Answers them instantly from reply templates ("QREW {nickname} 💗"),
+  with no LLM round trip
+- Counts how many turns were answered this way
+
+How matching works:
+- Every pattern becomes a regex where each letter may repeat
+  ("qre" → "q+r+e+"), and spaces/hyphens are optional
+- All patterns are compiled into ONE alternation, so a message is
+  scanned once no matter how many rules there are
+- A message is only short-circuited when NOTHING else is left after
+  removing the rituals, nicknames and a few filler words.
+  "QRE Boo 💗" → fast path.  "QRE, how was work?" → the LLM answers.
+
+The rules live in each persona's rituals.json (see personas.py) so they
+can be edited without touching code. A persona without one has no rituals.
+
+Important:
+- This file does NOT call the LLM
+- llm.py asks `persona.rituals.reply(message)` before building a prompt
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import json
+import os
+import random
+import re
+import threading
+from collections import Counter
+
+
+# Seed for picking reply templates (set by bench/replay.py, so replayed
+# conversations get the same ritual replies every run)
+RITUALS_SEED = os.getenv("RITUALS_SEED")
+
+_WORD_RE = re.compile(r"[a-z]+")
+
+
+def collapse_repeats(text):
+    """
+    "Alaaabuuu" → "alabu": lowercase, runs of the same letter squashed.
+    """
+    return re.sub(r"(.)\1+", r"\1", text.lower())
+
+
+def pattern_to_regex(pattern):
+    """
+    "paw-paw" → r"p+a+w+[\\s\\-]*p+a+w+"  (repeat-tolerant, separator-tolerant)
+    """
+    parts = []
+    for char in collapse_repeats(pattern):
+        if char.isalnum():
+            parts.append(re.escape(char) + "+")
+        elif char in " -":
+            if not parts or parts[-1] != r"[\s\-]*":
+                parts.append(r"[\s\-]*")
+        else:
+            parts.append(re.escape(char))
+    return "".join(parts)
+
+
+class RitualEngine:
+    """
+    Single-pass matcher + reply templates for ritual messages.
+    """
+
+    def __init__(self, rules, nicknames, filler_words=(), rng=None):
+        self.rules = {rule["name"]: rule for rule in rules}
+        self.nicknames = list(nicknames)
+        self._rng = rng or random.Random()
+
+        # Words allowed around a ritual without disabling the fast path
+        self.filler = {collapse_repeats(word) for word in filler_words}
+        for nickname in self.nicknames:
+            self.filler.update(collapse_repeats(word) for word in _WORD_RE.findall(nickname.lower()))
+
+        # One named group per rule, all in one alternation
+        alternatives = []
+        for index, rule in enumerate(rules):
+            body = "|".join(pattern_to_regex(p) for p in rule["patterns"])
+            alternatives.append(f"(?P<r{index}>{body})")
+        self._group_names = {f"r{index}": rule["name"] for index, rule in enumerate(rules)}
+        self._matcher = re.compile(
+            r"(?<![a-z])(?:" + "|".join(alternatives) + r")(?![a-z])" if alternatives else r"(?!)",
+            re.IGNORECASE,
+        )
+
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(config["rules"], config["nicknames"], config.get("filler_words", ()), rng=random.Random(RITUALS_SEED))
+
+    def match(self, message):
+        """
+        Names of the rituals in `message`, in order, if the message is
+        ONLY rituals (plus nicknames / filler). Otherwise an empty list.
+        """
+        found = []
+        leftover = []
+        position = 0
+        for m in self._matcher.finditer(message):
+            leftover.append(message[position:m.start()])
+            position = m.end()
+            name = self._group_names[m.lastgroup]
+            if name not in found:
+                found.append(name)
+        leftover.append(message[position:])
+
+        if not found:
+            return []
+
+        for word in _WORD_RE.findall(" ".join(leftover).lower()):
+            if collapse_repeats(word) not in self.filler:
+                return []
+        return found
+
+    def mentions(self, message):
+        """
+        True if `message` contains a ritual anywhere, even with other text
+        around it ("QRE, how was work?").
+        """
+        return self._matcher.search(message) is not None
+
+    def reply(self, message):
+        """
+        Instant reply for a ritual-only message, or None if the LLM should answer.
+        """
+        # Rituals are short; don't regex-scan long messages at all
+        if len(message) > 80:
+            self._count("checked", "passed")
+            return None
+
+        names = self.match(message)
+        if not names:
+            self._count("checked", "passed")
+            return None
+
+        self._count("checked", "short_circuited", *(f"rule:{name}" for name in names))
+        return " ".join(
+            self._rng.choice(self.rules[name]["replies"]).format(nickname=self._rng.choice(self.nicknames))
+            for name in names
+        )
+
+    def _count(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._counts[key] += 1
+
+    def stats(self):
+        """
+        Counters: messages checked, short-circuited, passed to the LLM, per rule.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+        return {
+            "checked": counts.pop("checked", 0),
+            "short_circuited": counts.pop("short_circuited", 0),
+            "passed": counts.pop("passed", 0),
+            "by_rule": {key[5:]: value for key, value in counts.items()},
+        }
@@ -0,0 +1,352 @@
+"""
+session_store.py
+
+This file keeps per-session conversation state for ArtyBot.
+
+What this file does:
+- Gives every chat session (one browser / device) its own stage counter
+- Keeps memory bounded: least-recently-used sessions are evicted,
+  idle sessions expire after a TTL
+- Lets the storage backend be swapped via environment variables:
+    - "memory" → a dict inside this worker process (default, fastest)
+    - "sqlite" → a local SQLite file in WAL mode that every gunicorn
+                 worker on the same machine shares
+
+Important:
+- This file does NOT know about Flask or the LLM
+- llm.py only calls `advance_stage()` on the store (and `rewind_stage()`
+  when admission control turns an already-counted turn away, and
+  `restore()` at startup, from the transcripts)
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+# Used when the frontend does not send a session id (old clients, curl)
+DEFAULT_SESSION_ID = "default"
+
+# Session ids are generated by the browser, so keep them short and sane
+MAX_SESSION_ID_LENGTH = 64
+
+# Separates a persona's name from the session id in the stored key
+# ("bob:abc", see personas.py), so client ids may not contain it
+PERSONA_SEPARATOR = ":"
+
+# "memory" or "sqlite"
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "memory")
+
+# Where the shared SQLite file lives (only used by the sqlite backend)
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "artybot_sessions.db")
+
+# How many sessions we remember at most
+SESSION_MAX = int(os.getenv("SESSION_MAX", "10000"))
+
+# Sessions idle for longer than this are forgotten (seconds)
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(24 * 3600)))
+
+
+def is_valid_session_id(session_id):
+    """
+    True if `session_id` looks like something the frontend generated.
+
+    No ":" — the default persona stores sessions under the bare id, so
+    "bob:x" would otherwise be persona bob's session "x".
+    """
+    return (
+        isinstance(session_id, str)
+        and 0 < len(session_id) <= MAX_SESSION_ID_LENGTH
+        and session_id.isprintable()
+        and PERSONA_SEPARATOR not in session_id
+    )
+
+
+# -------------------------
+# Per-session record
+# -------------------------
+
+class SessionRecord:
+    """
+    Compact state for ONE chat session.
+
+    __slots__ keeps each record to a couple of machine words instead of
+    a full per-instance dict, so tens of thousands of sessions stay cheap.
+    """
+
+    __slots__ = ("stage", "last_seen")
+
+    def __init__(self, stage=0, last_seen=0.0):
+        self.stage = stage
+        self.last_seen = last_seen
+
+
+# -------------------------
+# In-process backend
+# -------------------------
+
+class MemorySessionBackend:
+    """
+    LRU + TTL session store living inside one worker process.
+
+    - OrderedDict keeps sessions in least → most recently used order
+    - Touching a session moves it to the end
+    - When full, the oldest session is dropped
+    - Expired sessions are dropped when they are looked up, and the
+      oldest end of the dict is swept on every write
+    """
+
+    def __init__(self, max_sessions=SESSION_MAX, ttl_seconds=SESSION_TTL_SECONDS, clock=time.monotonic):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._records = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._records)
+
+    def _expired(self, record, now):
+        return now - record.last_seen > self.ttl_seconds
+
+    def _sweep(self, now):
+        # Oldest entries sit at the front, so stop at the first live one
+        while self._records:
+            oldest_id, oldest = next(iter(self._records.items()))
+            if not self._expired(oldest, now):
+                break
+            del self._records[oldest_id]
+
+        while len(self._records) > self.max_sessions:
+            self._records.popitem(last=False)
+
+    def get_stage(self, session_id):
+        """
+        Current stage for `session_id` (0 if unknown or expired).
+        """
+        now = self._clock()
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is None:
+                return 0
+            if self._expired(record, now):
+                del self._records[session_id]
+                return 0
+            return record.stage
+
+    def advance_stage(self, session_id):
+        """
+        Increments the stage for `session_id` and returns the new value.
+        """
+        now = self._clock()
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is None or self._expired(record, now):
+                record = SessionRecord()
+                self._records[session_id] = record
+            else:
+                self._records.move_to_end(session_id)
+
+            record.stage += 1
+            record.last_seen = now
+
+            self._sweep(now)
+            return record.stage
+
+    def rewind_stage(self, session_id):
+        """
+        Undoes one advance_stage(), for a turn that was turned away
+        before it was answered.
+        """
+        with self._lock:
+            record = self._records.get(session_id)
+            if record is not None and record.stage > 0:
+                record.stage -= 1
+
+    def restore(self, session_id, stage, age_seconds):
+        """
+        Puts back a session from before a restart (see transcripts.py),
+        last seen `age_seconds` ago. Sessions already here are left alone.
+        Returns True if it was restored.
+        """
+        if age_seconds > self.ttl_seconds:
+            return False
+        now = self._clock()
+        record = SessionRecord(stage, now - age_seconds)
+        with self._lock:
+            if session_id in self._records:
+                return False
+
+            # Oldest first, like everything else here (_sweep() and the LRU
+            # rely on it): slot it in before the sessions seen after it
+            newer = []
+            while self._records:
+                newest_id = next(reversed(self._records))
+                if self._records[newest_id].last_seen <= record.last_seen:
+                    break
+                newer.append(self._records.popitem())
+            self._records[session_id] = record
+            for newer_id, newer_record in reversed(newer):
+                self._records[newer_id] = newer_record
+
+            self._sweep(now)
+            return True
+
+    def reset(self, session_id):
+        with self._lock:
+            self._records.pop(session_id, None)
+
+
+# -------------------------
+# Shared SQLite backend
+# -------------------------
+
+class SQLiteSessionBackend:
+    """
+    Session store backed by a local SQLite file in WAL mode.
+
+    Why this works across gunicorn workers:
+    - WAL lets readers run while one writer commits
+    - Each thread gets its own connection (no shared Python lock)
+    - advance_stage() is ONE upsert statement, so the write lock is held
+      for microseconds and workers never queue behind each other
+    - Eviction runs only every `prune_every` writes, not on every request
+    """
+
+    def __init__(
+        self,
+        path=SESSION_DB_PATH,
+        max_sessions=SESSION_MAX,
+        ttl_seconds=SESSION_TTL_SECONDS,
+        prune_every=256,
+        clock=time.time,
+    ):
+        self.path = path
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self._clock = clock
+        self._local = threading.local()
+        self._writes = 0
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                stage      INTEGER NOT NULL,
+                last_seen  REAL    NOT NULL
+            ) WITHOUT ROWID
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_seen ON sessions (last_seen)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # A forked worker must not reuse the parent's connection
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def get_stage(self, session_id):
+        row = self._connection().execute(
+            "SELECT stage, last_seen FROM sessions WHERE session_id = ?",
+            (session_id,),
+        ).fetchone()
+        if row is None or self._clock() - row[1] > self.ttl_seconds:
+            return 0
+        return row[0]
+
+    def advance_stage(self, session_id):
+        now = self._clock()
+        cutoff = now - self.ttl_seconds
+
+        # Expired sessions restart from 1, live ones are incremented
+        (stage,) = self._connection().execute(
+            """
+            INSERT INTO sessions (session_id, stage, last_seen) VALUES (?, 1, ?)
+            ON CONFLICT (session_id) DO UPDATE SET
+                stage = CASE WHEN last_seen < ? THEN 1 ELSE stage + 1 END,
+                last_seen = excluded.last_seen
+            RETURNING stage
+            """,
+            (session_id, now, cutoff),
+        ).fetchone()
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune(now)
+
+        return stage
+
+    def rewind_stage(self, session_id):
+        self._connection().execute(
+            "UPDATE sessions SET stage = stage - 1 WHERE session_id = ? AND stage > 0",
+            (session_id,),
+        )
+
+    def restore(self, session_id, stage, age_seconds):
+        # The file outlives restarts: normally every session is still here
+        if age_seconds > self.ttl_seconds:
+            return False
+        cursor = self._connection().execute(
+            "INSERT INTO sessions (session_id, stage, last_seen) VALUES (?, ?, ?) ON CONFLICT (session_id) DO NOTHING",
+            (session_id, stage, self._clock() - age_seconds),
+        )
+        return cursor.rowcount == 1
+
+    def prune(self, now=None):
+        """
+        Deletes expired sessions and trims the table to `max_sessions`.
+        """
+        now = self._clock() if now is None else now
+        conn = self._connection()
+        conn.execute("DELETE FROM sessions WHERE last_seen < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            """
+            DELETE FROM sessions WHERE session_id IN (
+                SELECT session_id FROM sessions
+                ORDER BY last_seen DESC
+                LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_sessions,),
+        )
+
+    def reset(self, session_id):
+        self._connection().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+
+# -------------------------
+# Factory
+# -------------------------
+
+def create_session_store(backend=None):
+    """
+    Builds the session store selected by SESSION_BACKEND.
+    """
+    backend = backend or SESSION_BACKEND
+
+    if backend == "memory":
+        return MemorySessionBackend()
+    if backend == "sqlite":
+        return SQLiteSessionBackend()
+
+    raise ValueError(f"Unknown SESSION_BACKEND: {backend!r} (expected 'memory' or 'sqlite')")
@@ -0,0 +1,150 @@
+"""
+single_flight.py
+
+Coalesces identical chat requests that are in flight at the same time.
+
+Why:
+- A double-tap on Enter, or a client retrying after a slow reply, sends
+  the same message for the same session while the first request is still
+  waiting on Groq. Each copy advanced the stage and paid for its own LLM call.
+
+What this file does:
+- Keys every request by (session id, hash of the message)
+- The FIRST request for a key becomes the leader and does the real work
+- Requests that arrive while the leader is running become followers:
+  they wait on the leader's future and get the same (reply, is_final)
+- Works for threads (app.py) and asyncio (asgi.py): followers either
+  block on the future or await it
+
+Important:
+- Per worker process: duplicates that land on two different gunicorn
+  workers are not coalesced (the idempotency store covers retries)
+- Followers wait at most SINGLE_FLIGHT_WAIT_SECONDS, then give up
+- A flight older than SINGLE_FLIGHT_MAX_AGE_SECONDS is dropped, so a
+  leader that never finishes (a bug, a lost stream) cannot hold its key
+  forever: the next request for it becomes a new leader
+- This file does NOT call the LLM
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+
+# How long a duplicate waits for the first request's reply (seconds).
+# A bit more than the LLM deadline, so followers outlive a slow leader.
+SINGLE_FLIGHT_WAIT_SECONDS = float(os.getenv("SINGLE_FLIGHT_WAIT_SECONDS", "20"))
+
+# Flights older than this are treated as abandoned (seconds). Well past
+# the LLM deadline plus the time to stream a long reply.
+SINGLE_FLIGHT_MAX_AGE_SECONDS = float(os.getenv("SINGLE_FLIGHT_MAX_AGE_SECONDS", "120"))
+
+
+def make_key(session_id, message):
+    """
+    "session|sha256(message)": the same text in the same session.
+    """
+    return f"{session_id}|{hashlib.sha256(message.encode('utf-8')).hexdigest()}"
+
+
+class SingleFlight:
+    """
+    Map of key → (Future, start time) for the requests currently in flight.
+
+    Leader:    future, leader = flights.join(key)
+               ... work ...
+               flights.finish(key, future, result)       (or error=...)
+    Follower:  result = flights.wait(future)             (or await flights.await_result(future))
+    """
+
+    def __init__(self, wait_seconds=SINGLE_FLIGHT_WAIT_SECONDS, max_age=SINGLE_FLIGHT_MAX_AGE_SECONDS, clock=time.monotonic):
+        self.wait_seconds = wait_seconds
+        self.max_age = max_age
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._counts = Counter()
+
+    def __len__(self):
+        return len(self._flights)
+
+    def join(self, key):
+        """
+        (future, is_leader). Only the leader may call finish().
+        """
+        now = self._clock()
+        with self._lock:
+            self._evict(now)
+            flight = self._flights.get(key)
+            if flight is not None:
+                self._counts["followers"] += 1
+                return flight[0], False
+
+            future = Future()
+            self._flights[key] = (future, now)
+            self._counts["leaders"] += 1
+            return future, True
+
+    def finish(self, key, future, result=None, error=None):
+        """
+        Hands the leader's result (or error) to every follower and lets
+        the next request with this key start a new flight.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None and flight[0] is future:
+                del self._flights[key]
+
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _evict(self, now):
+        # Caller holds the lock. The evicted future is left alone: its
+        # followers time out, and a late finish() still reaches them
+        stale = [key for key, (_, started) in self._flights.items() if now - started > self.max_age]
+        for key in stale:
+            del self._flights[key]
+        self._counts["evicted"] += len(stale)
+
+    def wait(self, future):
+        """
+        The leader's result. Raises the leader's error, or TimeoutError.
+        """
+        try:
+            return future.result(timeout=self.wait_seconds)
+        except FutureTimeoutError:
+            self._count("timeouts")
+            raise TimeoutError("single-flight leader did not finish in time") from None
+
+    async def await_result(self, future):
+        """
+        Same as wait(), without blocking the event loop.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), self.wait_seconds)
+        except asyncio.TimeoutError:
+            self._count("timeouts")
+            raise TimeoutError("single-flight leader did not finish in time") from None
+
+    def _count(self, key):
+        with self._lock:
+            self._counts[key] += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self._counts["leaders"],
+                "followers": self._counts["followers"],
+                "timeouts": self._counts["timeouts"],
+                "evicted": self._counts["evicted"],
+            }
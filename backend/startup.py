@@ -0,0 +1,191 @@
+"""
+startup.py
+
+What a worker does before it takes traffic, and whether it is ready.
+
+Why:
+- On a Render cold start the first user request paid for everything
+  nobody had done yet: importing the Groq SDK, creating the client, and
+  the TCP + TLS handshake to Groq. That is the slowest reply of the day,
+  and usually it is the first message of a conversation.
+
+What this file does:
+- restore()  → puts recent sessions back from the transcripts (stage and
+               last exchanges, see llm.restore_sessions), so a restart
+               doesn't send everyone back to stage 1
+- prepare()  → the fork-safe part: restore(), imports the LLM SDK and
+               builds one prompt end to end (persona, knowledge index,
+               length directive). With GUNICORN_PRELOAD=1 it runs once
+               in the gunicorn master and every worker inherits the result.
+- warm_up()  → per process: starts watching the loaded personas'
+               prompt files (personas.py), prepare(), then creates the LLM client and
+               opens its connection pool. Only then is the process READY.
+               gunicorn.conf.py runs it before a worker accepts requests.
+- warm_up_async() → the same connection warm-up for the async client
+               (asgi.py runs it at lifespan startup, on the event loop
+               that will use the connections)
+- readiness  → liveness vs readiness, for /livez and /readyz:
+    - live:  the process answers at all
+    - ready: warm-up has finished (it is ready even if Groq could not be
+             reached: ritual and cached replies still work, and the
+             client retries Groq on the first real request)
+
+Settings:
+- STARTUP_WARMUP=0 → skip the warm-up, ready right after restore()
+- STARTUP_WARMUP_TIMEOUT_SECONDS → how long the connection warm-up may
+  take; it must stay well under gunicorn's worker timeout
+
+`python -m bench.cold_start` prints the import-time profile and the
+warm-up timings.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import os
+import threading
+import time
+
+from llm import build_prompt, llm_backend, persona_registry, restore_sessions
+
+
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "1") != "0"
+STARTUP_WARMUP_TIMEOUT_SECONDS = float(os.getenv("STARTUP_WARMUP_TIMEOUT_SECONDS", "10"))
+
+# Goes through knowledge retrieval and the tokenizer like a real message
+WARMUP_MESSAGE = "Hi Boo, how was your day? Did you eat?"
+
+
+# -------------------------
+# Readiness
+# -------------------------
+
+class Readiness:
+    """
+    Per process. `report` holds the warm-up timings (seconds) and the
+    connection error, if there was one.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self.started = clock()
+        self.ready = False
+        self.report = {}
+        self._lock = threading.Lock()
+
+    def mark_ready(self, **report):
+        with self._lock:
+            self.report.update(report)
+            self.ready = True
+
+    def add(self, **report):
+        with self._lock:
+            self.report.update(report)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "uptime_seconds": round(self._clock() - self.started, 3),
+                "warmup": dict(self.report),
+            }
+
+
+readiness = Readiness()
+
+
+# -------------------------
+# Warm-up
+# -------------------------
+
+_restored = False
+_prepared = False
+
+
+def restore():
+    """
+    Restores recent sessions from the transcripts, once per process (or
+    once in the master, with preload).
+    """
+    global _restored
+    if _restored:
+        return
+    _restored = True
+
+    started = time.perf_counter()
+    try:
+        restored = restore_sessions()
+    except Exception as e:
+        # Start anyway: sessions begin at stage 1, as before
+        print(f"Session restore failed: {type(e).__name__}: {e}")
+        restored = 0
+    readiness.add(restored_sessions=restored, restore_seconds=round(time.perf_counter() - started, 4))
+
+
+def prepare():
+    """
+    Imports and compiles everything that is safe to share across a fork.
+    Returns its duration in seconds (0 if it already ran).
+    """
+    global _prepared
+    if _prepared:
+        return 0.0
+
+    started = time.perf_counter()
+    restore()
+    llm_backend.prepare()
+    build_prompt(WARMUP_MESSAGE)
+    _prepared = True
+    return time.perf_counter() - started
+
+
+def _connect_error(error):
+    print(f"LLM warm-up failed: {type(error).__name__}: {error}")
+    return f"{type(error).__name__}: {error}"
+
+
+def warm_up():
+    """
+    Makes this process ready: prepare(), then open the LLM connection pool.
+    """
+    # Per process, after the fork: picks up edits to the loaded personas
+    persona_registry.watch()
+
+    if readiness.ready:
+        return
+    if not STARTUP_WARMUP:
+        restore()
+        readiness.mark_ready(skipped=True)
+        return
+
+    prepare_seconds = prepare()
+
+    started = time.perf_counter()
+    error = None
+    try:
+        llm_backend.connect(STARTUP_WARMUP_TIMEOUT_SECONDS)
+    except Exception as e:
+        error = _connect_error(e)
+
+    readiness.mark_ready(
+        prepare_seconds=round(prepare_seconds, 4),
+        connect_seconds=round(time.perf_counter() - started, 4),
+        connect_error=error,
+    )
+
+
+async def warm_up_async():
+    """
+    Opens the async client's connection pool (on the running event loop).
+    """
+    if not STARTUP_WARMUP:
+        return
+
+    started = time.perf_counter()
+    error = None
+    try:
+        await llm_backend.aconnect(STARTUP_WARMUP_TIMEOUT_SECONDS)
+    except Exception as e:
+        error = _connect_error(e)
+
+    readiness.add(connect_async_seconds=round(time.perf_counter() - started, 4), connect_async_error=error)
@@ -0,0 +1,298 @@
+"""
+static_files.py
+
+Serves /static (the final-reveal photo and any other media) efficiently.
+
+What this file does:
+- Picks a PRECOMPRESSED variant of text assets when the browser accepts
+  it: "style.css.br" (Brotli) or "style.css.gz" (gzip) next to the file.
+  `python static_files.py` creates them.
+- Conditional requests: ETag + Last-Modified, answered with 304 Not
+  Modified (no body) when the browser's copy is still current
+- Byte ranges: "Range: bytes=..." → 206 Partial Content, so audio / video
+  can seek without downloading everything before the seek point
+- Cache-Control:
+    - fingerprinted names ("photo.3f9a1c2b7d.jpg", see
+      frontend/build_assets.py) → cached for a year, immutable
+    - everything else → "no-cache": kept, but revalidated (cheap 304)
+- The response body is the open file itself, so gunicorn can hand it to
+  the kernel with sendfile() (app.py), and uvicorn with zerocopysend
+  when the server supports it (asgi.py)
+
+Important:
+- Only files inside STATIC_DIR are served (no "../" escapes)
+- This file does NOT know about Flask or ASGI: app.py and asgi.py turn
+  a StaticResponse into their own response objects
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import email.utils
+import gzip
+import mimetypes
+import os
+import re
+import sys
+
+
+STATIC_DIR = os.getenv("STATIC_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "static"))
+
+# Chunk size when the body has to be read instead of sendfile()'d
+CHUNK_SIZE = 64 * 1024
+
+# "name.<10 hex chars>.ext" (what build_assets.py and reveal_photo.py
+# write): the URL changes whenever the content does
+_FINGERPRINT_RE = re.compile(r"\.[0-9a-f]{10}\.[A-Za-z0-9]+$")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+# Types worth compressing (images, audio and video already are)
+COMPRESSIBLE_TYPES = {"application/javascript", "application/json", "image/svg+xml", "text/javascript"}
+
+# Preferred first
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def is_compressible(content_type):
+    return content_type.startswith("text/") or content_type in COMPRESSIBLE_TYPES
+
+
+def accepted_encodings(header):
+    """
+    "gzip, br;q=0.8, deflate;q=0" → {"gzip", "br"}
+    """
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        match = re.search(r"q=([0-9.]+)", params)
+        if match:
+            try:
+                q = float(match.group(1))
+            except ValueError:
+                q = 0.0
+        if name and q > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def parse_range(header, size):
+    """
+    (start, length) for a single "bytes=a-b" range, "unsatisfiable", or
+    None (no range / not one we handle: send the whole file).
+    """
+    match = _RANGE_RE.match((header or "").strip())
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+
+    if not first:
+        # "bytes=-500": the last 500 bytes
+        length = min(int(last), size)
+        if length == 0:
+            return "unsatisfiable"
+        return size - length, length
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return "unsatisfiable"
+    return start, end - start + 1
+
+
+# -------------------------
+# One response
+# -------------------------
+
+class StaticResponse:
+    """
+    What to send: status, headers and (for 200 / 206) which bytes of
+    which file. `path` is None when there is no body.
+    """
+
+    __slots__ = ("status", "headers", "path", "start", "length")
+
+    def __init__(self, status, headers, path=None, start=0, length=0):
+        self.status = status
+        self.headers = headers
+        self.path = path
+        self.start = start
+        self.length = length
+
+    def open(self):
+        """
+        The file, positioned at the first byte to send.
+        """
+        f = open(self.path, "rb")
+        f.seek(self.start)
+        return f
+
+    def iter_body(self, f):
+        """
+        Plain reads, for servers without sendfile(): exactly `length` bytes.
+        """
+        remaining = self.length
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+# -------------------------
+# Static directory
+# -------------------------
+
+class StaticFiles:
+    def __init__(self, directory=STATIC_DIR):
+        self.directory = os.path.realpath(directory)
+
+    def _resolve(self, filename):
+        """
+        Absolute path of `filename` inside the directory, or None.
+        """
+        path = os.path.realpath(os.path.join(self.directory, filename))
+        if not path.startswith(self.directory + os.sep) or not os.path.isfile(path):
+            return None
+        return path
+
+    def respond(self, method, filename, header):
+        """
+        Decides the response for GET / HEAD /static/<filename>.
+
+        header: function(name) → request header value or None
+        """
+        path = self._resolve(filename)
+        if path is None or filename.endswith((".br", ".gz")):
+            return StaticResponse(404, [("Content-Type", "text/plain; charset=utf-8")])
+
+        content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        headers = []
+
+        # Precompressed variant, if one exists and the browser takes it
+        encoding = None
+        if is_compressible(content_type):
+            headers.append(("Vary", "Accept-Encoding"))
+            accepted = accepted_encodings(header("Accept-Encoding"))
+            for name, suffix in ENCODINGS:
+                if name in accepted and os.path.isfile(path + suffix):
+                    path, encoding = path + suffix, name
+                    headers.append(("Content-Encoding", name))
+                    break
+            if content_type.startswith("text/") or content_type.endswith(("javascript", "json")):
+                content_type += "; charset=utf-8"
+
+        stat = os.stat(path)
+        size = stat.st_size
+        etag = f'"{size:x}-{stat.st_mtime_ns:x}{"-" + encoding if encoding else ""}"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        cache_control = IMMUTABLE_CACHE_CONTROL if _FINGERPRINT_RE.search(filename) else REVALIDATE_CACHE_CONTROL
+
+        headers += [
+            ("Content-Type", content_type),
+            ("ETag", etag),
+            ("Last-Modified", last_modified),
+            ("Cache-Control", cache_control),
+            ("Accept-Ranges", "bytes"),
+        ]
+
+        # The browser's copy is still current → 304, no body
+        if self._not_modified(header, etag, stat.st_mtime):
+            return StaticResponse(304, headers)
+
+        # Byte range (ignored when If-Range names another version)
+        byte_range = None
+        if_range = header("If-Range")
+        if if_range is None or if_range == etag:
+            byte_range = parse_range(header("Range"), size)
+
+        if byte_range == "unsatisfiable":
+            return StaticResponse(416, headers + [("Content-Range", f"bytes */{size}"), ("Content-Length", "0")])
+
+        if byte_range is not None:
+            start, length = byte_range
+            headers += [
+                ("Content-Range", f"bytes {start}-{start + length - 1}/{size}"),
+                ("Content-Length", str(length)),
+            ]
+            status = 206
+        else:
+            start, length = 0, size
+            headers.append(("Content-Length", str(size)))
+            status = 200
+
+        if method == "HEAD":
+            return StaticResponse(status, headers)
+        return StaticResponse(status, headers, path, start, length)
+
+    @staticmethod
+    def _not_modified(header, etag, mtime):
+        if_none_match = header("If-None-Match")
+        if if_none_match is not None:
+            # Weak comparison: W/"x" matches "x"
+            candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            return "*" in candidates or etag in candidates
+
+        if_modified_since = header("If-Modified-Since")
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(mtime) <= since
+        return False
+
+
+# -------------------------
+# Precompression (run at deploy / build time)
+# -------------------------
+
+def precompress(directory=STATIC_DIR):
+    """
+    Writes name.gz (and name.br if the `brotli` package is installed)
+    next to every compressible file, when it is actually smaller.
+    Returns [(name, original bytes, best compressed bytes)].
+    """
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    results = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if name.endswith((".br", ".gz")):
+                continue
+            content_type = mimetypes.guess_type(name)[0] or ""
+            if not is_compressible(content_type):
+                continue
+
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+
+            variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants[".br"] = brotli.compress(data, quality=11)
+
+            best = len(data)
+            for suffix, compressed in variants.items():
+                if len(compressed) < len(data):
+                    with open(path + suffix, "wb") as f:
+                        f.write(compressed)
+                    best = min(best, len(compressed))
+            results.append((os.path.relpath(path, directory), len(data), best))
+    return results
+
+
+if __name__ == "__main__":
+    directory = sys.argv[1] if len(sys.argv) > 1 else STATIC_DIR
+    for name, original, best in precompress(directory):
+        print(f"{name:40} {original:10} → {best:10} bytes")
@@ -0,0 +1,20 @@
+"""
+tests/conftest.py
+
+Unit tests for the backend (run from backend/):
+
+    python -m pytest -q tests
+
+They never talk to Groq: LLM_BACKEND is the local stub, and the
+resilience tests drive llm_client.py with a scripted fake backend.
+"""
+
+import os
+import sys
+
+# The backend modules import each other by their plain names
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("LLM_BACKEND", "stub")
+# Nothing written next to the real transcripts, nothing restored from them
+os.environ.setdefault("TRANSCRIPT_BACKEND", "off")
@@ -0,0 +1,246 @@
+"""
+tests/test_admission.py
+
+admission.py: client IPs, Retry-After values, token buckets and the LLM
+queue, plus llm.py rewinding the stage of a turn that was turned away.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import (
+    AsyncLLMGate,
+    ChatRateLimiter,
+    LLMGate,
+    Overloaded,
+    RateLimited,
+    RateLimiter,
+    client_ip,
+)
+
+
+def test_client_ip_uses_the_entry_added_by_the_proxy():
+    assert client_ip("203.0.113.7", "10.0.0.1") == "203.0.113.7"
+    assert client_ip("198.51.100.1, 203.0.113.7", "10.0.0.1") == "203.0.113.7"
+
+
+def test_forged_leading_entry_does_not_change_the_key():
+    honest = client_ip("203.0.113.7", "10.0.0.1")
+    for forged in ("1.2.3.4", "5.6.7.8, 9.9.9.9", "not-an-ip"):
+        assert client_ip(f"{forged}, 203.0.113.7", "10.0.0.1") == honest
+
+
+def test_trusted_hops():
+    forwarded_for = "1.2.3.4, 203.0.113.7, 10.1.1.1"
+    assert client_ip(forwarded_for, "10.0.0.1", trusted_hops=2) == "203.0.113.7"
+    # Fewer entries than proxies: every entry came from a proxy
+    assert client_ip("203.0.113.7", "10.0.0.1", trusted_hops=3) == "203.0.113.7"
+    # No proxy: the header is the client's own, ignore it
+    assert client_ip(forwarded_for, "10.0.0.1", trusted_hops=0) == "10.0.0.1"
+
+
+def test_client_ip_without_header():
+    assert client_ip(None, "10.0.0.1") == "10.0.0.1"
+    assert client_ip(" , ", "10.0.0.1") == "10.0.0.1"
+    assert client_ip(None, None) == "unknown"
+
+
+# -------------------------
+# Retry-After
+# -------------------------
+
+def test_retry_after_header_is_whole_seconds_at_least_one():
+    assert RateLimited("session_rate", 0.2).retry_after_header == "1"
+    assert RateLimited("session_rate", 1.0).retry_after_header == "1"
+    assert Overloaded("deadline", 2.01).retry_after_header == "3"
+    assert RateLimited("ip_rate", 0.5).status == 429
+    assert Overloaded("queue_full", 0.5).status == 503
+
+
+# -------------------------
+# Token buckets
+# -------------------------
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_burst_then_rate():
+    clock = FakeClock()
+    limiter = RateLimiter(per_minute=60, burst=3, clock=clock)
+    assert [limiter.take("a") for _ in range(3)] == [0, 0, 0]
+    # Empty: one token per second at 60/minute
+    assert limiter.take("a") == pytest.approx(1.0)
+    clock.now += 0.5
+    assert limiter.take("a") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter.take("a") == 0
+    # Other keys have their own bucket
+    assert limiter.take("b") == 0
+
+
+def test_rate_limit_off():
+    limiter = RateLimiter(per_minute=0, burst=1)
+    assert all(limiter.take("a") == 0 for _ in range(100))
+
+
+def test_chat_rate_limiter_raises_with_retry_after():
+    rejected = []
+    limiter = ChatRateLimiter(on_reject=rejected.append)
+    limiter.sessions = RateLimiter(per_minute=6, burst=1, clock=FakeClock())
+    limiter.check("s", "203.0.113.7")
+    with pytest.raises(RateLimited) as error:
+        limiter.check("s", "203.0.113.7")
+    assert error.value.reason == "session_rate"
+    assert error.value.retry_after == pytest.approx(10.0)
+    assert error.value.retry_after_header == "10"
+    assert rejected == ["session_rate"]
+
+
+def test_rate_limiter_forgets_least_recent_clients():
+    limiter = RateLimiter(per_minute=60, burst=1, max_clients=2, clock=FakeClock())
+    for key in ("a", "b", "c"):
+        limiter.take(key)
+    assert len(limiter) == 2
+    # "a" was dropped: it starts again with a full bucket
+    assert limiter.take("a") == 0
+
+
+# -------------------------
+# LLM gate
+# -------------------------
+
+def _hold_slot(gate):
+    """
+    Takes one slot in another thread; set the returned event to free it.
+    """
+    taken, release = threading.Event(), threading.Event()
+
+    def hold():
+        with gate.slot():
+            taken.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold, daemon=True)
+    thread.start()
+    assert taken.wait(5)
+    return release, thread
+
+
+def test_gate_sheds_after_queue_timeout():
+    rejected = []
+    gate = LLMGate(max_concurrency=1, max_queue=4, queue_timeout=0.05, on_reject=rejected.append)
+    release, thread = _hold_slot(gate)
+    try:
+        started = time.monotonic()
+        with pytest.raises(Overloaded) as error:
+            with gate.slot():
+                pass
+        assert time.monotonic() - started >= 0.05
+        assert error.value.reason == "queue_timeout"
+        assert error.value.retry_after == pytest.approx(0.05)
+        assert rejected == ["queue_timeout"]
+        assert gate.stats()["waiting"] == 0
+    finally:
+        release.set()
+        thread.join()
+
+    # The slot is free again
+    with gate.slot():
+        assert gate.stats()["active"] == 1
+
+
+def test_gate_sheds_when_queue_full():
+    gate = LLMGate(max_concurrency=1, max_queue=0, queue_timeout=5)
+    release, thread = _hold_slot(gate)
+    try:
+        with pytest.raises(Overloaded) as error:
+            gate.admit()
+        assert error.value.reason == "queue_full"
+        assert error.value.retry_after_header == "5"
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_gate_sheds_when_expected_wait_is_too_long():
+    gate = LLMGate(max_concurrency=1, max_queue=10, queue_timeout=1.0)
+    # Calls have been taking 3 s each
+    gate._observe_hold(3.0)
+    release, thread = _hold_slot(gate)
+    try:
+        with pytest.raises(Overloaded) as error:
+            gate.admit()
+        assert error.value.reason == "deadline"
+        assert error.value.retry_after == pytest.approx(3.0)
+        assert error.value.retry_after_header == "3"
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_async_gate_sheds_after_queue_timeout():
+    gate = AsyncLLMGate(max_concurrency=1, max_queue=4, queue_timeout=0.05)
+
+    async def run():
+        holding = asyncio.Event()
+        release = asyncio.Event()
+
+        async def hold():
+            async with gate.slot():
+                holding.set()
+                await release.wait()
+
+        holder = asyncio.ensure_future(hold())
+        await holding.wait()
+        with pytest.raises(Overloaded) as error:
+            async with gate.slot():
+                pass
+        release.set()
+        await holder
+        return error.value
+
+    error = asyncio.run(run())
+    assert error.reason == "queue_timeout"
+    assert gate.stats()["waiting"] == 0 and gate.stats()["active"] == 0
+
+
+# -------------------------
+# Turned-away turns (llm.py)
+# -------------------------
+
+def _shedding_gate():
+    return LLMGate(max_concurrency=0, max_queue=0, queue_timeout=1)
+
+
+def test_turn_shed_by_the_llm_queue_rewinds_the_stage(monkeypatch):
+    import llm
+
+    session_id = "admission-test-slot"
+    monkeypatch.setattr(llm, "llm_gate", _shedding_gate())
+    with pytest.raises(Overloaded):
+        llm.process_user_message("tell me about the lake that summer", session_id)
+    assert llm.session_store.get_stage(session_id) == 0
+
+    monkeypatch.undo()
+    llm.process_user_message("tell me about the lake that summer", session_id)
+    assert llm.session_store.get_stage(session_id) == 1
+
+
+def test_turn_shed_at_admission_rewinds_the_stage(monkeypatch):
+    import llm
+
+    session_id = "admission-test-admit"
+    llm.process_user_message("hi", session_id)
+    # start_turn()'s default gate is the one admit() is called on
+    monkeypatch.setattr(llm.start_turn, "__defaults__", (_shedding_gate(),))
+    with pytest.raises(Overloaded):
+        llm.process_user_message("what did you eat today", session_id)
+    assert llm.session_store.get_stage(session_id) == 1
@@ -0,0 +1,36 @@
+"""
+tests/test_asgi_routes.py
+
+asgi.py routing: persona-prefixed paths only reach the chat routes.
+"""
+
+import asyncio
+
+import pytest
+
+import asgi
+
+
+def _get(path):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "headers": [], "client": ("127.0.0.1", 1)}
+    asyncio.run(asgi.app(scope, receive, send))
+    return sent[0]["status"]
+
+
+@pytest.mark.parametrize("path", ["/p/artija/static/final_photo.jpg", "/p/artija/metrics", "/p/artija/"])
+def test_persona_prefix_only_routes_chat(path):
+    assert _get(path) == 404
+
+
+def test_split_persona():
+    assert asgi.split_persona("/p/bob/chat/stream") == ("bob", "/chat/stream")
+    assert asgi.split_persona("/static/p/x") == (None, "/static/p/x")
+    assert asgi.split_persona("/p/bob") == (None, "/p/bob")
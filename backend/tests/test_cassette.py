@@ -0,0 +1,41 @@
+"""
+tests/test_cassette.py
+
+llm_backends.CassetteBackend: recording through the async client, then
+replaying what was recorded.
+"""
+
+import asyncio
+
+from llm_backends import CassetteBackend, StubBackend
+
+
+def _instant_stub():
+    return StubBackend(ttft="fixed:0", tokens_per_second=1e9, error_rate=0, timeout_rate=0)
+
+
+def test_async_recording_replays(tmp_path):
+    path = str(tmp_path / "cassette.json")
+    recorder = CassetteBackend(path, inner=_instant_stub())
+    plain = [{"role": "user", "content": "hello there"}]
+    streamed = [{"role": "user", "content": "tell me a story"}]
+
+    async def record():
+        response = await recorder.acomplete(model="m", messages=plain)
+        stream = await recorder.acomplete(model="m", messages=streamed, stream=True)
+        text = "".join([chunk.choices[0].delta.content or "" async for chunk in stream if chunk.choices])
+        return response.choices[0].message.content, text
+
+    plain_reply, streamed_reply = asyncio.run(record())
+    recorder.save()
+    assert recorder.stats()["recorded"] == 2
+
+    player = CassetteBackend(path)
+
+    async def replay(messages):
+        response = await player.acomplete(model="m", messages=messages)
+        return response.choices[0].message.content
+
+    assert asyncio.run(replay(plain)) == plain_reply
+    assert asyncio.run(replay(streamed)) == streamed_reply
+    assert player.stats()["miss"] == 0
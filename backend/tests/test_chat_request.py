@@ -0,0 +1,30 @@
+"""
+tests/test_chat_request.py
+
+app.py's chat request validation, shared by /chat, /chat/stream,
+asgi.py and the WebSocket.
+"""
+
+import pytest
+
+from app import validate_chat_payload
+
+
+@pytest.mark.parametrize("message", [123, None, [1, 2], {"text": "hi"}, True])
+def test_non_string_message_is_rejected(message):
+    assert validate_chat_payload({"message": message}) == (None, None, "message must be a string")
+
+
+def test_valid_payload():
+    user_message, session_id, error = validate_chat_payload({"message": "hi", "session_id": "abc123"})
+    assert (user_message, session_id, error) == ("hi", "abc123", None)
+
+
+def test_missing_message():
+    assert validate_chat_payload({"session_id": "abc123"})[2] == "No message provided"
+    assert validate_chat_payload(["hi"])[2] == "No message provided"
+
+
+def test_session_id_cannot_reach_another_personas_session():
+    # The default persona keeps bare ids: "bob:x" would be persona bob's "x"
+    assert validate_chat_payload({"message": "hi", "session_id": "bob:x"}) == (None, None, "Invalid session_id")
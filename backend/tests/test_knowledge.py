@@ -0,0 +1,102 @@
+"""
+tests/test_knowledge.py
+
+knowledge.py: splitting the knowledge base into core persona text and
+retrievable chunks, top-k selection under the token budget, and recall
+on the default persona (the cases of bench/recall_cases.json).
+"""
+
+import json
+import os
+
+import pytest
+
+from knowledge import KNOWLEDGE_TOKEN_BUDGET, KnowledgeIndex, render_chunks, split_knowledge_base
+from personas import DEFAULT_PERSONA, PERSONAS_DIR
+from prompts import read_persona
+
+
+KNOWLEDGE_BASE = """
+1. PERSONALITY OF ARTY:
+- warm, playful and a little dramatic
+2. TEXTING STYLE OF ARTY:
+- short lines with lots of emojis
+4. FOOTBALL AND FAVOURITE CLUBS:
+- FAVOURITE CLUB - FCB, since forever
+- favourite player: Messi, the greatest of all time
+- hates Real Madrid as arch-enemy
+5. MUSIC THAT WE SHARE:
+- Pink Floyd on long drives, Comfortably Numb above all
+A SAMPLE TEXTING SESSION BETWEEN US:
+A: hiii
+B: heyy how was work
+A: long, tell me about your day
+"""
+
+CASES_PATH = os.path.join(os.path.dirname(__file__), os.pardir, "bench", "recall_cases.json")
+
+
+def load_cases():
+    with open(CASES_PATH, encoding="utf-8") as f:
+        return [(case["query"], snippet) for case in json.load(f) for snippet in case["expect"]]
+
+
+@pytest.fixture(scope="module")
+def default_index():
+    knowledge_base, _template = read_persona(os.path.join(PERSONAS_DIR, DEFAULT_PERSONA))
+    return KnowledgeIndex.from_text(knowledge_base, mode="bm25")
+
+
+def test_core_sections_stay_out_of_the_index():
+    core_text, chunks = split_knowledge_base(KNOWLEDGE_BASE)
+    assert "warm, playful" in core_text and "lots of emojis" in core_text
+    assert not [chunk for chunk in chunks if "emojis" in chunk.text or "playful" in chunk.text]
+
+
+def test_facts_and_sample_chat_chunks():
+    _core_text, chunks = split_knowledge_base(KNOWLEDGE_BASE)
+    football = [chunk for chunk in chunks if chunk.section == "4. FOOTBALL AND FAVOURITE CLUBS"]
+    assert [chunk.kind for chunk in football] == ["fact"] * 3
+
+    # A sample chat is only useful as a whole
+    (chat,) = [chunk for chunk in chunks if chunk.kind == "section"]
+    assert chat.text.splitlines() == ["A: hiii", "B: heyy how was work", "A: long, tell me about your day"]
+
+
+@pytest.mark.parametrize("mode", ["bm25", "hybrid"])
+def test_football_message_retrieves_football_facts(mode):
+    index = KnowledgeIndex.from_text(KNOWLEDGE_BASE, mode=mode)
+    texts = [chunk.text for chunk in index.select("messi scored again for fcb")]
+    assert any("Messi" in text for text in texts)
+    assert not any("Pink Floyd" in text for text in texts)
+
+
+def test_select_respects_k_and_the_token_budget():
+    index = KnowledgeIndex.from_text(KNOWLEDGE_BASE)
+    query = "fcb messi real madrid football"
+    assert len(index.select(query, k=1)) == 1
+
+    everything = index.select(query, token_budget=10_000)
+    budget = sum(chunk.tokens for chunk in everything) - 1
+    assert sum(chunk.tokens for chunk in index.select(query, token_budget=budget)) <= budget
+
+    # Knowledge-base order, grouped under the section title
+    assert [chunk.chunk_id for chunk in everything] == sorted(chunk.chunk_id for chunk in everything)
+    assert render_chunks(everything).startswith("4. FOOTBALL AND FAVOURITE CLUBS:\n- ")
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        KnowledgeIndex([], mode="grep")
+
+
+@pytest.mark.parametrize("query, snippet", load_cases())
+def test_default_persona_recall(default_index, query, snippet):
+    texts = [chunk.text for chunk in default_index.select(query)]
+    assert any(snippet in text for text in texts)
+
+
+def test_greeting_sends_far_less_than_the_whole_knowledge_base(default_index):
+    everything = sum(chunk.tokens for chunk in default_index.chunks)
+    sent = sum(chunk.tokens for chunk in default_index.select("hi"))
+    assert sent <= KNOWLEDGE_TOKEN_BUDGET < everything
@@ -0,0 +1,257 @@
+"""
+tests/test_llm_client.py
+
+llm_client.py against a scripted fake backend: circuit breaker (and its
+half-open probe), retries, fallback and hedging.
+"""
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from llm_backends import _status_error
+from llm_client import CircuitBreaker, CircuitOpenError, LLMUnavailableError, ResilientClient
+
+
+PRIMARY = "primary"
+FALLBACK = "fallback"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScriptedBackend:
+    """
+    Answers each model from its script: an int is an HTTP error status,
+    a float a delay (seconds) before answering, (delay, status) a slow
+    error, anything else the reply. An empty script answers "ok".
+    """
+
+    def __init__(self, **scripts):
+        self.scripts = {model: list(steps) for model, steps in scripts.items()}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _next(self, model):
+        with self._lock:
+            self.calls.append(model)
+            script = self.scripts.get(model) or []
+            return script.pop(0) if script else "ok"
+
+    def complete(self, model, messages, timeout, **request):
+        step = self._next(model)
+        if isinstance(step, tuple):
+            time.sleep(step[0])
+            raise _status_error(step[1])
+        if isinstance(step, float):
+            time.sleep(step)
+            return f"{model} after {step}"
+        if isinstance(step, int):
+            raise _status_error(step)
+        return step
+
+    async def acomplete(self, model, messages, timeout, **request):
+        step = self._next(model)
+        if isinstance(step, tuple):
+            await asyncio.sleep(step[0])
+            raise _status_error(step[1])
+        if isinstance(step, float):
+            await asyncio.sleep(step)
+            return f"{model} after {step}"
+        if isinstance(step, int):
+            raise _status_error(step)
+        return step
+
+
+def make_client(backend, fallback_model="", **options):
+    settings = {
+        "deadline": 5.0,
+        "attempt_timeout": 5.0,
+        "max_retries": 0,
+        "backoff_base": 0.0,
+        "backoff_cap": 0.0,
+        "hedge_after": None,
+        "breaker_threshold": 2,
+        "breaker_reset": 30.0,
+        **options,
+    }
+    return ResilientClient(backend, PRIMARY, fallback_model=fallback_model, **settings)
+
+
+def half_open(client, model=PRIMARY):
+    """
+    Trips `model`'s breaker and moves its clock past the reset timeout.
+    """
+    breaker = client.breakers[model]
+    clock = FakeClock()
+    breaker._clock = clock
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == "open"
+    clock.now += breaker.reset_timeout
+    assert breaker.state == "half-open"
+    return breaker
+
+
+# -------------------------
+# Circuit breaker
+# -------------------------
+
+def test_breaker_opens_after_threshold_and_fails_fast():
+    backend = ScriptedBackend(primary=[500, 500])
+    client = make_client(backend)
+    for _ in range(2):
+        with pytest.raises(LLMUnavailableError):
+            client.create([])
+    assert client.breakers[PRIMARY].state == "open"
+
+    with pytest.raises(CircuitOpenError):
+        client.create([])
+    assert len(backend.calls) == 2
+    assert client.stats()["breaker_rejections"] == 1
+
+
+def test_half_open_probe_success_closes():
+    client = make_client(ScriptedBackend())
+    breaker = half_open(client)
+    assert client.create([]) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe_failure_reopens():
+    client = make_client(ScriptedBackend(primary=[500]))
+    breaker = half_open(client)
+    with pytest.raises(LLMUnavailableError):
+        client.create([])
+    assert breaker.state == "open"
+
+
+def test_half_open_only_one_probe_at_a_time():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=1.0, clock=FakeClock())
+    breaker.record_failure()
+    breaker._clock.now += 1.0
+    assert breaker.allow()
+    assert not breaker.allow()
+
+
+def test_half_open_probe_non_retryable_error_is_handed_back():
+    client = make_client(ScriptedBackend(primary=[400]))
+    breaker = half_open(client)
+    with pytest.raises(LLMUnavailableError):
+        client.create([])
+
+    # Not wedged: the next call is the probe, and closes the breaker
+    assert breaker.state == "half-open"
+    assert client.create([]) == "ok"
+    assert breaker.state == "closed"
+
+
+def test_half_open_probe_out_of_deadline_is_handed_back():
+    # The primary uses up the whole deadline; the fallback's probe then
+    # has no time left and never calls the backend
+    backend = ScriptedBackend(primary=[(0.1, 504)])
+    client = make_client(backend, fallback_model=FALLBACK, deadline=0.05, attempt_timeout=0.05)
+    breaker = half_open(client, FALLBACK)
+
+    with pytest.raises(LLMUnavailableError):
+        client.create([])
+    assert FALLBACK not in backend.calls
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+
+
+def test_cancelled_probe_is_handed_back():
+    client = make_client(ScriptedBackend(primary=[10.0]))
+    breaker = half_open(client)
+
+    async def cancel_probe():
+        task = asyncio.ensure_future(client.acreate([]))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+
+
+# -------------------------
+# Retries and fallback
+# -------------------------
+
+def test_retries_up_to_the_budget():
+    backend = ScriptedBackend(primary=[500, 503, 429])
+    client = make_client(backend, max_retries=2, breaker_threshold=10)
+    with pytest.raises(LLMUnavailableError):
+        client.create([])
+    assert backend.calls == [PRIMARY] * 3
+    assert client.stats()["retries"] == 2
+    assert client.stats()["failures"] == 1
+
+
+def test_retry_succeeds():
+    backend = ScriptedBackend(primary=[500, "second try"])
+    client = make_client(backend, max_retries=2, breaker_threshold=10)
+    assert client.create([]) == "second try"
+    assert client.stats()["retries"] == 1
+
+
+def test_non_retryable_error_is_not_retried_nor_sent_to_the_fallback():
+    backend = ScriptedBackend(primary=[400])
+    client = make_client(backend, fallback_model=FALLBACK, max_retries=2)
+    with pytest.raises(LLMUnavailableError):
+        client.create([])
+    assert backend.calls == [PRIMARY]
+
+
+def test_fallback_model_answers_when_primary_fails():
+    backend = ScriptedBackend(primary=[500, 500], fallback=["from fallback", "again"])
+    client = make_client(backend, fallback_model=FALLBACK)
+    assert client.create([]) == "from fallback"
+    assert client.stats()["fallbacks"] == 1
+
+    # Second failure opens the primary's breaker: the next call skips it
+    assert client.create([]) == "again"
+    assert client.create([]) == "ok"
+    assert backend.calls == [PRIMARY, FALLBACK, PRIMARY, FALLBACK, FALLBACK]
+    assert client.stats()["breaker_rejections"] == 1
+
+
+def test_async_fallback():
+    backend = ScriptedBackend(primary=[500], fallback=["from fallback"])
+    client = make_client(backend, fallback_model=FALLBACK)
+    assert asyncio.run(client.acreate([])) == "from fallback"
+
+
+# -------------------------
+# Hedging
+# -------------------------
+
+def test_slow_call_is_hedged():
+    backend = ScriptedBackend(primary=[0.5], fallback=["hedge"])
+    client = make_client(backend, fallback_model=FALLBACK, hedge_after=0.02)
+    assert client.create([]) == "hedge"
+    assert client.stats()["hedges"] == 1
+
+
+def test_fast_call_is_not_hedged():
+    backend = ScriptedBackend(primary=["fast"])
+    client = make_client(backend, fallback_model=FALLBACK, hedge_after=0.5)
+    assert client.create([]) == "fast"
+    assert client.stats()["hedges"] == 0
+    assert backend.calls == [PRIMARY]
+
+
+def test_async_slow_call_is_hedged():
+    backend = ScriptedBackend(primary=[0.5], fallback=["hedge"])
+    client = make_client(backend, fallback_model=FALLBACK, hedge_after=0.02)
+    assert asyncio.run(client.acreate([])) == "hedge"
+    assert client.stats()["hedges"] == 1
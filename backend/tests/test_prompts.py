@@ -0,0 +1,27 @@
+"""
+tests/test_prompts.py
+
+prompts.py: pruning the compiled-bundle cache.
+"""
+
+import os
+
+import pytest
+
+from prompts import _prune
+
+
+def _bundles(directory, count):
+    for i in range(count):
+        path = directory / f"v{i}.pickle"
+        path.write_bytes(b"")
+        os.utime(path, (1000 + i, 1000 + i))
+
+
+@pytest.mark.parametrize("keep, left", [(0, []), (2, ["v3.pickle", "v4.pickle"]), (10, [f"v{i}.pickle" for i in range(5)])])
+def test_prune_keeps_the_most_recent(tmp_path, keep, left):
+    _bundles(tmp_path, 5)
+    (tmp_path / "notes.txt").write_text("not a bundle")
+    _prune(str(tmp_path), keep)
+    assert sorted(p.name for p in tmp_path.glob("*.pickle")) == left
+    assert (tmp_path / "notes.txt").exists()
@@ -0,0 +1,66 @@
+"""
+tests/test_reply_cache.py
+
+reply_cache.py keys and pools, and llm.py only using the cache for the
+first message of a session.
+"""
+
+import uuid
+
+import pytest
+
+import llm
+from reply_cache import MemoryReplyCache, make_key
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    # One variant: the stub always gives the same reply to the same message
+    cache = MemoryReplyCache(variants=1)
+    monkeypatch.setattr(llm, "reply_cache", cache)
+    return cache
+
+
+def new_session():
+    return f"rc-{uuid.uuid4().hex}"
+
+
+def test_key_normalizes_the_message():
+    assert make_key("Heyyy love!! 💗", "v1") == make_key("hey love", "v1") == "v1|hey love"
+    assert make_key("hey love", "v2") != make_key("hey love", "v1")
+
+
+def test_long_or_empty_messages_are_not_cached():
+    assert make_key("this message has far too many words", "v1") is None
+    assert make_key("!!! 💗", "v1") is None
+
+
+def test_pool_fills_then_rotates():
+    cache = MemoryReplyCache(variants=2)
+    assert cache.get("k") is None
+    cache.put("k", "one")
+    assert cache.get("k") is None
+    cache.put("k", "two")
+    assert [cache.get("k") for _ in range(3)] == ["one", "two", "one"]
+    assert cache.stats.as_dict()["hits"] == 3
+
+
+def test_first_message_misses_then_hits(cache):
+    first, _ = llm.process_user_message("hi", new_session())
+    assert cache.stats.as_dict()["misses"] == 1
+
+    again, _ = llm.process_user_message("hi", new_session())
+    assert again == first
+    assert cache.stats.as_dict()["hits"] == 1
+
+
+def test_later_turns_never_use_the_cache(cache):
+    llm.process_user_message("hi", new_session())
+
+    session_id = new_session()
+    llm.process_user_message("how are you", session_id)
+    before = cache.stats.as_dict()
+    llm.process_user_message("hi", session_id)
+
+    # No lookup at all for a session that already has history
+    assert cache.stats.as_dict() == before
@@ -0,0 +1,54 @@
+"""
+tests/test_reveal_photo.py
+
+reveal_photo.py builds: --out outside STATIC_DIR is refused, and a format
+the encoder fails on halfway leaves no files behind.
+"""
+
+import os
+
+import pytest
+
+import reveal_photo
+
+
+def test_out_dir_outside_static_dir_is_refused(tmp_path, monkeypatch):
+    static_dir = tmp_path / "static"
+    static_dir.mkdir()
+    monkeypatch.setattr(reveal_photo, "STATIC_DIR", str(static_dir))
+
+    elsewhere = tmp_path / "elsewhere"
+    with pytest.raises(ValueError):
+        reveal_photo.build_reveal_photo("photo.jpg", str(elsewhere))
+    assert not elsewhere.exists()
+
+
+def test_format_failing_halfway_writes_nothing(tmp_path, monkeypatch):
+    Image = pytest.importorskip("PIL.Image")
+
+    monkeypatch.setattr(reveal_photo, "STATIC_DIR", str(tmp_path))
+    source = tmp_path / "photo.png"
+    Image.new("RGB", (1200, 900), "pink").save(source)
+
+    encode = reveal_photo._encode
+    webp_calls = []
+
+    def flaky_encode(image, pillow_format, options):
+        # AVIF is never available here; WebP fails on its second width
+        if pillow_format == "AVIF":
+            raise KeyError(pillow_format)
+        if pillow_format == "WEBP":
+            webp_calls.append(image.width)
+            if len(webp_calls) > 1:
+                raise OSError("encoder crashed")
+        return encode(image, pillow_format, options)
+
+    monkeypatch.setattr(reveal_photo, "_encode", flaky_encode)
+    out_dir = tmp_path / "persona"
+    manifest = reveal_photo.build_reveal_photo(str(source), str(out_dir), widths=(480, 768))
+
+    written = os.listdir(out_dir)
+    assert not [name for name in written if name.endswith(".webp")]
+    assert len([name for name in written if name.endswith(".jpg")]) == 2
+    assert [entry["type"] for entry in manifest["sources"]] == ["image/jpeg"]
+    assert manifest["src"].startswith("/static/persona/")
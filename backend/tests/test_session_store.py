@@ -0,0 +1,55 @@
+"""
+tests/test_session_store.py
+
+session_store.py memory backend: restored sessions take their place in
+the least → most recently seen order. Plus which session ids are valid.
+"""
+
+from session_store import MemorySessionBackend, is_valid_session_id
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_restore_keeps_oldest_first():
+    clock = FakeClock()
+    store = MemorySessionBackend(max_sessions=10, ttl_seconds=100, clock=clock)
+    store.advance_stage("live")
+    assert store.restore("recent", 2, age_seconds=10)
+    assert store.restore("stale", 3, age_seconds=90)
+    assert store.restore("middle", 1, age_seconds=50)
+    assert list(store._records) == ["stale", "middle", "recent", "live"]
+
+
+def test_stale_restored_session_expires_first():
+    clock = FakeClock()
+    store = MemorySessionBackend(max_sessions=10, ttl_seconds=100, clock=clock)
+    store.restore("recent", 2, age_seconds=10)
+    store.restore("stale", 3, age_seconds=90)
+
+    # "stale" is past its TTL now: the next write sweeps it from the front
+    clock.now += 20
+    store.advance_stage("new")
+    assert store.get_stage("recent") == 2
+    assert "stale" not in store._records
+
+
+def test_lru_drops_the_least_recently_seen_restored_session():
+    clock = FakeClock()
+    store = MemorySessionBackend(max_sessions=2, ttl_seconds=100, clock=clock)
+    store.restore("recent", 2, age_seconds=10)
+    store.restore("stale", 3, age_seconds=90)
+    store.advance_stage("new")
+    assert store.get_stage("recent") == 2
+    assert store.get_stage("stale") == 0
+
+
+def test_session_ids_cannot_contain_the_persona_separator():
+    assert is_valid_session_id("abc123")
+    assert not is_valid_session_id("bob:abc123")
+    assert not is_valid_session_id(":")
@@ -0,0 +1,126 @@
+"""
+tests/test_single_flight.py
+
+single_flight.py (leaders, followers, eviction of stale flights) and the
+streaming entry points in llm.py handing back flights whose stream was
+never read.
+"""
+
+import asyncio
+import uuid
+
+import pytest
+
+import llm
+from single_flight import SingleFlight
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fresh_message():
+    # Unique text: never served from the reply cache, so a real stream
+    return f"hello there {uuid.uuid4().hex}"
+
+
+@pytest.fixture
+def in_flight(monkeypatch):
+    # Short waits, so a regression fails fast instead of hanging for 20 s
+    flights = SingleFlight(wait_seconds=0.5)
+    monkeypatch.setattr(llm, "in_flight", flights)
+    return flights
+
+
+# -------------------------
+# SingleFlight
+# -------------------------
+
+def test_follower_gets_the_leader_result():
+    flights = SingleFlight(wait_seconds=1.0)
+    future, leader = flights.join("k")
+    follower_future, follower = flights.join("k")
+    assert leader and not follower
+    flights.finish("k", future, ("reply", False))
+    assert flights.wait(follower_future) == ("reply", False)
+    assert len(flights) == 0
+
+
+def test_stale_flight_is_evicted():
+    clock = FakeClock()
+    flights = SingleFlight(wait_seconds=1.0, max_age=60.0, clock=clock)
+    stale, _ = flights.join("k")
+
+    clock.now += 61.0
+    future, leader = flights.join("k")
+    assert leader and future is not stale
+    assert flights.stats()["evicted"] == 1
+
+    # The lost leader finishing late does not end the new flight
+    flights.finish("k", stale, ("late", False))
+    assert len(flights) == 1
+
+
+# -------------------------
+# Streams that are never read
+# -------------------------
+
+@pytest.mark.parametrize("drop", ["close", "del"])
+def test_unstarted_stream_does_not_hold_the_flight(in_flight, drop):
+    message, session_id = fresh_message(), f"sf-{uuid.uuid4().hex}"
+    pieces, _ = llm.process_user_message_stream(message, session_id)
+    assert len(in_flight) == 1
+
+    if drop == "close":
+        pieces.close()
+    del pieces
+    assert len(in_flight) == 0
+
+    # The same message again leads a turn of its own: no fallback reply
+    pieces, _ = llm.process_user_message_stream(message, session_id)
+    assert "".join(pieces) != llm.FALLBACK_REPLY
+    assert in_flight.stats()["timeouts"] == 0
+
+
+def test_follower_of_a_dropped_stream_is_released(in_flight):
+    message, session_id = fresh_message(), f"sf-{uuid.uuid4().hex}"
+    pieces, _ = llm.process_user_message_stream(message, session_id)
+    flight = llm._Flight(message, llm.persona_registry.default().session_key(session_id), None)
+    assert not flight.leader
+
+    pieces.close()
+    assert flight.follow() == (llm.FALLBACK_REPLY, False)
+    assert in_flight.stats()["timeouts"] == 0
+
+
+def test_unstarted_async_stream_does_not_hold_the_flight(in_flight):
+    message, session_id = fresh_message(), f"sf-{uuid.uuid4().hex}"
+
+    async def run():
+        pieces, _ = await llm.process_user_message_stream_async(message, session_id)
+        assert len(in_flight) == 1
+        await pieces.aclose()
+        assert len(in_flight) == 0
+
+        pieces, _ = await llm.process_user_message_stream_async(message, session_id)
+        return "".join([text async for text in pieces])
+
+    assert asyncio.run(run()) != llm.FALLBACK_REPLY
+    assert in_flight.stats()["timeouts"] == 0
+
+
+def test_chat_stream_that_fails_before_streaming_releases_the_flight(in_flight, monkeypatch):
+    import app
+
+    def broken_preload(session_id, persona):
+        raise RuntimeError("preload failed")
+
+    monkeypatch.setattr(app, "reveal_preload", broken_preload)
+    client = app.app.test_client()
+    payload = {"message": fresh_message(), "session_id": f"sf-{uuid.uuid4().hex}"}
+    assert client.post("/chat/stream", json=payload).status_code == 500
+    assert len(in_flight) == 0
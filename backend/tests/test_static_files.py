@@ -0,0 +1,19 @@
+"""
+tests/test_static_files.py
+
+static_files.py: which files are cached as immutable.
+"""
+
+import pytest
+
+from static_files import _FINGERPRINT_RE
+
+
+@pytest.mark.parametrize("name", ["app.3f9a1c2b7d.js", "final_photo.768.3f9a1c2b7d.webp"])
+def test_fingerprinted_names(name):
+    assert _FINGERPRINT_RE.search(name)
+
+
+@pytest.mark.parametrize("name", ["final_photo.jpg", "app.3f9a1c2b.js", "app.3f9a1c2b7d00.js", "logo.deadbeefcafe.png"])
+def test_other_names(name):
+    assert not _FINGERPRINT_RE.search(name)
@@ -0,0 +1,70 @@
+"""
+tokens.py
+
+Fast, dependency-free token counting for ArtyBot.
+
+What this file does:
+- Estimates how many LLM tokens a piece of text will cost
+- Used for logging prompt size and for enforcing the per-component
+  token budgets in llm.py (persona, knowledge, history, user message)
+
+Important:
+- This is an ESTIMATE, not the real Llama tokenizer
+- It is tuned to slightly over-count, so budgets stay on the safe side
+- It runs in microseconds, so it is fine to call on the request path
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import re
+
+
+# Words, numbers, and single punctuation / emoji characters
+_PIECE_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+# BPE tokenizers split long words into several pieces.
+# Roughly one extra token per this many letters beyond the first chunk.
+_LETTERS_PER_TOKEN = 6
+
+
+def _piece_tokens(piece):
+    if piece.isascii():
+        return 1 + (len(piece) - 1) // _LETTERS_PER_TOKEN
+    return (len(piece.encode("utf-8")) + 1) // 2
+
+
+def estimate_tokens(text):
+    """
+    Returns an approximate token count for `text`.
+
+    Heuristic:
+    - every word, number chunk or symbol counts as one token
+    - long words cost one extra token per ~6 letters
+    - non-ASCII symbols (emoji, Bengali, fancy quotes) cost one token per
+      UTF-8 byte pair, because byte-level BPE splits them up
+    """
+    if not text:
+        return 0
+
+    count = 0
+    for piece in _PIECE_RE.findall(text):
+        count += _piece_tokens(piece)
+    return count
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Returns the longest prefix of `text` estimated at <= `max_tokens`,
+    cut after a whole word / symbol (same estimate as estimate_tokens).
+    """
+    # Every character costs at most 2 tokens, so short texts always fit
+    if not text or len(text) * 2 <= max_tokens or estimate_tokens(text) <= max_tokens:
+        return text
+
+    count = 0
+    for match in _PIECE_RE.finditer(text):
+        count += _piece_tokens(match.group())
+        if count > max_tokens:
+            return text[:match.start()].rstrip()
+    return text
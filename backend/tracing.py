@@ -0,0 +1,361 @@
+"""
+tracing.py
+
+Sampled per-request traces for ArtyBot, written to rotating JSONL files.
+
+What this file does:
+- For a sampled fraction of requests, records spans: request parse,
+  prompt build, LLM call (with time-to-first-token when streaming) and
+  response encode
+- Hands finished traces to a background writer thread through a bounded
+  queue, so the request thread never touches the disk
+- Rotates the files by size; each worker process writes its own file
+- Run as a script, summarizes the slowest traces and where their time went
+
+Settings (environment variables):
+- TRACE_SAMPLE_RATE  → fraction of requests traced (0 = off, 1 = all)
+- TRACE_DIR          → where trace-<pid>.jsonl files are written
+- TRACE_MAX_BYTES    → rotate a file once it is this big
+- TRACE_BACKUPS      → rotated files kept per worker (.1, .2, ...)
+- TRACE_QUEUE_SIZE   → traces waiting to be written; more are dropped
+
+Usage of the report (from backend/):
+
+    python tracing.py [--top 10] [--route /chat] [--dir traces]
+
+Important:
+- The current trace lives in a contextvar, so it follows the request
+  through threads (gthread) and asyncio tasks (asgi.py) alike
+- When a request is not sampled every call here is a contextvar lookup
+- Message text is never written, only timings and the turn's stage
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import contextvars
+import functools
+import glob
+import inspect
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+
+
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.05"))
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", "3"))
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "10000"))
+
+
+# -------------------------
+# Traces and spans
+# -------------------------
+
+class Span:
+    __slots__ = ("trace", "name", "attrs", "started")
+
+    def __init__(self, trace, name, attrs):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+        self.started = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        ended = time.perf_counter()
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.spans.append({
+            "name": self.name,
+            "start_ms": round((self.started - self.trace.started) * 1000, 3),
+            "duration_ms": round((ended - self.started) * 1000, 3),
+            **self.attrs,
+        })
+        return False
+
+
+class _NoSpan:
+    """
+    Returned by span() when the request is not sampled: does nothing.
+    """
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class Trace:
+    __slots__ = ("trace_id", "route", "timestamp", "started", "attrs", "spans")
+
+    def __init__(self, route):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.route = route
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.attrs = {}
+        self.spans = []
+
+    def as_dict(self, ended):
+        return {
+            "trace_id": self.trace_id,
+            "route": self.route,
+            "timestamp": round(self.timestamp, 3),
+            "duration_ms": round((ended - self.started) * 1000, 3),
+            "pid": os.getpid(),
+            **self.attrs,
+            "spans": self.spans,
+        }
+
+
+_current = contextvars.ContextVar("artybot_trace", default=None)
+
+
+def start(route, sample_rate=None):
+    """
+    Starts a trace for this request if it is sampled, and makes it current.
+    Returns the Trace, or None.
+    """
+    rate = TRACE_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate <= 0 or random.random() >= rate:
+        _current.set(None)
+        return None
+
+    trace = Trace(route)
+    _current.set(trace)
+    return trace
+
+
+def use(trace):
+    """
+    Makes `trace` current again, e.g. inside a streaming response generator
+    that runs after the view function has returned.
+    """
+    _current.set(trace)
+
+
+def traced(route):
+    """
+    Decorator for a view (sync or async): traces the whole call, if sampled.
+    """
+    def decorate(fn):
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                trace = start(route)
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    finish(trace)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = start(route)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                finish(trace)
+        return wrapper
+
+    return decorate
+
+
+def span(name, **attrs):
+    """
+    `with tracing.span("build_prompt"): ...`
+    """
+    trace = _current.get()
+    if trace is None:
+        return NO_SPAN
+    return Span(trace, name, attrs)
+
+
+def annotate(**attrs):
+    """
+    Adds attributes to the whole trace (stage, is_final, source...).
+    """
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def finish(trace):
+    """
+    Ends the trace and queues it for the writer. Never blocks.
+    """
+    _current.set(None)
+    if trace is not None:
+        writer.submit(trace.as_dict(time.perf_counter()))
+
+
+# -------------------------
+# Background writer
+# -------------------------
+
+class TraceWriter:
+    """
+    One daemon thread per process, appending JSON lines to
+    <directory>/trace-<pid>.jsonl and rotating it by size.
+
+    The thread is started on first use and restarted after a fork, so
+    gunicorn workers each get their own thread and file.
+    """
+
+    def __init__(self, directory=TRACE_DIR, max_bytes=TRACE_MAX_BYTES, backups=TRACE_BACKUPS, queue_size=TRACE_QUEUE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.written = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            thread = threading.Thread(target=self._run, args=(self._queue,), name="trace-writer", daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, record):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+    def path(self):
+        return os.path.join(self.directory, f"trace-{os.getpid()}.jsonl")
+
+    def _rotate(self, path):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}"):
+                os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+    def _run(self, pending):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path()
+        f = open(path, "a", encoding="utf-8")
+
+        while True:
+            # Write everything that is waiting in one go
+            lines = [pending.get()]
+            while len(lines) < 256:
+                try:
+                    lines.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+
+            f.write("".join(json.dumps(line, ensure_ascii=False) + "\n" for line in lines))
+            f.flush()
+            self.written += len(lines)
+
+            if f.tell() >= self.max_bytes:
+                f.close()
+                self._rotate(path)
+                f = open(path, "a", encoding="utf-8")
+
+
+writer = TraceWriter()
+
+
+# -------------------------
+# Report: the slowest traces
+# -------------------------
+
+def read_traces(directory):
+    for path in sorted(glob.glob(os.path.join(directory, "trace-*.jsonl*"))):
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue   # a line cut short by a crash
+
+
+def summarize(traces, top):
+    """
+    Prints the `top` slowest traces with a per-span breakdown, then the
+    average share of time per span over those traces.
+    """
+    slowest = sorted(traces, key=lambda t: t["duration_ms"], reverse=True)[:top]
+    if not slowest:
+        print("no traces found")
+        return
+
+    share = {}
+    for trace in slowest:
+        total = trace["duration_ms"] or 1
+        extras = {k: v for k, v in trace.items() if k not in ("trace_id", "route", "timestamp", "duration_ms", "pid", "spans")}
+        stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(trace["timestamp"]))
+        print(f"{trace['duration_ms']:9.1f} ms  {trace['route']:13} {stamp}  {trace['trace_id']}  {extras}")
+
+        for item in trace["spans"]:
+            details = {k: v for k, v in item.items() if k not in ("name", "start_ms", "duration_ms")}
+            print(
+                f"    {item['name']:14} +{item['start_ms']:9.1f} ms  {item['duration_ms']:9.1f} ms "
+                f"({item['duration_ms'] / total:5.1%})  {details or ''}"
+            )
+            share[item["name"]] = share.get(item["name"], 0.0) + item["duration_ms"] / total
+
+    print(f"\naverage share of time over these {len(slowest)} traces:")
+    for name, value in sorted(share.items(), key=lambda item: item[1], reverse=True):
+        print(f"    {name:14} {value / len(slowest):6.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize the slowest ArtyBot traces.")
+    parser.add_argument("--dir", default=TRACE_DIR)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--route", help="only traces for this route, e.g. /chat/stream")
+    args = parser.parse_args()
+
+    traces = [t for t in read_traces(args.dir) if not args.route or t["route"] == args.route]
+    print(f"{len(traces)} traces in {args.dir}\n")
+    summarize(traces, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,517 @@
+"""
+transcripts.py
+
+An append-only record of every conversation turn.
+
+Why:
+- Nothing was recorded: a bad reply could not be looked at afterwards,
+  and a restart (every deploy, every Render cold start) forgot which
+  stage every session was at
+- Writing to disk inside chat() would add a commit to every reply
+
+What this file does:
+- One row per turn: session id, stage, source (llm / ritual / cache /
+  fallback), prompt version + a hash of the exact prompt, the message,
+  the reply, token usage and latency
+- record() only puts the row on a bounded queue. A background thread
+  per process writes whatever is waiting in one batch (one transaction,
+  or one append). When the queue is full the row is dropped and counted,
+  the request never waits
+- recent() hands startup.py the latest turns of every recent session,
+  so llm.restore_sessions() can put their stage (and last exchanges)
+  back after a restart
+- Run as a script, prints one session's transcript
+
+Backends (TRANSCRIPT_BACKEND):
+- "sqlite" → a local SQLite file in WAL mode shared by all gunicorn
+             workers, indexed by session (default)
+- "jsonl"  → rotating JSON lines files, one per worker process, for
+             shipping to a log pipeline. Lookups scan the files
+- "off"    → nothing is recorded or restored
+
+Usage (from backend/):
+
+    python transcripts.py SESSION_ID [--limit 20]
+
+Important:
+- Message and reply text IS stored (unlike traces): keep the file private
+- Rows older than TRANSCRIPT_RETENTION_SECONDS are deleted (sqlite) or
+  rotated away (jsonl)
+- Rows still queued when a worker is killed are lost; gunicorn.conf.py
+  flushes the queue when a worker exits normally
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import glob
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+
+# -------------------------
+# Configuration
+# -------------------------
+
+TRANSCRIPT_BACKEND = os.getenv("TRANSCRIPT_BACKEND", "sqlite")
+TRANSCRIPT_DB_PATH = os.getenv("TRANSCRIPT_DB_PATH", "artybot_transcripts.db")
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", "transcripts")
+TRANSCRIPT_MAX_BYTES = int(os.getenv("TRANSCRIPT_MAX_BYTES", str(50 * 1024 * 1024)))
+TRANSCRIPT_BACKUPS = int(os.getenv("TRANSCRIPT_BACKUPS", "5"))
+TRANSCRIPT_RETENTION_SECONDS = float(os.getenv("TRANSCRIPT_RETENTION_SECONDS", str(30 * 24 * 3600)))
+
+# Rows waiting for the writer; more are dropped
+TRANSCRIPT_QUEUE_SIZE = int(os.getenv("TRANSCRIPT_QUEUE_SIZE", "10000"))
+
+# At most this many rows per write, gathered for at most this long
+TRANSCRIPT_BATCH_SIZE = int(os.getenv("TRANSCRIPT_BATCH_SIZE", "256"))
+TRANSCRIPT_LINGER_SECONDS = float(os.getenv("TRANSCRIPT_LINGER_SECONDS", "0.2"))
+
+# Put sessions back from the transcripts at startup, with this many of
+# their last exchanges (see llm.restore_sessions)
+TRANSCRIPT_RESTORE = os.getenv("TRANSCRIPT_RESTORE", "1") != "0"
+TRANSCRIPT_RESTORE_TURNS = int(os.getenv("TRANSCRIPT_RESTORE_TURNS", "3"))
+
+# Columns, in order
+FIELDS = (
+    "ts",
+    "session_id",
+    "stage",
+    "is_final",
+    "source",
+    "prompt_version",
+    "prompt_hash",
+    "user_message",
+    "reply",
+    "prompt_tokens",
+    "completion_tokens",
+    "latency_ms",
+)
+
+
+def prompt_hash(messages):
+    """
+    Short hash of the exact chat messages sent to the LLM (None without
+    a prompt: rituals and cache hits).
+    """
+    if not messages:
+        return None
+    encoded = json.dumps(messages, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()[:16]
+
+
+def _row(record):
+    """
+    What llm.py queued → a stored row. Runs on the writer thread, so the
+    prompt is hashed off the request path.
+    """
+    row = {field: record.get(field) for field in FIELDS}
+    row["prompt_hash"] = prompt_hash(record.get("messages"))
+    row["is_final"] = bool(row["is_final"])
+    return row
+
+
+# -------------------------
+# SQLite backend
+# -------------------------
+
+class SQLiteTranscriptStore:
+    """
+    Transcripts in a local SQLite file (WAL), one row per turn.
+
+    - (session_id, id) index: one session's turns, in order, without a scan
+    - ts index: recent sessions (restore) and retention
+    - one transaction per batch, so a busy minute is a handful of commits
+    """
+
+    enabled = True
+
+    def __init__(self, path=TRANSCRIPT_DB_PATH, retention_seconds=TRANSCRIPT_RETENTION_SECONDS, prune_every=256, clock=time.time):
+        self.path = path
+        self.retention_seconds = retention_seconds
+        self.prune_every = prune_every
+        self._clock = clock
+        self._local = threading.local()
+        self._writes = 0
+
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS transcripts (
+                id                INTEGER PRIMARY KEY,
+                ts                REAL    NOT NULL,
+                session_id        TEXT    NOT NULL,
+                stage             INTEGER NOT NULL,
+                is_final          INTEGER NOT NULL,
+                source            TEXT    NOT NULL,
+                prompt_version    TEXT,
+                prompt_hash       TEXT,
+                user_message      TEXT    NOT NULL,
+                reply             TEXT    NOT NULL,
+                prompt_tokens     INTEGER,
+                completion_tokens INTEGER,
+                latency_ms        REAL
+            )
+            """
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS transcripts_session ON transcripts (session_id, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS transcripts_ts ON transcripts (ts)")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        # A forked worker must not reuse the parent's connection
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM transcripts").fetchone()[0]
+
+    def write(self, rows):
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(
+                f"INSERT INTO transcripts ({', '.join(FIELDS)}) VALUES ({', '.join('?' * len(FIELDS))})",
+                [tuple(row[field] for field in FIELDS) for row in rows],
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def session(self, session_id, limit=50):
+        """
+        The session's last `limit` turns, oldest first.
+        """
+        rows = self._connection().execute(
+            f"SELECT {', '.join(FIELDS)} FROM transcripts WHERE session_id = ? ORDER BY id DESC LIMIT ?",
+            (session_id, limit),
+        ).fetchall()
+        return [dict(row) for row in reversed(rows)]
+
+    def recent(self, since, max_sessions, turns):
+        """
+        [(session_id, last `turns` rows oldest first), ...] for the
+        `max_sessions` sessions active most recently since `since`,
+        least recently active first.
+        """
+        rows = self._connection().execute(
+            f"""
+            SELECT {', '.join(FIELDS)} FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY session_id ORDER BY id DESC) AS newest
+                FROM transcripts WHERE ts >= ?
+            )
+            WHERE newest <= ?
+            ORDER BY id
+            """,
+            (since, turns),
+        ).fetchall()
+        return _group_by_session((dict(row) for row in rows), max_sessions)
+
+    def prune(self, now=None):
+        """
+        Deletes rows older than the retention period.
+        """
+        now = self._clock() if now is None else now
+        self._connection().execute("DELETE FROM transcripts WHERE ts < ?", (now - self.retention_seconds,))
+
+
+# -------------------------
+# JSON lines backend
+# -------------------------
+
+class JSONLTranscriptStore:
+    """
+    <directory>/transcript-<pid>.jsonl, rotated by size like tracing.py's
+    trace files. Only the writer thread appends, so one file per process
+    needs no locking.
+    """
+
+    enabled = True
+
+    def __init__(self, directory=TRANSCRIPT_DIR, max_bytes=TRANSCRIPT_MAX_BYTES, backups=TRANSCRIPT_BACKUPS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self._file = None
+        self._pid = None
+
+    def __len__(self):
+        return sum(1 for _ in self._rows())
+
+    def path(self):
+        return os.path.join(self.directory, f"transcript-{os.getpid()}.jsonl")
+
+    def _rotate(self, path):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{path}.{index}"):
+                os.replace(f"{path}.{index}", f"{path}.{index + 1}")
+        if self.backups > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+    def write(self, rows):
+        if self._file is None or self._pid != os.getpid():
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self.path(), "a", encoding="utf-8")
+            self._pid = os.getpid()
+
+        self._file.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+        self._file.flush()
+
+        if self._file.tell() >= self.max_bytes:
+            self._file.close()
+            self._rotate(self.path())
+            self._file = open(self.path(), "a", encoding="utf-8")
+
+    def _rows(self):
+        for path in glob.glob(os.path.join(self.directory, "transcript-*.jsonl*")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            continue  # cut off by a crash mid-write
+            except OSError:
+                continue  # rotated away while we were reading
+
+    def session(self, session_id, limit=50):
+        rows = sorted((row for row in self._rows() if row.get("session_id") == session_id), key=lambda row: row["ts"])
+        return rows[-limit:]
+
+    def recent(self, since, max_sessions, turns):
+        rows = sorted((row for row in self._rows() if row.get("ts", 0) >= since), key=lambda row: row["ts"])
+        return [(session_id, session_rows[-turns:]) for session_id, session_rows in _group_by_session(rows, max_sessions)]
+
+
+class DisabledTranscriptStore:
+    """
+    TRANSCRIPT_BACKEND=off: records nothing, restores nothing.
+    """
+
+    enabled = False
+
+    def __len__(self):
+        return 0
+
+    def write(self, rows):
+        pass
+
+    def session(self, session_id, limit=50):
+        return []
+
+    def recent(self, since, max_sessions, turns):
+        return []
+
+
+def _group_by_session(rows, max_sessions):
+    """
+    Rows in time order → [(session_id, rows), ...], least recently
+    active session first, keeping the `max_sessions` most recent.
+    """
+    sessions = {}
+    for row in rows:
+        session_id = row["session_id"]
+        # Re-inserting moves the session to the end (most recent)
+        session_rows = sessions.pop(session_id, [])
+        session_rows.append(row)
+        sessions[session_id] = session_rows
+    return list(sessions.items())[-max_sessions:] if max_sessions > 0 else []
+
+
+# -------------------------
+# Background writer
+# -------------------------
+
+class TranscriptLog:
+    """
+    What llm.py uses: record() a finished turn, never waiting for the disk.
+
+    One daemon writer thread per process, started on first use and
+    restarted after a fork (same as tracing.TraceWriter).
+    """
+
+    def __init__(
+        self,
+        store,
+        queue_size=TRANSCRIPT_QUEUE_SIZE,
+        batch_size=TRANSCRIPT_BATCH_SIZE,
+        linger_seconds=TRANSCRIPT_LINGER_SECONDS,
+    ):
+        self.store = store
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.linger_seconds = linger_seconds
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.write_errors = 0
+        self.last_batch_ms = 0.0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._flushing = None
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._flushing = threading.Event()
+            thread = threading.Thread(target=self._run, args=(self._queue,), name="transcript-writer", daemon=True)
+            thread.start()
+            self._pid = os.getpid()
+
+    def record(self, **fields):
+        """
+        Queues one turn (see FIELDS; `messages` is hashed, not stored).
+        Never blocks: a full queue drops the turn.
+        """
+        if not self.store.enabled:
+            return
+        self._ensure_started()
+        fields["ts"] = time.time()
+        try:
+            self._queue.put_nowait(fields)
+        except queue.Full:
+            self.dropped += 1
+
+    def flush(self, timeout=5.0):
+        """
+        Waits (up to `timeout` seconds) until everything queued so far is
+        written. True if it was.
+        """
+        if self._pid != os.getpid():
+            return True
+        # Cuts the writer's linger short
+        self._flushing.set()
+        try:
+            deadline = time.monotonic() + timeout
+            while self._queue.unfinished_tasks:
+                if time.monotonic() >= deadline:
+                    return False
+                time.sleep(0.01)
+            return True
+        finally:
+            self._flushing.clear()
+
+    def session(self, session_id, limit=50):
+        return self.store.session(session_id, limit)
+
+    def recent(self, since, max_sessions, turns):
+        return self.store.recent(since, max_sessions, turns)
+
+    def stats(self):
+        return {
+            "enabled": self.store.enabled,
+            "queued": self._queue.qsize() if self._pid == os.getpid() else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "batches": self.batches,
+            "write_errors": self.write_errors,
+            "last_batch_ms": self.last_batch_ms,
+        }
+
+    def _batch(self, pending):
+        # Block for the first row, then, unless a full batch is already
+        # waiting, let more arrive for linger_seconds. Waiting on an event
+        # only flush() sets (instead of on the queue) means record()
+        # doesn't wake this thread up for every row
+        batch = [pending.get()]
+        if pending.qsize() < self.batch_size - 1:
+            self._flushing.wait(self.linger_seconds)
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(pending.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, pending):
+        while True:
+            batch = self._batch(pending)
+            started = time.perf_counter()
+            try:
+                self.store.write([_row(record) for record in batch])
+                self.written += len(batch)
+                self.batches += 1
+            except Exception as e:
+                # The turns are lost, the writer keeps going
+                print("Transcript write error:", e)
+                self.write_errors += len(batch)
+            finally:
+                self.last_batch_ms = round((time.perf_counter() - started) * 1000, 3)
+                for _ in batch:
+                    pending.task_done()
+
+
+# -------------------------
+# Factory
+# -------------------------
+
+def create_transcript_log(backend=None):
+    """
+    Builds the transcript log selected by TRANSCRIPT_BACKEND.
+    """
+    backend = backend or TRANSCRIPT_BACKEND
+
+    if backend == "sqlite":
+        return TranscriptLog(SQLiteTranscriptStore())
+    if backend == "jsonl":
+        return TranscriptLog(JSONLTranscriptStore())
+    if backend == "off":
+        return TranscriptLog(DisabledTranscriptStore())
+
+    raise ValueError(f"Unknown TRANSCRIPT_BACKEND: {backend!r} (expected 'sqlite', 'jsonl' or 'off')")
+
+
+# -------------------------
+# Report
+# -------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("session_id")
+    parser.add_argument("--limit", type=int, default=20, help="last N turns")
+    args = parser.parse_args()
+
+    log = create_transcript_log()
+    rows = log.session(args.session_id, args.limit)
+    if not rows:
+        print(f"No turns recorded for session {args.session_id!r}")
+        return
+
+    for row in rows:
+        when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row["ts"]))
+        tokens = f"{row['prompt_tokens']}+{row['completion_tokens']} tokens" if row["prompt_tokens"] is not None else "no usage"
+        print(
+            f"{when}  stage {row['stage']}{' (final)' if row['is_final'] else ''}  {row['source']}  "
+            f"{row['latency_ms']:.0f} ms  {tokens}  prompt {row['prompt_version']}/{row['prompt_hash'] or '-'}"
+        )
+        print(f"  Tapas:  {row['user_message']}")
+        print(f"  Artija: {row['reply']}\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+ws_chat.py
+
+The WebSocket chat channel (/ws, /p/<persona>/ws), served by asgi.py
+next to /chat.
+
+Why:
+- Every message was its own cross-origin POST: a CORS preflight, a full
+  set of request / response headers and, on mobile networks that drop
+  idle connections, sometimes a new TLS handshake. One WebSocket per chat
+  session pays for all of that once.
+
+Protocol (JSON text frames):
+
+    client → server
+        {"type": "hello", "session_id": "...", "persona"?}     first frame
+        {"type": "message", "id": "<uuid>", "message": "..."}  one per message
+        {"type": "ping"}                                        heartbeat
+
+    server → client
+        {"type": "ready"}                          after hello
+        {"type": "typing", "id"}                   the reply is being written
+        {"type": "token", "id", "text"}            streamed reply pieces
+        {"type": "done", "id", "is_final": false, "preload"?}
+        {"type": "final", "id", "is_final": true, "photo_url", "note", ...}
+        {"type": "busy", "id", "error", "reason", "retry_after"}   (= 429 / 503)
+        {"type": "error", "id"?, "error"}          bad frame (= 400)
+        {"type": "pong"}
+
+Resume:
+- A message's id is its Idempotency-Key. When the connection drops
+  mid-reply, the frontend reconnects and sends the same message again:
+  the reply is replayed (or joined, if it is still being written)
+  without advancing the stage. If it can't reconnect, it sends the same
+  id as the Idempotency-Key of a POST to /chat.
+- So a reply is generated to the end even after its client is gone: it
+  is what the retry gets back.
+
+Important:
+- Same validation, rate limits and admission control as /chat
+- The persona is the one in the URL (/p/<persona>/ws), else the hello
+  frame's "persona", else the default one; an unknown one is an "error"
+  frame and no "ready"
+- Only asgi:app serves /ws (uvicorn needs the `websockets` package);
+  against app:app the frontend simply stays on POST
+- Connections that send nothing, not even a ping, for
+  WS_IDLE_TIMEOUT_SECONDS are closed
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import asyncio
+import json
+import os
+import time
+
+import metrics
+import tracing
+from admission import AdmissionError, client_ip
+from app import (
+    admission_error_payload,
+    done_payload,
+    rate_limiter,
+    resolve_persona,
+    reveal_preload,
+    validate_chat_payload,
+    validate_idempotency_key,
+)
+from llm import process_user_message_stream_async
+from session_store import DEFAULT_SESSION_ID, is_valid_session_id
+
+
+# The frontend pings every 20 s
+WS_IDLE_TIMEOUT_SECONDS = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "75"))
+
+# Replies being written at once on one connection
+WS_MAX_PENDING_REPLIES = int(os.getenv("WS_MAX_PENDING_REPLIES", "4"))
+
+# Frames bigger than this are rejected (same limit as an HTTP body)
+MAX_FRAME_BYTES = 64 * 1024
+
+# Close codes
+CLOSE_GOING_AWAY = 1001
+CLOSE_POLICY_VIOLATION = 1008
+
+# Compact JSON: a reply is one frame per token
+_SEPARATORS = (",", ":")
+
+_PONG = json.dumps({"type": "pong"}, separators=_SEPARATORS)
+_READY = json.dumps({"type": "ready"}, separators=_SEPARATORS)
+
+# Open connections and messages handled, in this worker
+_stats = {"open": 0, "messages": 0}
+
+
+def stats():
+    return dict(_stats)
+
+
+def final_frame(message_id, persona):
+    """
+    The "final" frame: the persona's prebuilt reveal fields plus type and id.
+    """
+    return f'{{"type":"final","id":{json.dumps(message_id)},{persona.reveal_fields}}}'
+
+
+# -------------------------
+# One connection
+# -------------------------
+
+class ChatConnection:
+    def __init__(self, send, ip, persona_name=None):
+        self._send = send
+        self.ip = ip
+        self.persona_name = persona_name
+        self.persona = None
+        self.session_id = None
+        self.connected = True
+        self.replies = set()
+
+    async def send_text(self, text):
+        """
+        Sends one frame; after a disconnect, quietly does nothing.
+        """
+        if not self.connected:
+            return
+        try:
+            await self._send({"type": "websocket.send", "text": text})
+        except (OSError, RuntimeError):
+            self.connected = False
+
+    async def send_frame(self, frame):
+        await self.send_text(json.dumps(frame, ensure_ascii=False, separators=_SEPARATORS))
+
+    async def error(self, text, message_id=None):
+        await self.send_frame({"type": "error", "id": message_id, "error": text})
+
+    async def handle(self, raw):
+        """
+        Handles one frame from the client.
+        """
+        if raw is None or len(raw) > MAX_FRAME_BYTES:
+            await self.error("Frame too large")
+            return
+        try:
+            frame = json.loads(raw)
+        except ValueError:
+            frame = None
+        if not isinstance(frame, dict):
+            await self.error("Invalid frame")
+            return
+
+        kind = frame.get("type")
+        if kind == "ping":
+            await self.send_text(_PONG)
+        elif kind == "hello":
+            session_id = frame.get("session_id") or DEFAULT_SESSION_ID
+            if not is_valid_session_id(session_id):
+                await self.error("Invalid session_id")
+                return
+            persona, error_text = resolve_persona(self.persona_name, frame.get("persona"))
+            if error_text:
+                await self.error(error_text)
+                return
+            self.persona = persona
+            self.session_id = session_id
+            await self.send_text(_READY)
+        elif kind == "message":
+            await self.start_reply(frame)
+        else:
+            await self.error("Unknown frame type")
+
+    async def start_reply(self, frame):
+        message_id = frame.get("id")
+        if self.session_id is None:
+            await self.error("Send hello first", message_id)
+            return
+
+        user_message, session_id, error_text = validate_chat_payload(
+            {"message": frame["message"], "session_id": self.session_id} if "message" in frame else None
+        )
+        if not error_text:
+            message_id, error_text = validate_idempotency_key(message_id)
+        if not error_text and len(self.replies) >= WS_MAX_PENDING_REPLIES:
+            error_text = "Too many messages at once"
+        if error_text:
+            await self.error(error_text, frame.get("id"))
+            return
+
+        # Its own task: pings and further messages keep being read meanwhile
+        task = asyncio.create_task(self.reply(user_message, session_id, message_id))
+        self.replies.add(task)
+        task.add_done_callback(self.replies.discard)
+
+    @tracing.traced("/ws")
+    async def reply(self, user_message, session_id, message_id):
+        started = time.perf_counter()
+        _stats["messages"] += 1
+        reply_pieces = None
+        try:
+            # Raises RateLimited / Overloaded, like /chat
+            rate_limiter.check(self.persona.session_key(session_id), self.ip)
+            reply_pieces, is_final_stage = await process_user_message_stream_async(
+                user_message, session_id, message_id, self.persona
+            )
+            preload = None if is_final_stage else reveal_preload(session_id, self.persona)
+            await self.send_frame({"type": "typing", "id": message_id})
+
+            # Read to the end even if the client is gone (see Resume above)
+            async for text in reply_pieces:
+                await self.send_frame({"type": "token", "id": message_id, "text": text})
+        except AdmissionError as error:
+            await self.send_frame({"type": "busy", "id": message_id, **admission_error_payload(error)[0]})
+            return
+        except Exception as error:
+            print("WebSocket reply failed:", error)
+            await self.error("Something went wrong", message_id)
+            return
+        finally:
+            if reply_pieces is not None:
+                # Not read to the end: duplicates stop waiting (see llm.py)
+                await reply_pieces.aclose()
+            metrics.REQUEST_SECONDS.labels("/ws").observe(time.perf_counter() - started)
+
+        if is_final_stage:
+            await self.send_text(final_frame(message_id, self.persona))
+        else:
+            await self.send_frame({"type": "done", "id": message_id, **done_payload(preload)})
+
+
+# -------------------------
+# ASGI handler
+# -------------------------
+
+async def serve(scope, receive, send, persona_name=None):
+    """
+    Runs one WebSocket connection until the client leaves or goes idle.
+    persona_name comes from the URL (/p/<persona>/ws).
+    """
+    message = await receive()
+    if message["type"] != "websocket.connect":
+        return
+    await send({"type": "websocket.accept"})
+
+    headers = dict(scope["headers"])
+    forwarded_for = headers.get(b"x-forwarded-for")
+    peer = scope.get("client") or (None,)
+    connection = ChatConnection(
+        send, client_ip(forwarded_for and forwarded_for.decode("latin-1"), peer[0]), persona_name
+    )
+
+    _stats["open"] += 1
+    try:
+        while True:
+            try:
+                message = await asyncio.wait_for(receive(), WS_IDLE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                if connection.connected:
+                    await send({"type": "websocket.close", "code": CLOSE_GOING_AWAY})
+                break
+
+            if message["type"] == "websocket.disconnect":
+                break
+            if message["type"] == "websocket.receive":
+                await connection.handle(message.get("text") or message.get("bytes"))
+    finally:
+        # Replies still being written finish on their own (and are stored)
+        connection.connected = False
+        _stats["open"] -= 1
+
+
+async def reject(send):
+    """
+    Refuses a WebSocket on any other path (the client sees HTTP 403).
+    """
+    await send({"type": "websocket.close", "code": CLOSE_POLICY_VIOLATION})
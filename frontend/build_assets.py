@@ -0,0 +1,274 @@
+"""
+build_assets.py
+
+Build step for the frontend media (~8 MB of GIFs and MP3s before this).
+
+What this script does:
+- GIFs   → animated WebP and MP4 (H.264), with the GIF kept as fallback.
+           index.html gets a <picture>: Safari picks the MP4, other
+           browsers the WebP, anything older the GIF
+- MP3s   → re-encoded mono at a voice / sound-effect bitrate
+- Every file gets a content hash in its name ("totoro.3f9a1c2b7d.webp"),
+  so it can be cached forever: a changed file is a new URL
+- Writes dist/asset-manifest.json (original name → built files), and
+  inlines it into dist/index.html as window.ASSET_MANIFEST for script.js
+- Writes dist/_headers (Netlify) with immutable caching for dist/assets/
+- Prints the byte totals before / after
+
+A variant is only kept when it is smaller than the original.
+
+Needs ffmpeg on PATH for transcoding (built with libwebp and libx264).
+Without it, files are still fingerprinted and copied, just not shrunk.
+
+Usage (from the repo root):
+
+    python frontend/build_assets.py [--out frontend/dist] [--ffmpeg ffmpeg]
+
+Then deploy frontend/dist/ instead of frontend/.
+"""
+
+# -------------------------
+# Imports
+# -------------------------
+import argparse
+import hashlib
+import html
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+FRONTEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Fingerprinted files go here, under the site root
+ASSETS_DIR = "assets"
+
+# Plain files that are copied and fingerprinted as they are
+STATIC_EXTENSIONS = {".css", ".js", ".webp", ".png", ".jpg", ".jpeg", ".svg"}
+
+# Sound effects and short voice clips don't need stereo 128 kbps.
+# Songs (the Shin-chan dance tracks) keep a bit more.
+AUDIO_BITRATES = {
+    "dhinchak.mp3": "96k",
+    "balle.mp3": "96k",
+}
+DEFAULT_AUDIO_BITRATE = "64k"
+
+# ffmpeg settings per output format
+GIF_TO_WEBP = ["-c:v", "libwebp", "-lossless", "0", "-q:v", "70", "-compression_level", "6", "-loop", "0", "-an"]
+GIF_TO_MP4 = [
+    "-c:v", "libx264", "-crf", "28", "-preset", "slow", "-pix_fmt", "yuv420p",
+    # H.264 needs even dimensions
+    "-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2",
+    "-movflags", "+faststart", "-an",
+]
+
+
+# -------------------------
+# Helpers
+# -------------------------
+
+def fingerprint(path, logical_name):
+    """
+    "shinchan dance.gif" + content → "shinchan-dance.1a2b3c4d5e.gif"
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            digest.update(block)
+    stem, ext = os.path.splitext(logical_name)
+    slug = re.sub(r"[^a-z0-9]+", "-", stem.lower()).strip("-")
+    return f"{slug}.{digest.hexdigest()[:10]}{ext}"
+
+
+def ffmpeg_available(ffmpeg):
+    return shutil.which(ffmpeg) is not None
+
+
+def transcode(ffmpeg, source, target, args):
+    """
+    Runs ffmpeg; True if `target` was written.
+    """
+    result = subprocess.run(
+        [ffmpeg, "-y", "-loglevel", "error", "-i", source, *args, target],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if result.returncode != 0:
+        print(f"  ffmpeg failed for {os.path.basename(target)}: {result.stderr.strip()[:200]}", file=sys.stderr)
+        return False
+    return os.path.exists(target)
+
+
+class Build:
+    def __init__(self, src_dir, out_dir, ffmpeg):
+        self.src_dir = src_dir
+        self.out_dir = out_dir
+        self.assets_dir = os.path.join(out_dir, ASSETS_DIR)
+        self.ffmpeg = ffmpeg if ffmpeg_available(ffmpeg) else None
+        self.work_dir = tempfile.mkdtemp(prefix="artybot-assets-")
+        self.manifest = {}
+        # (original name, original bytes, bytes a first visit downloads)
+        self.report = []
+
+    def emit(self, path, logical_name):
+        """
+        Copies `path` into dist/assets under its fingerprinted name.
+        Returns the URL path relative to the site root.
+        """
+        name = fingerprint(path, logical_name)
+        shutil.copyfile(path, os.path.join(self.assets_dir, name))
+        return f"{ASSETS_DIR}/{name}"
+
+    def variant(self, source, name, ext, args):
+        """
+        Transcodes `source` to a temp file; returns its path if it is
+        smaller than the source, else None.
+        """
+        if self.ffmpeg is None:
+            return None
+        target = os.path.join(self.work_dir, os.path.splitext(name)[0] + ext)
+        if not transcode(self.ffmpeg, source, target, args):
+            return None
+        if os.path.getsize(target) >= os.path.getsize(source):
+            return None
+        return target
+
+    def gif(self, name):
+        source = os.path.join(self.src_dir, name)
+        entry = {"src": self.emit(source, name), "type": "image/gif", "sources": []}
+        downloaded = os.path.getsize(source)
+
+        # Order matters in <picture>: the first supported source wins
+        for ext, mime, args in ((".mp4", "video/mp4", GIF_TO_MP4), (".webp", "image/webp", GIF_TO_WEBP)):
+            built = self.variant(source, name, ext, args)
+            if built is not None:
+                entry["sources"].append({"src": self.emit(built, os.path.splitext(name)[0] + ext), "type": mime})
+                downloaded = min(downloaded, os.path.getsize(built))
+
+        self.manifest[name] = entry
+        self.report.append((name, os.path.getsize(source), downloaded))
+
+    def audio(self, name):
+        source = os.path.join(self.src_dir, name)
+        bitrate = AUDIO_BITRATES.get(name, DEFAULT_AUDIO_BITRATE)
+        built = self.variant(source, name, ".mp3", ["-ac", "1", "-b:a", bitrate, "-map_metadata", "-1"])
+        chosen = built or source
+
+        self.manifest[name] = {"src": self.emit(chosen, name), "type": "audio/mpeg"}
+        self.report.append((name, os.path.getsize(source), os.path.getsize(chosen)))
+
+    def static(self, name):
+        source = os.path.join(self.src_dir, name)
+        self.manifest[name] = {"src": self.emit(source, name)}
+        self.report.append((name, os.path.getsize(source), os.path.getsize(source)))
+
+    # -------------------------
+    # index.html
+    # -------------------------
+
+    def picture(self, match):
+        """
+        <img src="x.gif" ...> → <picture><source ...><img src="assets/x.….gif" ...></picture>
+        """
+        tag, name = match.group(0), html.unescape(match.group(2))
+        entry = self.manifest.get(name)
+        if entry is None:
+            return tag
+        img = tag.replace(match.group(1), f'src="{entry["src"]}"', 1)
+        sources = "".join(
+            f'<source type="{source["type"]}" srcset="{source["src"]}">' for source in entry.get("sources", ())
+        )
+        return f"<picture>{sources}{img}</picture>" if sources else img
+
+    def index_html(self):
+        with open(os.path.join(self.src_dir, "index.html"), encoding="utf-8") as f:
+            page = f.read()
+
+        # Images: fingerprinted, with WebP / MP4 sources for the GIFs
+        page = re.sub(r'<img\b[^>]*?(src="([^"]+)")[^>]*>', self.picture, page)
+
+        # Stylesheet and script
+        def rewrite(match):
+            attribute, name = match.group(1), html.unescape(match.group(2))
+            entry = self.manifest.get(name)
+            return f'{attribute}="{entry["src"]}"' if entry else match.group(0)
+
+        page = re.sub(r'\b(href|src)="([^"]+\.(?:css|js))"', rewrite, page)
+
+        # script.js reads the manifest from here (see asset() in script.js)
+        inline = f"<script>window.ASSET_MANIFEST = {json.dumps(self.manifest, separators=(',', ':'))};</script>\n"
+        page = page.replace('<script src="', inline + '<script src="', 1)
+
+        with open(os.path.join(self.out_dir, "index.html"), "w", encoding="utf-8") as f:
+            f.write(page)
+
+    def headers_file(self):
+        with open(os.path.join(self.out_dir, "_headers"), "w", encoding="utf-8") as f:
+            f.write(
+                f"/{ASSETS_DIR}/*\n"
+                "  Cache-Control: public, max-age=31536000, immutable\n"
+                "/index.html\n"
+                "  Cache-Control: no-cache\n"
+            )
+
+    # -------------------------
+    # Whole build
+    # -------------------------
+
+    def run(self):
+        shutil.rmtree(self.out_dir, ignore_errors=True)
+        os.makedirs(self.assets_dir)
+
+        names = sorted(os.listdir(self.src_dir))
+        for name in names:
+            ext = os.path.splitext(name)[1].lower()
+            if ext == ".gif":
+                self.gif(name)
+            elif ext == ".mp3":
+                self.audio(name)
+            elif ext in STATIC_EXTENSIONS:
+                self.static(name)
+
+        # index.html is the only file that is NOT fingerprinted: it holds
+        # the manifest, and is what the browser revalidates on every visit
+        self.index_html()
+        self.headers_file()
+
+        with open(os.path.join(self.out_dir, "asset-manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=2, ensure_ascii=False)
+
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+def print_report(build):
+    before = sum(original for _, original, _ in build.report)
+    after = sum(downloaded for _, _, downloaded in build.report)
+    for name, original, downloaded in build.report:
+        change = f"{downloaded / original - 1:+.0%}" if original else ""
+        print(f"  {name:24} {original / 1024:9.1f} KB → {downloaded / 1024:9.1f} KB  {change}")
+    print(f"  {'total':24} {before / 1024:9.1f} KB → {after / 1024:9.1f} KB  {after / before - 1:+.0%}")
+    if build.ffmpeg is None:
+        print("  (ffmpeg not found: files were fingerprinted but not transcoded)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--src", default=FRONTEND_DIR)
+    parser.add_argument("--out", default=os.path.join(FRONTEND_DIR, "dist"))
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    args = parser.parse_args()
+
+    build = Build(args.src, args.out, args.ffmpeg)
+    build.run()
+    print(f"built {len(build.manifest)} assets into {args.out}")
+    print_report(build)
+
+
+if __name__ == "__main__":
+    main()
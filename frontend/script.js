@@ -1,14 +1,73 @@
-const sendSound = new Audio("send.mp3");
-const receiveSound = new Audio("receive.mp3");
-const heartPop = new Audio("pop.mp3");
-const dhinchak = new Audio("dhinchak.mp3");
-const balle = new Audio("balle.mp3");
-const totoro = new Audio("totoro sound.mp3")
+// Built file for an original asset name (see build_assets.py). The build
+// inlines window.ASSET_MANIFEST into index.html; unbuilt, names are used as is.
+function asset(name) {
+  const entry = window.ASSET_MANIFEST && window.ASSET_MANIFEST[name];
+  return entry ? entry.src : name;
+}
+
+const sendSound = new Audio(asset("send.mp3"));
+const receiveSound = new Audio(asset("receive.mp3"));
+const heartPop = new Audio(asset("pop.mp3"));
+const dhinchak = new Audio(asset("dhinchak.mp3"));
+const balle = new Audio(asset("balle.mp3"));
+const totoro = new Audio(asset("totoro sound.mp3"))
+
+// The songs are only played on click: don't download them up front
+dhinchak.preload = "none";
+balle.preload = "none";
+totoro.preload = "none";
+
+// One id per browser, so the backend can track this chat's stage separately
+const SESSION_KEY = "artybot_session_id";
+
+function newId() {
+  return crypto.randomUUID ? crypto.randomUUID() : String(Date.now()) + Math.random().toString(16).slice(2);
+}
+
+function getSessionId() {
+  let id = localStorage.getItem(SESSION_KEY);
+  if (!id) {
+    id = newId();
+    localStorage.setItem(SESSION_KEY, id);
+  }
+  return id;
+}
+
+
+const BACKEND_URL = "https://artybot-backend.onrender.com";
 
+// ?persona=<name> talks to another persona than the default one; the
+// backend keeps a separate conversation per persona for the same session
+const PERSONA = new URLSearchParams(window.location.search).get("persona");
+const API_BASE = PERSONA ? `${BACKEND_URL}/p/${encodeURIComponent(PERSONA)}` : BACKEND_URL;
+
+// When the backend says 429 / 503 ("slow down" / "busy"), wait as long as
+// it asks (plus a little jitter) and try again, a few times at most
+const MAX_BUSY_RETRIES = 3;
+const MAX_BUSY_WAIT_MS = 15000;
+
+class BusyError extends Error {
+  constructor(data) {
+    super(data && data.error ? data.error : "busy");
+    this.retryAfter = data && data.retry_after;
+  }
+
+  waitMs(attempt) {
+    const asked = Number(this.retryAfter) > 0 ? Number(this.retryAfter) * 1000 : 1000 * 2 ** attempt;
+    return Math.min(asked, MAX_BUSY_WAIT_MS) + Math.random() * 500;
+  }
+}
+
+function isBusy(res) {
+  return res.status === 429 || res.status === 503;
+}
+
+function sleep(ms) {
+  return new Promise(resolve => setTimeout(resolve, ms));
+}
 
 async function sendMessage() {
   const input = document.getElementById("userInput");
-  const chat = document.getElementById("chat");
   const text = input.value.trim();
 
   if (!text) return;
@@ -21,20 +80,369 @@ async function sendMessage() {
   // ✅ SHOW typing indicator
   document.getElementById("typing").style.display = "block";
 
-  const res = await fetch("https://artybot-backend.onrender.com/chat", {
+  const body = JSON.stringify({ message: text, session_id: getSessionId() });
+
+  // One key per typed message: if this message is sent again (the /chat
+  // fallback below, a retry), the backend replays the first reply instead
+  // of advancing the conversation twice
+  const headers = { "Content-Type": "application/json", "Idempotency-Key": newId() };
+
+  for (let attempt = 0; ; attempt++) {
+    try {
+      await deliverReply(text, body, headers);
+      return;
+    } catch (err) {
+      if (!(err instanceof BusyError)) throw err;
+      if (attempt >= MAX_BUSY_RETRIES) {
+        hideTyping();
+        addMessage("I'm a little overwhelmed right now 🥺 give me a minute and send that again?", "bot");
+        return;
+      }
+      // Typing indicator stays on while we back off
+      await sleep(err.waitMs(attempt));
+    }
+  }
+}
+
+async function deliverReply(text, body, headers) {
+  try {
+    await socketReply(text, headers["Idempotency-Key"]);
+    return;
+  } catch (err) {
+    if (err instanceof BusyError) throw err;
+    // No socket (app:app backend, blocked by a proxy, gave up) → HTTP
+  }
+
+  try {
+    await streamReply(body, headers);
+  } catch (err) {
+    if (err instanceof BusyError) throw err;
+
+    // Streaming not available (old backend, proxy trouble) → plain JSON route
+    const res = await fetch(`${API_BASE}/chat`, {
+      method: "POST",
+      headers,
+      body
+    });
+    const data = await res.json();
+    if (isBusy(res)) throw new BusyError(data);
+
+    hideTyping();
+    addMessage(data.reply, "bot");
+    if (data.is_final) showFinalReveal(data);
+    else preloadReveal(data.preload);
+  }
+}
+
+/* ✅ STREAMED REPLY: tokens are appended to the bubble as they arrive */
+async function streamReply(body, headers) {
+  const res = await fetch(`${API_BASE}/chat/stream`, {
     method: "POST",
-    headers: { "Content-Type": "application/json" },
-    body: JSON.stringify({ message: text })
+    headers,
+    body
   });
 
-  const data = await res.json();
+  if (isBusy(res)) throw new BusyError(await res.json().catch(() => null));
+  if (!res.ok || !res.body) throw new Error(`stream unavailable (${res.status})`);
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let bubble = null;
+
+  while (true) {
+    let chunk;
+    try {
+      chunk = await reader.read();
+    } catch (err) {
+      // Connection dropped mid-reply: keep what we have, don't re-send
+      break;
+    }
+    const { value, done } = chunk;
+    if (done) break;
+
+    buffer += decoder.decode(value, { stream: true });
+
+    // SSE frames are separated by a blank line
+    let boundary;
+    while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+
+      const event = parseSseFrame(frame);
+      if (!event) continue;
+
+      if (event.type === "token") {
+        if (!bubble) {
+          // First visible token: swap the typing indicator for the bubble
+          hideTyping();
+          bubble = addMessage("", "bot");
+        }
+        bubble.textContent += event.data.text;
+        scrollChat();
+      } else if (event.type === "final") {
+        showFinalReveal(event.data);
+      } else if (event.type === "done") {
+        preloadReveal(event.data.preload);
+      } else if (event.type === "busy") {
+        // Shed before any token was sent: back off and retry
+        throw new BusyError(event.data);
+      }
+    }
+  }
+
+  hideTyping();
+}
+
+function parseSseFrame(frame) {
+  let type = "message";
+  let data = "";
+  for (const line of frame.split("\n")) {
+    if (line.startsWith("event:")) type = line.slice(6).trim();
+    else if (line.startsWith("data:")) data += line.slice(5).trim();
+  }
+  return data ? { type, data: JSON.parse(data) } : null;
+}
+
+/* ✅ WEBSOCKET: one connection per chat instead of a POST (and a CORS
+   preflight) per message. A message's id is its Idempotency-Key, so after
+   a drop the same message is simply sent again: the backend replays the
+   reply instead of advancing the conversation. */
+const WS_URL = API_BASE.replace(/^http/, "ws") + "/ws";
+const WS_PING_MS = 20000;
+const WS_PONG_TIMEOUT_MS = 8000;
+const WS_MAX_BACKOFF_MS = 30000;
+const WS_GIVE_UP_AFTER = 4;     // failed connects in a row → POST only
+const WS_CONNECT_WAIT_MS = 1000; // a first message sent while still connecting
+const WS_RESUME_WAIT_MS = 3000; // how long a dropped reply waits for a reconnect
 
+class SocketDropped extends Error {}
+
+const chatSocket = {
+  ws: null,
+  ready: false,
+  failures: 0,
+  backoffMs: 1000,
+  pingTimer: null,
+  pongTimer: null,
+  waiters: [],
+  replies: new Map(),
+
+  usable() {
+    return "WebSocket" in window && this.failures < WS_GIVE_UP_AFTER;
+  },
+
+  connect() {
+    if (!this.usable() || this.ws) return;
+    const ws = new WebSocket(WS_URL);
+    this.ws = ws;
+    ws.onopen = () => ws.send(JSON.stringify({ type: "hello", session_id: getSessionId() }));
+    ws.onmessage = (e) => {
+      let frame;
+      try { frame = JSON.parse(e.data); } catch (err) { return; }
+      this.onFrame(frame);
+    };
+    ws.onclose = () => this.onClose(ws);
+  },
+
+  onFrame(frame) {
+    if (frame.type === "ready") {
+      this.ready = true;
+      this.failures = 0;
+      this.backoffMs = 1000;
+      this.startHeartbeat();
+      this.waiters.splice(0).forEach(resolve => resolve(true));
+    } else if (frame.type === "pong") {
+      clearTimeout(this.pongTimer);
+    } else {
+      const handler = this.replies.get(frame.id);
+      if (handler) handler(frame);
+    }
+  },
+
+  onClose(ws) {
+    if (this.ws !== ws) return;
+    if (!this.ready) this.failures++;
+    this.ws = null;
+    this.ready = false;
+    clearInterval(this.pingTimer);
+    clearTimeout(this.pongTimer);
+    this.waiters.splice(0).forEach(resolve => resolve(false));
+
+    // Replies in flight find out now, and decide whether to resend
+    for (const handler of this.replies.values()) handler({ type: "dropped" });
+
+    if (!this.usable()) return;
+    setTimeout(() => this.connect(), this.backoffMs + Math.random() * 500);
+    this.backoffMs = Math.min(this.backoffMs * 2, WS_MAX_BACKOFF_MS);
+  },
+
+  // Mobile networks drop idle connections silently: a ping that gets no
+  // pong means the socket is dead even if it still looks open
+  startHeartbeat() {
+    clearInterval(this.pingTimer);
+    const ws = this.ws;
+    this.pingTimer = setInterval(() => {
+      ws.send(JSON.stringify({ type: "ping" }));
+      clearTimeout(this.pongTimer);
+      this.pongTimer = setTimeout(() => {
+        ws.close();
+        this.onClose(ws);
+      }, WS_PONG_TIMEOUT_MS);
+    }, WS_PING_MS);
+  },
+
+  whenReady(ms) {
+    if (this.ready) return Promise.resolve(true);
+    if (!this.usable()) return Promise.resolve(false);
+    this.connect();
+    return new Promise(resolve => {
+      this.waiters.push(resolve);
+      setTimeout(() => resolve(this.ready), ms);
+    });
+  },
+
+  // Resolves on "done" / "final"; onFrame sees every frame of the reply
+  send(id, message, onFrame) {
+    return new Promise((resolve, reject) => {
+      this.replies.set(id, (frame) => {
+        if (frame.type === "dropped") {
+          this.replies.delete(id);
+          reject(new SocketDropped("connection lost"));
+          return;
+        }
+        onFrame(frame);
+        if (frame.type === "done" || frame.type === "final") {
+          this.replies.delete(id);
+          resolve();
+        } else if (frame.type === "busy" || frame.type === "error") {
+          this.replies.delete(id);
+          reject(frame.type === "busy" ? new BusyError(frame) : new Error(frame.error));
+        }
+      });
+      this.ws.send(JSON.stringify({ type: "message", id, message }));
+    });
+  }
+};
+
+async function socketReply(text, id) {
+  let bubble = null;
+  const onFrame = (frame) => {
+    if (frame.type === "token") {
+      if (!bubble) {
+        hideTyping();
+        bubble = addMessage("", "bot");
+      }
+      bubble.textContent += frame.text;
+      scrollChat();
+    } else if (frame.type === "done") {
+      preloadReveal(frame.preload);
+    } else if (frame.type === "final") {
+      showFinalReveal(frame);
+    }
+  };
+
+  for (let attempt = 0; ; attempt++) {
+    if (!(await chatSocket.whenReady(attempt ? WS_RESUME_WAIT_MS : WS_CONNECT_WAIT_MS))) {
+      if (bubble) bubble.remove();
+      throw new SocketDropped("no connection");
+    }
+    try {
+      await chatSocket.send(id, text, onFrame);
+      hideTyping();
+      return;
+    } catch (err) {
+      if (!(err instanceof SocketDropped) || attempt > 0) {
+        if (bubble) bubble.remove();
+        throw err;
+      }
+      // The replay starts from the first token again
+      if (bubble) bubble.textContent = "";
+    }
+  }
+}
+
+function hideTyping() {
   // ✅ HIDE typing indicator
-  document.getElementById("typing").style.display = "none";
+  const typing = document.getElementById("typing");
+  if (typing.style.display === "none") return;
+  typing.style.display = "none";
 
   receiveSound.currentTime = 0;
   receiveSound.play();
-  addMessage(data.reply, "bot");
+}
+
+function scrollChat() {
+  const chat = document.getElementById("chat");
+  chat.scrollTop = chat.scrollHeight;
+}
+
+/* ✅ FINAL REVEAL PHOTO: the backend sends "preload" with the last replies
+   before the reveal. The photo element is built right then (the browser
+   starts downloading it, off-screen) and shown as is at the reveal. */
+let revealPhoto = null;
+
+function preloadReveal(preload) {
+  if (!preload || revealPhoto) return;
+  revealPhoto = buildRevealPhoto(preload);
+}
+
+// <picture> with AVIF / WebP / JPEG sources, so the browser downloads one
+// format at the width it needs; a plain <img> for an old backend
+function buildRevealPhoto(data) {
+  const img = document.createElement("img");
+  img.alt = "For you 💗";
+  img.decoding = "async";
+
+  const photo = data.photo;
+  if (!photo) {
+    img.src = `${BACKEND_URL}${data.photo_url}`;
+    return img;
+  }
+
+  const picture = document.createElement("picture");
+  const srcset = (candidates) => candidates.map(([url, width]) => `${BACKEND_URL}${url} ${width}w`).join(", ");
+  for (const source of photo.sources) {
+    const el = document.createElement("source");
+    el.type = source.type;
+    el.srcset = srcset(source.srcset);
+    el.sizes = photo.sizes;
+    picture.appendChild(el);
+  }
+
+  // Reserves the photo's space, so the chat doesn't jump when it arrives
+  img.width = photo.width;
+  img.height = photo.height;
+
+  // Tiny blurred copy (inline, no request) until the real photo is in
+  if (photo.placeholder) {
+    img.style.backgroundImage = `url("${photo.placeholder}")`;
+    img.addEventListener("load", () => { img.style.backgroundImage = ""; }, { once: true });
+  }
+
+  // src last: the sources have to be in place when the load starts
+  img.sizes = photo.sizes;
+  img.src = `${BACKEND_URL}${photo.src}`;
+  picture.appendChild(img);
+  return picture;
+}
+
+/* ✅ FINAL REVEAL: photo + handwritten note */
+function showFinalReveal(data) {
+  const chat = document.getElementById("chat");
+  const div = document.createElement("div");
+  div.className = "message bot final-reveal";
+
+  const photo = revealPhoto || buildRevealPhoto(data);
+  revealPhoto = null;
+
+  const note = document.createElement("p");
+  note.textContent = data.note.trim();
+
+  div.appendChild(photo);
+  div.appendChild(note);
+  chat.appendChild(div);
+  scrollChat();
 }
 
 function addMessage(text, type) {
@@ -44,12 +452,16 @@ function addMessage(text, type) {
   div.textContent = text;
   chat.appendChild(div);
   chat.scrollTop = chat.scrollHeight;
+  return div;
 }
 
 function enterChat() {
   document.getElementById("landing").style.display = "none";
   document.getElementById("chatPage").style.display = "flex";
   addMessage("Hi Boo! Wanna talk? 🐰", "bot");
+
+  // Opened now, so it is ready by the first message
+  chatSocket.connect();
 }
 
 /* ✅ ENTER KEY SENDS MESSAGE */